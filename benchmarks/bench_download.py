@@ -0,0 +1,218 @@
+"""
+Model download benchmark: parallel range requests against a local HTTP
+stand-in that limits the bandwidth per connection, like most CDNs do.
+"""
+import hashlib
+import os
+import re
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from chatshell.model_download import DownloadError, ModelDownloader, file_sha256
+
+from common import benchmark, check, result_entry
+
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+def write_fake_gguf(path, size):
+    """
+    File with a GGUF header and pseudo-random content of the given size.
+    """
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return
+    header = b"GGUF" + struct.pack("<IQQ", 3, 0, 0)
+    block = hashlib.sha256(b"chatshell").digest() * 2048
+    with open(path, "wb") as f:
+        f.write(header)
+        written = len(header)
+        while written < size:
+            data = block[:size - written]
+            f.write(data)
+            written += len(data)
+
+
+class RangeFileServer:
+    """
+    Serves one file with range support, ETag and X-Linked-Etag (SHA-256, like
+    Hugging Face). Every connection is limited to bytes_per_second. The first
+    fail_requests range responses are cut off after fail_after_bytes, the first
+    empty_requests range responses have no body. Without ranges, Range headers
+    are ignored.
+    """
+
+    def __init__(self, path, bytes_per_second=16 * 2**20):
+        self.path               = path
+        self.size               = os.path.getsize(path)
+        self.bytes_per_second   = bytes_per_second
+        self.fail_requests      = 0
+        self.fail_after_bytes   = 0
+        self.empty_requests     = 0
+        self.ranges             = True
+        self.requests           = 0
+        self.bytes_sent         = 0
+        self.lock               = threading.Lock()
+
+        self.sha256             = file_sha256(path)
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                start, end, status = 0, server.size - 1, 200
+                match = RANGE_PATTERN.match(self.headers.get("Range", ""))
+                if match and server.ranges:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)) if match.group(2) else server.size - 1, server.size - 1)
+                    status = 206
+
+                with server.lock:
+                    server.requests += 1
+                    cut_off = status == 206 and end > start and server.fail_requests > 0
+                    if cut_off:
+                        server.fail_requests -= 1
+                    empty = status == 206 and end > start and not cut_off and server.empty_requests > 0
+                    if empty:
+                        server.empty_requests -= 1
+
+                self.send_response(status)
+                self.send_header("Content-Length", "0" if empty else str(end - start + 1))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", f'"{server.sha256[:16]}"')
+                self.send_header("X-Linked-Etag", f'"{server.sha256}"')
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{server.size}")
+                self.end_headers()
+
+                limit = server.fail_after_bytes if cut_off else 0 if empty else end - start + 1
+                t_start = time.perf_counter()
+                sent = 0
+                with open(server.path, "rb") as f:
+                    f.seek(start)
+                    while sent < limit:
+                        data = f.read(min(64 * 1024, limit - sent))
+                        try:
+                            self.wfile.write(data)
+                        except (BrokenPipeError, ConnectionResetError):
+                            return
+                        sent += len(data)
+                        with server.lock:
+                            server.bytes_sent += len(data)
+                        # Bandwidth limit of this connection
+                        delay = sent / server.bytes_per_second - (time.perf_counter() - t_start)
+                        if delay > 0:
+                            time.sleep(delay)
+                if cut_off:
+                    self.close_connection = True
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/model.gguf"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _remove_download(dest):
+    for suffix in ("", ".part", ".part.json"):
+        if os.path.exists(dest + suffix):
+            os.remove(dest + suffix)
+
+
+@benchmark("model_download")
+def bench_model_download(ctx):
+    size = (32 if ctx.quick else 128) * 2**20
+    source = str(ctx.fixture_dir / "download_source.gguf")
+    dest = str(ctx.fixture_dir / "download_target.gguf")
+    write_fake_gguf(source, size)
+
+    results = []
+    with RangeFileServer(source) as server:
+        for parts in (1, 4, 8):
+            timings = []
+            for _ in range(ctx.repeat):
+                _remove_download(dest)
+                downloader = ModelDownloader(parts=parts, min_part_size=2**20)
+                t_start = time.perf_counter()
+                downloader.download(server.url, dest, progress=lambda *args: None)
+                timings.append(time.perf_counter() - t_start)
+            best = min(timings)
+            results.append(result_entry(
+                {"parts": parts, "size_mb": size / 2**20, "connection_mb_s": server.bytes_per_second / 2**20},
+                {"seconds": best, "throughput_mb_s": size / 2**20 / best}
+            ))
+
+        # Interrupted download (connections cut after 1.5 MiB), then resumed
+        _remove_download(dest)
+        server.fail_requests, server.fail_after_bytes = 8, 3 * 2**19
+        try:
+            ModelDownloader(parts=8, min_part_size=2**20, retries=0).download(server.url, dest, progress=lambda *args: None)
+            check(False, "Interrupted download did not fail")
+        except DownloadError:
+            pass
+        server.fail_requests = 0
+        check(not os.path.exists(dest), "Interrupted download was moved to its final name")
+        check(os.path.exists(dest + ".part") and os.path.exists(dest + ".part.json"), "Interrupted download left no resumable state")
+        sent_before = server.bytes_sent
+        t_start = time.perf_counter()
+        ModelDownloader(parts=8, min_part_size=2**20).download(server.url, dest, progress=lambda *args: None)
+        resumed_s = time.perf_counter() - t_start
+        refetched_share = (server.bytes_sent - sent_before) / size
+        verified = file_sha256(dest) == server.sha256
+        check(verified, "Resumed download has the wrong SHA-256")
+        check(refetched_share < 1.0 - 8 * server.fail_after_bytes / size / 2, f"Resumed download fetched {refetched_share:.0%} of the file again")
+        check(not os.path.exists(dest + ".part") and not os.path.exists(dest + ".part.json"), "Resumed download left its state behind")
+        results.append(result_entry(
+            {"parts": 8, "size_mb": size / 2**20, "resume": True},
+            {"seconds": resumed_s, "refetched_share": refetched_share, "verified": verified}
+        ))
+        _remove_download(dest)
+
+        # Wrong SHA-256: the partial file is discarded, nothing is moved to the final name
+        try:
+            ModelDownloader(parts=8, min_part_size=2**20).download(server.url, dest, sha256="0" * 64, progress=lambda *args: None)
+            check(False, "Download with a wrong SHA-256 did not fail")
+        except DownloadError:
+            pass
+        check(not any(os.path.exists(dest + suffix) for suffix in ("", ".part", ".part.json")), "Download with a wrong SHA-256 left files behind")
+
+        # Empty range responses count as failed attempts instead of being retried forever
+        server.empty_requests = 10**6
+        t_start = time.perf_counter()
+        try:
+            ModelDownloader(parts=8, min_part_size=2**20, retries=1).download(server.url, dest, progress=lambda *args: None)
+            check(False, "Download with empty range responses did not fail")
+        except DownloadError:
+            pass
+        server.empty_requests = 0
+        check(time.perf_counter() - t_start < 30.0, "Download with empty range responses did not give up")
+        _remove_download(dest)
+
+        # Server without range support: one plain GET after the probe
+        server.ranges = False
+        requests_before = server.requests
+        t_start = time.perf_counter()
+        ModelDownloader(parts=8, min_part_size=2**20).download(server.url, dest, progress=lambda *args: None)
+        single_s = time.perf_counter() - t_start
+        server.ranges = True
+        verified = file_sha256(dest) == server.sha256
+        check(verified, "Download without range support has the wrong SHA-256")
+        check(server.requests - requests_before == 2, f"Download without range support sent {server.requests - requests_before} requests")
+        results.append(result_entry(
+            {"parts": 8, "size_mb": size / 2**20, "ranges": False},
+            {"seconds": single_s, "throughput_mb_s": size / 2**20 / single_s, "verified": verified}
+        ))
+        _remove_download(dest)
+
+    return results
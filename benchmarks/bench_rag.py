@@ -0,0 +1,576 @@
+"""
+Benchmarks for the RAG pipeline: chunking, embedding and the embedding backends, hnswlib index build/query,
+chunk store memory and lookups, search_knn end to end, PDF text extraction
+and ingestion, HTML main content extraction, deduplication of crawled pages,
+incremental folder indexing, collection switching and extractive summarization.
+"""
+import random
+import shutil
+import socket
+import threading
+import time
+import tracemalloc
+
+from common import benchmark, check, measure, percentiles, result_entry, timing_stats
+from fixtures import synthetic_crawl, synthetic_sentences, synthetic_text, uneven_article_html
+
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+FAKE_EMBEDDING_MODEL = "fake-embedding-model.gguf"
+
+
+def _embedding_model(ctx):
+    from light_embed import TextEmbedding
+    return ctx.shared("embedding_model", lambda: TextEmbedding(EMBEDDING_MODEL_NAME))
+
+
+def _chunker(embedding_model=None):
+    from chatshell.chunker import Chunker, TokenCounter
+
+    # Default parameters as used in ChatshellVectorsearch
+    return Chunker(TokenCounter.for_model(embedding_model))
+
+
+def _langchain_splitter():
+    # Character based splitter used before the token based chunker, for comparison
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        return None
+    return RecursiveCharacterTextSplitter(
+        chunk_size=500,
+        chunk_overlap=50,
+        separators=["\n\n", "\n", ".", " ", ""]
+    )
+
+
+def _corpus_text(ctx, n_chars):
+    path = ctx.corpus["text"].get(n_chars)
+    if path is not None:
+        return path.read_text(encoding="utf-8")
+    return synthetic_text(n_chars)
+
+
+def _text_sizes(ctx):
+    sizes = sorted(ctx.corpus["text"].keys())
+    return sizes[:2] if ctx.quick else sizes
+
+
+@benchmark("chunking")
+def bench_chunking(ctx):
+    from chatshell.chunker import TokenCounter
+
+    model = _embedding_model(ctx)
+    # Exact chunk sizes in tokens of the embedding model (with special tokens)
+    token_counter = TokenCounter.for_model(model)
+    max_tokens = token_counter.model_max_length
+
+    splitters = {"chunker": _chunker(model).split_text}
+    langchain_splitter = _langchain_splitter()
+    if langchain_splitter is not None:
+        splitters["langchain_recursive"] = langchain_splitter.split_text
+
+    results = []
+    for n_chars in _text_sizes(ctx):
+        text = _corpus_text(ctx, n_chars)
+        for name, split_text in splitters.items():
+            timings, chunks = measure(lambda: split_text(text), repeat=ctx.repeat)
+            stats = timing_stats(timings)
+            stats["chunks"] = len(chunks)
+            stats["mb_per_s"] = len(text.encode("utf-8")) / 1e6 / stats["median_s"]
+
+            tokens = [token_counter.count(chunk) + token_counter.special_tokens for chunk in chunks]
+            stats["tokens_min"] = min(tokens)
+            stats["tokens_mean"] = sum(tokens) / len(tokens)
+            stats["tokens_max"] = max(tokens)
+            # Chunks the embedding model truncates
+            stats["over_model_limit"] = sum(count > max_tokens for count in tokens) if max_tokens else 0
+            results.append(result_entry({"splitter": name, "chars": n_chars}, stats))
+
+    return results
+
+
+@benchmark("embedding")
+def bench_embedding(ctx):
+    model = _embedding_model(ctx)
+    chunks = _chunker(model).split_text(_corpus_text(ctx, max(ctx.corpus["text"].keys())))
+
+    results = []
+    for n_chunks in ([32, 128] if ctx.quick else [32, 128, 512, 2048]):
+        batch = (chunks * (n_chunks // max(len(chunks), 1) + 1))[:n_chunks]
+        timings, _ = measure(lambda: model.encode(batch, normalize_embeddings=True), repeat=ctx.repeat)
+        stats = timing_stats(timings)
+        stats["chunks_per_s"] = n_chunks / stats["median_s"]
+        results.append(result_entry({"model": EMBEDDING_MODEL_NAME, "chunks": n_chunks}, stats))
+
+    return results
+
+
+class _FakeEmbeddingServer:
+    """
+    fake_llama_server in a thread, for the llama-server embedding backend
+    without a model (measures the HTTP and JSON overhead of the backend).
+    """
+
+    def __init__(self, dim):
+        import uvicorn
+        from fake_llama_server import create_app
+
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}/v1"
+        app = create_app(50.0, 0.0, 16, FAKE_EMBEDDING_MODEL, embedding_dim=dim)
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.sock]}, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *args):
+        self.server.should_exit = True
+        self.thread.join()
+        self.sock.close()
+
+
+@benchmark("embedding_backends")
+def bench_embedding_backends(ctx):
+    from chatshell.embeddings import LlamaServerBackend, MatryoshkaBackend
+    from chatshell.shared_index import MatrixIndex
+
+    base = _vectorsearch(ctx).embedding_model
+    chunks = _chunker(base).split_text(_corpus_text(ctx, max(ctx.corpus["text"].keys())))
+    n_chunks = 128 if ctx.quick else 512
+    batch = (chunks * (n_chunks // max(len(chunks), 1) + 1))[:n_chunks]
+    queries = _random_unit_vectors(50, base.dim, seed=7)
+    n_items = 20_000
+
+    with _FakeEmbeddingServer(base.dim) as fake_server:
+        backends = {
+            "light_embed": base,
+            "light_embed_matryoshka_256": MatryoshkaBackend(base, 256),
+            "light_embed_matryoshka_128": MatryoshkaBackend(base, 128),
+            "llama_server_fake": LlamaServerBackend(fake_server.url, FAKE_EMBEDDING_MODEL),
+        }
+        if ctx.embedding_url:
+            backends["llama_server"] = LlamaServerBackend(ctx.embedding_url)
+
+        results = []
+        for name, backend in backends.items():
+            timings, embeddings = measure(lambda: backend.encode(batch, normalize_embeddings=True), repeat=ctx.repeat)
+            stats = timing_stats(timings)
+            stats["chunks_per_s"] = n_chunks / stats["median_s"]
+            stats["dim"] = int(embeddings.shape[1])
+
+            # Exact search over a corpus of this dimension (memory-mapped indexes of the proxy workers)
+            index = MatrixIndex(_random_unit_vectors(n_items, stats["dim"], seed=n_items))
+            search_timings, _ = measure(lambda: [index.knn_query(query[:stats["dim"]], k=10) for query in queries], repeat=ctx.repeat)
+            stats["exact_search_ms"] = min(search_timings) * 1000.0 / len(queries)
+            stats["index_mb"] = n_items * stats["dim"] * 4 / 2**20
+            results.append(result_entry({"backend": name, "model_id": backend.model_id, "chunks": n_chunks, "index_items": n_items}, stats))
+
+    return results
+
+
+def _random_unit_vectors(n, dim, seed):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+@benchmark("hnsw")
+def bench_hnsw(ctx):
+    import hnswlib
+    import numpy as np
+
+    results = []
+    k = 10
+    n_queries = 200
+
+    for n_items in ([1000, 5000] if ctx.quick else [1000, 10000, 50000]):
+        data = _random_unit_vectors(n_items, EMBEDDING_DIM, seed=n_items)
+        queries = _random_unit_vectors(n_queries, EMBEDDING_DIM, seed=n_items + 1)
+
+        def build():
+            index = hnswlib.Index(space='cosine', dim=EMBEDDING_DIM)
+            index.init_index(max_elements=n_items, ef_construction=200, M=48)
+            index.add_items(data)
+            index.set_ef(50)
+            return index
+
+        build_timings, index = measure(build, repeat=1 if n_items > 10000 else ctx.repeat, warmup=0)
+
+        query_latencies = []
+        found = []
+        for query in queries:
+            t_start = time.perf_counter()
+            labels, _ = index.knn_query(query, k=k)
+            query_latencies.append((time.perf_counter() - t_start) * 1000.0)
+            found.append(labels[0])
+
+        # Recall against exact brute force search
+        exact = np.argsort(-(queries @ data.T), axis=1)[:, :k]
+        recall = float(np.mean([len(set(found[i]) & set(exact[i])) / k for i in range(n_queries)]))
+
+        metrics = {
+            "build": timing_stats(build_timings),
+            "query_latency_ms": percentiles(query_latencies),
+            "queries_per_s": n_queries / (sum(query_latencies) / 1000.0),
+            "recall_at_10": recall,
+        }
+        results.append(result_entry({"items": n_items, "dim": EMBEDDING_DIM, "M": 48, "ef": 50}, metrics))
+
+    return results
+
+
+def _traced_memory(build):
+    # Bytes allocated by build() that are still alive afterwards, and its result
+    tracemalloc.start()
+    try:
+        result = build()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current, result
+
+
+@benchmark("chunk_store")
+def bench_chunk_store(ctx):
+    from chatshell.chunk_store import ChunkStore
+
+    base_chunks = _chunker().split_text(_corpus_text(ctx, max(ctx.corpus["text"].keys())))
+    results = []
+
+    for n_chunks in ([10000] if ctx.quick else [10000, 100000]):
+        chunks = (base_chunks * (n_chunks // len(base_chunks) + 1))[:n_chunks]
+        # 20 chunks per page of 50 page documents
+        pages = [(f"document_{i // 1000}.pdf", (i // 20) % 50) for i in range(n_chunks)]
+
+        def build_lists():
+            # Previous layout: list of texts and one metadata dict per chunk
+            texts = [chunk.encode("utf-8").decode("utf-8") for chunk in chunks]
+            metadata = [{"source_info": f"{source}", "source_position": page} for source, page in pages]
+            return texts, metadata
+
+        def build_store():
+            store = ChunkStore()
+            for chunk, (source, page) in zip(chunks, pages):
+                store.add(chunk, source, page)
+            return store
+
+        list_bytes, (texts, metadata) = _traced_memory(build_lists)
+        store_bytes, store = _traced_memory(build_store)
+
+        lookups = random.Random(n_chunks).choices(range(n_chunks), k=10000)
+
+        def lookup_lists():
+            for i in lookups:
+                meta = metadata[i] if len(metadata) > i else {}
+                texts[i], meta.get("source_info"), meta.get("source_position")
+
+        def lookup_store():
+            for i in lookups:
+                store.text(i), store.metadata(i)
+
+        list_timings, _ = measure(lookup_lists, repeat=ctx.repeat)
+        store_timings, _ = measure(lookup_store, repeat=ctx.repeat)
+        text_bytes = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+
+        for layout, memory, timings in (("lists", list_bytes, list_timings), ("chunk_store", store_bytes, store_timings)):
+            metrics = {
+                "memory_mb": memory / 2**20,
+                "bytes_per_text_byte": memory / text_bytes,
+                "lookups_per_s": len(lookups) / timing_stats(timings)["median_s"],
+            }
+            results.append(result_entry({"layout": layout, "chunks": n_chunks}, metrics))
+
+    return results
+
+
+def _vectorsearch(ctx):
+    from chatshell.vectorstore import ChatshellVectorsearch
+    return ctx.shared("vectorsearch", ChatshellVectorsearch)
+
+
+@benchmark("search_knn")
+def bench_search_knn(ctx):
+    vectorsearch = _vectorsearch(ctx)
+    queries = synthetic_sentences(50, seed=99)
+    results = []
+
+    for n_chars in _text_sizes(ctx):
+        text = _corpus_text(ctx, n_chars)
+
+        t_start = time.perf_counter()
+        vectorsearch.index_vectorstore(text)
+        index_time = time.perf_counter() - t_start
+
+        latencies = []
+        for query in queries:
+            t_start = time.perf_counter()
+            vectorsearch.search_knn(query, num_chunks=10)
+            latencies.append((time.perf_counter() - t_start) * 1000.0)
+
+        metrics = {
+            "index_time_s": index_time,
+            "chunks": len(vectorsearch.chunk_store),
+            "query_latency_ms": percentiles(latencies),
+            "queries_per_s": len(queries) / (sum(latencies) / 1000.0),
+        }
+        results.append(result_entry({"chars": n_chars, "num_chunks": 10}, metrics))
+
+    return results
+
+
+@benchmark("summarization")
+def bench_summarization(ctx):
+    vectorsearch = _vectorsearch(ctx)
+    results = []
+
+    for n_sentences in ([50, 200] if ctx.quick else [50, 200, 800]):
+        # Documents are passed as a list of page texts like in /summarize
+        sentences = synthetic_sentences(n_sentences, seed=n_sentences)
+        pages = [" ".join(sentences[i:i + 40]) for i in range(0, n_sentences, 40)]
+
+        timings, _ = measure(lambda: vectorsearch.generate_text_summary(pages), repeat=ctx.repeat, warmup=0)
+        stats = timing_stats(timings)
+        stats["sentences_per_s"] = n_sentences / stats["median_s"]
+        results.append(result_entry({"sentences": n_sentences, "pages": len(pages)}, stats))
+
+    return results
+
+
+@benchmark("pdf_extraction")
+def bench_pdf_extraction(ctx):
+    from chatshell.pdf_extract import PDF_BACKENDS, PdfExtractor, backend_available
+
+    results = []
+    page_counts = sorted(ctx.corpus["pdf"].keys())
+    for backend in PDF_BACKENDS:
+        if not backend_available(backend):
+            print(f"--> PDF backend {backend} is not installed, skipped.")
+            continue
+
+        for n_pages in (page_counts[:2] if ctx.quick else page_counts):
+            path = str(ctx.corpus["pdf"][n_pages])
+            cache_dir = ctx.fixture_dir / f"pdf_cache_{backend}"
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            extractor = PdfExtractor(backend, cache_dir=cache_dir)
+
+            timings, pages = measure(lambda: extractor.extract(path), repeat=ctx.repeat)
+            # First call fills the cache, the measured ones read it
+            extractor.page_texts(path)
+            cached_timings, _ = measure(lambda: extractor.page_texts(path), repeat=ctx.repeat, warmup=0)
+
+            stats = timing_stats(timings)
+            stats["pages_per_s"] = n_pages / stats["median_s"]
+            stats["cached_pages_per_s"] = n_pages / min(cached_timings)
+            stats["chars"] = sum(len(text) for text in pages)
+            results.append(result_entry({"backend": backend, "pages": n_pages}, stats))
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return results
+
+
+def _legacy_html_extraction(html):
+    # Main content selection of crawl_website before the lxml extractor
+    from bs4 import BeautifulSoup
+    from markdownify import markdownify as md
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for script in soup(['script', 'style']):
+        script.decompose()
+    max_text_length = 0
+    main_content = ""
+    for tag in soup.find_all(['article', 'div', 'main', 'p']):
+        text_length = len(tag.get_text())
+        if text_length > max_text_length:
+            max_text_length = text_length
+            main_content = tag
+    output = md(str(main_content), keep_inline_images_in=['td', 'th', 'a', 'figure'], strip=['a'])
+    return output.replace('\n', '').replace('\t', '').strip()
+
+
+@benchmark("html_extraction")
+def bench_html_extraction(ctx):
+    from chatshell.html_extract import extract_main_content
+
+    extractors = {"lxml_density": extract_main_content}
+    try:
+        import bs4, markdownify  # noqa: F401
+        extractors["bs4_get_text"] = _legacy_html_extraction
+    except ImportError:
+        print("--> beautifulsoup4 or markdownify is not installed, previous extraction skipped.")
+
+    results = []
+    paragraph_counts = sorted(ctx.corpus["html"].keys())
+    for n_paragraphs in (paragraph_counts[:2] if ctx.quick else paragraph_counts):
+        html = ctx.corpus["html"][n_paragraphs].read_text(encoding="utf-8")
+        for name, extract in extractors.items():
+            timings, content = measure(lambda: extract(html), repeat=ctx.repeat)
+            stats = timing_stats(timings)
+            stats["ms_per_page"] = stats["median_s"] * 1000.0
+            stats["html_kb"] = len(html.encode("utf-8")) / 1024
+            stats["content_chars"] = len(content)
+            stats["content_lines"] = content.count("\n") + 1
+            results.append(result_entry({"extractor": name, "paragraphs": n_paragraphs}, stats))
+
+        # The article of paragraphs is extracted, not its navigation or teasers
+        content = extract_main_content(html)
+        check("Navigation entry" not in content, f"Navigation extracted with the main content ({n_paragraphs} paragraphs)")
+
+    # Regression: the main content must not shrink to the longest paragraph of an article
+    html, article_texts = uneven_article_html()
+    content = extract_main_content(html)
+    missing = [text for text in article_texts if text not in content]
+    check(not missing, f"Main content of an article with uneven paragraphs misses {missing}")
+    check("Navigation entry" not in content, "Navigation extracted with the main content of an article with uneven paragraphs")
+
+    return results
+
+
+@benchmark("dedup")
+def bench_dedup(ctx):
+    from chatshell.dedup import Deduplicator
+    from chatshell.vectorstore import ChatshellVectorsearch
+
+    base = _vectorsearch(ctx)
+    results = []
+
+    for n_pages in ([50] if ctx.quick else [50, 200]):
+        pages = synthetic_crawl(n_pages)
+        for dedup in (False, True):
+            def ingest():
+                # Web ingestion without the crawl: split, deduplicate and embed
+                vectorsearch = ChatshellVectorsearch(embedding_model=base.embedding_model, chunker=base.chunker, dedup=dedup)
+                deduplicator = Deduplicator() if dedup else None
+                chunks, _ = vectorsearch.add_pages(pages, deduplicator)
+                vectorsearch.embed_chunks(chunks)
+                return vectorsearch, deduplicator
+
+            def split():
+                vectorsearch = ChatshellVectorsearch(embedding_model=base.embedding_model, chunker=base.chunker, dedup=dedup)
+                return vectorsearch.add_pages(pages, Deduplicator() if dedup else None)
+
+            timings, (vectorsearch, deduplicator) = measure(ingest, repeat=ctx.repeat)
+            split_timings, (chunks, _) = measure(split, repeat=ctx.repeat)
+            stats = timing_stats(timings)
+            stats["pages_per_s"] = n_pages / stats["median_s"]
+            stats["split_ms"] = min(split_timings) * 1000.0
+            stats["chunks_embedded"] = len(chunks)
+            stats["duplicate_pages"] = deduplicator.duplicate_pages if deduplicator else 0
+            stats["duplicate_chunks"] = deduplicator.duplicate_chunks if deduplicator else 0
+            stats["multi_source_chunks"] = sum(len(vectorsearch.chunk_store.all_sources(i)) > 1 for i in range(len(vectorsearch.chunk_store)))
+            results.append(result_entry({"pages": n_pages, "dedup": dedup}, stats))
+
+    return results
+
+
+@benchmark("pdf_ingestion")
+def bench_pdf_ingestion(ctx):
+    vectorsearch = _vectorsearch(ctx)
+    results = []
+
+    page_counts = sorted(ctx.corpus["pdf"].keys())
+    for n_pages in (page_counts[:2] if ctx.quick else page_counts):
+        path = str(ctx.corpus["pdf"][n_pages])
+
+        timings, _ = measure(lambda: vectorsearch.init_vectorstore_pdf([path]), repeat=1, warmup=0)
+        stats = timing_stats(timings)
+        stats["chunks"] = len(vectorsearch.chunk_store)
+        stats["pages_per_s"] = n_pages / stats["median_s"]
+        results.append(result_entry({"pages": n_pages}, stats))
+
+    return results
+
+
+@benchmark("folder_index")
+def bench_folder_index(ctx):
+    from chatshell.folder_index import FolderIndex
+    from chatshell.vectorstore import ChatshellVectorsearch
+
+    embedding_model = _vectorsearch(ctx).embedding_model
+    results = []
+
+    for n_files in ([20] if ctx.quick else [20, 100]):
+        doc_dir = ctx.fixture_dir / f"folder_{n_files}"
+        index_dir = ctx.fixture_dir / f"folder_{n_files}_index"
+        shutil.rmtree(doc_dir, ignore_errors=True)
+        shutil.rmtree(index_dir, ignore_errors=True)
+        doc_dir.mkdir(parents=True)
+        for i in range(n_files):
+            (doc_dir / f"doc_{i}.txt").write_text(synthetic_text(20_000, seed=i), encoding="utf-8")
+
+        def sync():
+            folder_index = FolderIndex(ChatshellVectorsearch(embedding_model=embedding_model), doc_dir, index_dir)
+            folder_index.load()
+            return folder_index.sync()
+
+        # Full build, then a restart without changes and a restart with one changed file
+        build_timings, _ = measure(sync, repeat=1, warmup=0)
+        rescan_timings, _ = measure(sync, repeat=ctx.repeat, warmup=0)
+        with open(doc_dir / "doc_0.txt", "a", encoding="utf-8") as f:
+            f.write(synthetic_text(2_000, seed=n_files))
+        changed_timings, changes = measure(sync, repeat=1, warmup=0)
+
+        results.append(result_entry(
+            {"files": n_files, "chars_per_file": 20_000},
+            {
+                "full_build_s": build_timings[0],
+                "unchanged_rescan_s": min(rescan_timings),
+                "one_changed_file_s": changed_timings[0],
+                "re_embedded_files": len(changes),
+            }
+        ))
+        shutil.rmtree(doc_dir, ignore_errors=True)
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+    return results
+
+
+@benchmark("collections")
+def bench_collections(ctx):
+    from chatshell.rag_collections import RagCollections
+
+    embedding_model = _vectorsearch(ctx).embedding_model
+    results = []
+
+    page_counts = sorted(ctx.corpus["pdf"].keys())
+    for n_pages in (page_counts[:2] if ctx.quick else page_counts):
+        path = str(ctx.corpus["pdf"][n_pages])
+        collections_dir = ctx.fixture_dir / f"collections_{n_pages}"
+        shutil.rmtree(collections_dir, ignore_errors=True)
+        collections = RagCollections(collections_dir, embedding_model, 2**30)
+
+        # What /chatwithfile costs on every switch without collections
+        def ingest():
+            vectorsearch = collections.create("manual")
+            vectorsearch.init_vectorstore_pdf([path])
+            collections.save("manual")
+        ingest_timings, _ = measure(ingest, repeat=1, warmup=0)
+
+        resident_timings, _ = measure(lambda: collections.search(["manual"]), repeat=ctx.repeat)
+
+        def from_disk():
+            collections.discard("manual")
+            return collections.search(["manual"])
+        disk_timings, _ = measure(from_disk, repeat=ctx.repeat, warmup=0)
+
+        results.append(result_entry(
+            {"pages": n_pages},
+            {
+                "ingest_s": ingest_timings[0],
+                "switch_resident_ms": min(resident_timings) * 1000.0,
+                "switch_from_disk_ms": min(disk_timings) * 1000.0,
+                "chunks": collections.get("manual").live_count(),
+            }
+        ))
+        shutil.rmtree(collections_dir, ignore_errors=True)
+
+    return results
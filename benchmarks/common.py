@@ -0,0 +1,141 @@
+"""
+Shared helpers for the Chatshell benchmark suite: benchmark registry,
+timing helpers and the JSON result format.
+"""
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+
+BENCHMARKS = {}
+
+RESULT_FORMAT_VERSION = 1
+
+
+def benchmark(name):
+    """
+    Decorator to register a benchmark function under the given name.
+    The function gets the BenchmarkContext and returns a list of result entries.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+class BenchmarkContext:
+    def __init__(self, fixture_dir, corpus, quick=False, repeat=3, embedding_url=""):
+        self.fixture_dir    = Path(fixture_dir)
+        self.corpus         = corpus
+        self.quick          = quick
+        self.repeat         = 1 if quick else repeat
+        # OpenAI compatible base URL of a llama-server started with --embeddings
+        self.embedding_url  = embedding_url
+        self.cache          = {}
+
+    def shared(self, key, factory):
+        # Expensive objects (e.g. embedding models) are created once per benchmark run
+        if key not in self.cache:
+            self.cache[key] = factory()
+        return self.cache[key]
+
+
+def measure(func, repeat=3, warmup=1):
+    """
+    Runs func() warmup + repeat times and returns the timings of the measured runs
+    in seconds together with the return value of the last run.
+    """
+    result = None
+    for _ in range(warmup):
+        result = func()
+
+    timings = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - t_start)
+
+    return timings, result
+
+
+def timing_stats(timings):
+    return {
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "mean_s": statistics.fmean(timings),
+        "runs": len(timings),
+    }
+
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    if len(values) == 0:
+        return {f"p{p}": None for p in points}
+
+    ordered = sorted(values)
+    output = {}
+    for p in points:
+        # Nearest-rank percentile
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100.0 * len(ordered)) - 1))
+        output[f"p{p}"] = ordered[index]
+    return output
+
+
+def result_entry(params, metrics):
+    return {"params": params, "metrics": metrics}
+
+
+def check(condition, message):
+    """
+    Fail the running benchmark (it gets an error result) if condition is false.
+    """
+    if not condition:
+        raise AssertionError(message)
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def run_metadata():
+    try:
+        from importlib.metadata import version
+        chatshell_version = version("chatshell-python")
+    except Exception:
+        chatshell_version = None
+
+    return {
+        "format_version": RESULT_FORMAT_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "chatshell_version": chatshell_version,
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(path, metadata, results):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        json.dump({"meta": metadata, "results": results}, f, indent=4)
+    return path
+
+
+def load_results(path):
+    with open(path, "r") as f:
+        return json.load(f)
@@ -0,0 +1,93 @@
+"""
+Compares two benchmark result files and prints the relative change of every
+metric, flagging regressions above a threshold.
+
+Usage:
+    python benchmarks/compare_results.py baseline.json candidate.json [--threshold 0.1]
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from common import load_results
+
+# Metrics where a larger value is better, all other metrics are treated as durations
+HIGHER_IS_BETTER_SUFFIXES = ("_per_s", "recall_at_10", "hit_rate", "speedup")
+
+
+def flatten_metrics(metrics, prefix=""):
+    output = {}
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            output.update(flatten_metrics(value, prefix=f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            output[name] = float(value)
+    return output
+
+
+def entry_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def compare(baseline, candidate, threshold):
+    regressions = []
+
+    for bench_name, candidate_entries in candidate["results"].items():
+        baseline_entries = baseline["results"].get(bench_name)
+        if not isinstance(candidate_entries, list) or not isinstance(baseline_entries, list):
+            continue
+
+        baseline_by_params = {entry_key(entry["params"]): entry for entry in baseline_entries}
+
+        print(f"\n== {bench_name} ==")
+        for entry in candidate_entries:
+            base_entry = baseline_by_params.get(entry_key(entry["params"]))
+            if base_entry is None:
+                continue
+
+            base_metrics = flatten_metrics(base_entry["metrics"])
+            cand_metrics = flatten_metrics(entry["metrics"])
+
+            print(f"  {entry['params']}")
+            for metric, cand_value in cand_metrics.items():
+                base_value = base_metrics.get(metric)
+                if base_value is None or base_value == 0:
+                    continue
+
+                change = (cand_value - base_value) / abs(base_value)
+                higher_is_better = metric.endswith(HIGHER_IS_BETTER_SUFFIXES)
+                regressed = (change < -threshold) if higher_is_better else (change > threshold)
+                marker = "  REGRESSION" if regressed else ""
+
+                print(f"    {metric:40s} {base_value:14.4f} -> {cand_value:14.4f} ({change:+.1%}){marker}")
+                if regressed:
+                    regressions.append((bench_name, entry["params"], metric, change))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two Chatshell benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change that counts as regression")
+    args = parser.parse_args()
+
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+
+    print(f"Baseline:  {baseline['meta'].get('chatshell_version')} ({baseline['meta'].get('git_revision')}, {baseline['meta'].get('timestamp')})")
+    print(f"Candidate: {candidate['meta'].get('chatshell_version')} ({candidate['meta'].get('git_revision')}, {candidate['meta'].get('timestamp')})")
+
+    regressions = compare(baseline, candidate, args.threshold)
+
+    print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}.")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Stand-in for an OpenAI-compatible llama-server that streams synthetic tokens.
+
+It needs no model and no GPU and is meant for measuring the overhead of the
+Chatshell proxy in isolation. Token rate and time to first token (TTFT) are
+configurable. The llama-server prompt cache is simulated per slot (--parallel):
+only the part of the prompt after the longest common prefix with a cached
+prompt counts as prefill (timings.prompt_n / timings.cache_n) and adds to the
+TTFT with --prefill-ms-per-token. Slots can be pinned with id_slot and saved or
+restored with /slots/{id}?action=save|restore. Prompts longer than the context
+of a slot (--ctx-size / --parallel) are rejected like by llama-server. Unknown llama-server arguments are accepted
+and ignored, so the script can also be configured as "llama-server-path" of an
+endpoint. The launch parameters --threads, --batch-size and --cache-type-k/v
+change the simulated speed on a machine with SIMULATED_CORES cores, for
+testing the endpoint autotuner (/autotune). /v1/embeddings returns
+deterministic pseudo-random vectors of --embedding-dim dimensions per text.
+
+Usage:
+    python benchmarks/fake_llama_server.py --port 4000 --tokens-per-second 50 --ttft-ms 200
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+try:
+    from chatshell.metrics import ProxyMetrics, EventLoopLagMonitor
+except ImportError:
+    # Started as executable from a source checkout (llama-server-path)
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+    from chatshell.metrics import ProxyMetrics, EventLoopLagMonitor
+
+SIMULATED_CORES = 4
+
+# Relative generation speed of the KV cache types
+SIMULATED_KV_SPEED = {"f16": 1.0, "q8_0": 1.08, "q4_0": 1.03}
+
+
+TOKEN_WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+
+
+def render_prompt(messages):
+    # Simple chat template, the prompt cache works on the rendered text
+    return "".join(f"<|{message.get('role', '')}|>{message.get('content', '')}<|end|>" for message in messages)
+
+
+def estimate_tokens(text):
+    # Rough estimate, ~4 characters per token
+    return len(text) // 4
+
+
+def common_prefix_length(a, b):
+    # Binary search on slice comparisons, fast for long prompts
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class PromptCacheSimulator:
+    """
+    Remembers the last prompt of every slot. Like llama-server, a request is assigned
+    to the slot with the longest common prefix if it covers more than
+    similarity_threshold of the prompt, otherwise to the least recently used slot.
+    """
+
+    def __init__(self, slots, similarity_threshold=0.5):
+        self.slots                  = [""] * max(1, slots)
+        self.last_used              = [0.0] * len(self.slots)
+        self.similarity_threshold   = similarity_threshold
+        self.saved                  = {}
+
+    def process(self, prompt, cache_prompt=True, id_slot=None):
+        if id_slot is not None and 0 <= int(id_slot) < len(self.slots):
+            slot = int(id_slot)
+        else:
+            prefixes = [common_prefix_length(prompt, cached) for cached in self.slots]
+            best = max(range(len(self.slots)), key=lambda i: prefixes[i])
+            similar = prefixes[best] > self.similarity_threshold * len(prompt)
+            slot = best if similar else min(range(len(self.slots)), key=lambda i: self.last_used[i])
+
+        cached_chars = common_prefix_length(prompt, self.slots[slot]) if cache_prompt else 0
+        self.slots[slot] = prompt
+        self.last_used[slot] = time.monotonic()
+
+        cache_n = estimate_tokens(prompt[:cached_chars])
+        return slot, max(estimate_tokens(prompt) - cache_n, 1), cache_n
+
+    def save(self, slot, filename):
+        self.saved[filename] = self.slots[slot]
+
+    def restore(self, slot, filename):
+        if filename not in self.saved:
+            return False
+        self.slots[slot] = self.saved[filename]
+        return True
+
+
+def simulated_rates(tokens_per_second, prefill_ms_per_token, threads=None, batch_size=None, cache_type_k=None):
+    """
+    Token rate and prefill time per token for the given launch parameters: speed
+    scales with the threads up to SIMULATED_CORES and drops with oversubscription,
+    prefill is fastest with a batch size of 1024.
+    """
+    if threads is not None:
+        scale = min(threads, SIMULATED_CORES) / SIMULATED_CORES
+        if threads > SIMULATED_CORES:
+            scale *= 0.85
+        tokens_per_second *= scale
+        prefill_ms_per_token /= scale
+    if batch_size is not None:
+        prefill_ms_per_token *= 1.0 + 0.2 * abs(math.log2(batch_size / 1024))
+    if cache_type_k is not None:
+        tokens_per_second *= SIMULATED_KV_SPEED.get(cache_type_k, 1.0)
+    return tokens_per_second, prefill_ms_per_token
+
+
+def create_app(tokens_per_second, ttft_ms, default_max_tokens, model_name, slots=4, prefill_ms_per_token=0.0, ctx_size=16384, embedding_dim=384):
+    app = FastAPI(title="Fake llama-server")
+
+    prompt_cache = PromptCacheSimulator(slots)
+    slot_ctx_size = ctx_size // max(1, slots)
+
+    metrics = ProxyMetrics()
+    lag_monitor = EventLoopLagMonitor(metrics)
+
+    @app.on_event("startup")
+    async def start_lag_monitor():
+        lag_monitor.start()
+
+    @app.get("/health")
+    async def health():
+        return JSONResponse({"status": "ok"})
+
+    @app.get("/v1/models")
+    async def list_models():
+        return JSONResponse({
+            "object": "list",
+            "data": [{"id": model_name, "object": "model", "created": int(time.time()), "owned_by": "fake-llama-server"}],
+        })
+
+    @app.get("/props")
+    async def props():
+        return JSONResponse({
+            "total_slots": len(prompt_cache.slots),
+            "model_path": model_name,
+            "default_generation_settings": {"n_ctx": slot_ctx_size},
+        })
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        payload = await request.json()
+        texts = payload.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        data = []
+        for index, text in enumerate(texts):
+            # Same text, same vector
+            seed = int.from_bytes(hashlib.blake2b(str(text).encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(embedding_dim).astype(np.float32)
+            data.append({"object": "embedding", "index": index, "embedding": (vector / np.linalg.norm(vector)).tolist()})
+        tokens = sum(estimate_tokens(str(text)) for text in texts)
+        return JSONResponse({
+            "object": "list",
+            "model": model_name,
+            "data": data,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    @app.post("/tokenize")
+    async def tokenize(request: Request):
+        payload = await request.json()
+        return JSONResponse({"tokens": list(range(estimate_tokens(str(payload.get("content", "")))))})
+
+    @app.post("/slots/{id_slot}")
+    async def slot_action(id_slot: int, action: str, request: Request):
+        payload = await request.json()
+        filename = payload.get("filename", "")
+        if not 0 <= id_slot < len(prompt_cache.slots) or filename == "":
+            return JSONResponse({"error": {"code": 400, "message": "Invalid slot or filename"}}, status_code=400)
+
+        if action == "save":
+            prompt_cache.save(id_slot, filename)
+            metrics.increment("slot_saves")
+        elif action == "restore":
+            if not prompt_cache.restore(id_slot, filename):
+                return JSONResponse({"error": {"code": 404, "message": "Slot file not found"}}, status_code=404)
+            metrics.increment("slot_restores")
+        else:
+            return JSONResponse({"error": {"code": 400, "message": "Invalid action"}}, status_code=400)
+        return JSONResponse({"id_slot": id_slot, "filename": filename})
+
+    @app.get("/chatshell/metrics")
+    async def get_metrics(reset: bool = False):
+        snapshot = metrics.snapshot()
+        if reset:
+            metrics.reset()
+        return JSONResponse(snapshot)
+
+    def chunk_json(response_id, created, content, finish_reason=None, extra=None):
+        chunk = {
+            "id": response_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model_name,
+            "choices": [{"index": 0, "delta": {"content": content} if content is not None else {}, "finish_reason": finish_reason}],
+        }
+        if extra:
+            chunk.update(extra)
+        return json.dumps(chunk)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        metrics.increment("chat_requests")
+
+        max_tokens = int(payload.get("max_tokens") or payload.get("n_predict") or default_max_tokens)
+        prompt = render_prompt(payload.get("messages", []))
+        if estimate_tokens(prompt) > slot_ctx_size:
+            metrics.increment("context_exceeded")
+            return JSONResponse(
+                {"error": {"code": 400, "type": "exceed_context_size_error", "message": "the request exceeds the available context size"}},
+                status_code=400
+            )
+        slot, prompt_tokens, cached_tokens = prompt_cache.process(
+            prompt,
+            cache_prompt=payload.get("cache_prompt", True),
+            id_slot=payload.get("id_slot")
+        )
+        prefill_ms = ttft_ms + prompt_tokens * prefill_ms_per_token
+        metrics.observe("prefill_tokens", prompt_tokens)
+        metrics.observe("cached_prompt_tokens", cached_tokens)
+        response_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        async def generate_tokens():
+            # Schedule tokens on absolute times so the rate does not drift
+            loop = asyncio.get_running_loop()
+            t_start = loop.time()
+            for i in range(max_tokens):
+                target = t_start + prefill_ms / 1000.0 + i / tokens_per_second
+                delay = target - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield TOKEN_WORDS[i % len(TOKEN_WORDS)] + " "
+
+        def timings(t_start):
+            elapsed_ms = (time.perf_counter() - t_start) * 1000.0
+            return {
+                "cache_n": cached_tokens,
+                "prompt_n": prompt_tokens,
+                "prompt_ms": prefill_ms,
+                "predicted_n": max_tokens,
+                "predicted_ms": max(elapsed_ms - prefill_ms, 0.0),
+                "predicted_per_second": tokens_per_second,
+            }
+
+        if payload.get("stream", False):
+            async def event_stream():
+                t_start = time.perf_counter()
+                async for token in generate_tokens():
+                    metrics.increment("generated_tokens")
+                    yield f"data: {chunk_json(response_id, created, token)}\n\n".encode("utf-8")
+
+                final_extra = {"timings": timings(t_start)}
+                yield f"data: {chunk_json(response_id, created, None, 'stop', final_extra)}\n\n".encode("utf-8")
+                yield b"data: [DONE]\n\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        t_start = time.perf_counter()
+        content = ""
+        generated = 0
+        async for token in generate_tokens():
+            metrics.increment("generated_tokens")
+            content += token
+            generated += 1
+            # Like llama-server, stop generating if the client has disconnected
+            if generated % 16 == 0 and await request.is_disconnected():
+                metrics.increment("cancelled_requests")
+                return Response(status_code=499)
+
+        return JSONResponse({
+            "id": response_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model_name,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens + cached_tokens, "completion_tokens": max_tokens, "total_tokens": prompt_tokens + cached_tokens + max_tokens},
+            "timings": timings(t_start),
+        })
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake streaming llama-server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--max-tokens", type=int, default=128, help="Tokens per response if the request sets no limit")
+    parser.add_argument("-m", "--model", default="fake-model.gguf")
+    parser.add_argument("-c", "--ctx-size", type=int, default=16384, help="Context size, shared by all slots")
+    parser.add_argument("-np", "--parallel", type=int, default=4, help="Number of slots of the simulated prompt cache")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.0, help="Added TTFT per uncached prompt token")
+    parser.add_argument("-t", "--threads", type=int, default=None, help="Simulated llama-server threads")
+    parser.add_argument("-b", "--batch-size", type=int, default=None, help="Simulated llama-server batch size")
+    parser.add_argument("-ctk", "--cache-type-k", default=None, help="Simulated KV cache type")
+    parser.add_argument("--embedding-dim", type=int, default=384, help="Dimension of the /v1/embeddings vectors")
+    args, _ = parser.parse_known_args()
+
+    args.tokens_per_second, args.prefill_ms_per_token = simulated_rates(
+        args.tokens_per_second, args.prefill_ms_per_token, args.threads, args.batch_size, args.cache_type_k
+    )
+
+    app = create_app(args.tokens_per_second, args.ttft_ms, args.max_tokens, args.model, args.parallel, args.prefill_ms_per_token, args.ctx_size, args.embedding_dim)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Deterministic synthetic fixture corpora for the Chatshell benchmarks.
+
+All fixtures are generated offline from a fixed seed, so every run (and every
+version of Chatshell) is measured on exactly the same input data.
+"""
+import random
+from pathlib import Path
+
+
+VOCABULARY = (
+    "cat dog house garden window system model server request response token context "
+    "document website chapter section example value number memory process thread index "
+    "vector search query result answer question summary network machine learning language "
+    "the a of and to in is for on with as by at from that this it be are was were has have "
+    "small large fast slow simple complex local remote public private open closed first last "
+    "configuration parameter endpoint inference embedding retrieval generation evaluation"
+).split()
+
+DEFAULT_SEED = 1234
+
+
+def synthetic_sentence(rng, min_words=6, max_words=22):
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(min_words, max_words))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+
+def synthetic_paragraph(rng, min_sentences=3, max_sentences=8):
+    return " ".join(synthetic_sentence(rng) for _ in range(rng.randint(min_sentences, max_sentences)))
+
+
+def synthetic_text(n_chars, seed=DEFAULT_SEED):
+    """
+    Returns a plain text document of approximately n_chars characters,
+    structured in paragraphs separated by blank lines.
+    """
+    rng = random.Random(seed)
+    paragraphs = []
+    length = 0
+    while length < n_chars:
+        if rng.random() < 0.1:
+            paragraph = f"Section {len(paragraphs) + 1}: " + synthetic_sentence(rng, 3, 6)
+        else:
+            paragraph = synthetic_paragraph(rng)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+
+    return "\n\n".join(paragraphs)[:n_chars]
+
+
+def synthetic_sentences(n_sentences, seed=DEFAULT_SEED):
+    rng = random.Random(seed)
+    return [synthetic_sentence(rng) for _ in range(n_sentences)]
+
+
+def synthetic_html(n_paragraphs, seed=DEFAULT_SEED, nesting=6):
+    """
+    Returns a HTML page with navigation, footer, boilerplate and a main article
+    of n_paragraphs paragraphs, wrapped into `nesting` levels of nested divs.
+    """
+    rng = random.Random(seed)
+
+    nav_links = "".join(f'<li><a href="/page{i}.html">Navigation entry {i}</a></li>' for i in range(30))
+    article = "".join(
+        f"<h2>Heading {i}</h2><p>{synthetic_paragraph(rng)}</p>" if i % 5 == 0 else f"<p>{synthetic_paragraph(rng)}</p>"
+        for i in range(n_paragraphs)
+    )
+    sidebar = "".join(f'<div class="teaser"><a href="/teaser{i}.html">{synthetic_sentence(rng, 3, 6)}</a></div>' for i in range(20))
+    footer = "".join(f'<p class="legal">{synthetic_sentence(rng)}</p>' for _ in range(5))
+
+    body = f"<article>{article}</article>"
+    for level in range(nesting):
+        body = f'<div class="wrapper-{level}">{body}</div>'
+
+    return (
+        "<!DOCTYPE html><html><head><title>Synthetic page</title>"
+        "<style>body { font-family: sans-serif; }</style>"
+        "<script>var tracking = 1;</script></head><body>"
+        f"<nav><ul>{nav_links}</ul></nav>"
+        f'<div class="layout">{body}<aside>{sidebar}</aside></div>'
+        f"<footer>{footer}</footer>"
+        "</body></html>"
+    )
+
+
+def uneven_article_html(seed=DEFAULT_SEED):
+    """
+    Returns a HTML page whose article has paragraphs of uneven length (a
+    heading, a short intro, one long paragraph and a closing paragraph), and
+    the texts of the article besides the long paragraph.
+    """
+    rng = random.Random(seed)
+    heading = synthetic_sentence(rng, 3, 6)
+    intro = synthetic_sentence(rng)
+    long_paragraph = " ".join(synthetic_paragraph(rng, 6, 8) for _ in range(8))
+    closing = synthetic_paragraph(rng, 1, 2)
+
+    nav_links = "".join(f'<li><a href="/page{i}.html">Navigation entry {i}</a></li>' for i in range(10))
+    html = (
+        "<!DOCTYPE html><html><head><title>Uneven article</title></head><body>"
+        f"<nav><ul>{nav_links}</ul></nav>"
+        f'<div class="layout"><div class="content"><article><h1>{heading}</h1><p class="intro">{intro}</p>'
+        f"<p>{long_paragraph}</p><p>{closing}</p></article></div></div>"
+        f'<footer><a href="/legal.html">Legal notice</a></footer>'
+        "</body></html>"
+    )
+    return html, [heading, intro, closing]
+
+
+def synthetic_crawl(n_pages, seed=DEFAULT_SEED, chars_per_page=3000):
+    """
+    Returns the (text, url) pages of a crawled site: every page has its own
+    article between a header and a footer block shared by all pages, every
+    10th page is a copy of an earlier page under another URL and every 10th
+    (offset by 5) a copy with one changed word.
+    """
+    rng = random.Random(seed)
+    header = synthetic_text(600, seed=seed + 1)
+    footer = synthetic_text(900, seed=seed + 2)
+
+    pages = []
+    for i in range(n_pages):
+        if i % 10 == 9:
+            text, url = pages[rng.randrange(len(pages))]
+            pages.append((text, url + "?ref=copy"))
+        elif i % 10 == 4 and pages:
+            text, url = pages[rng.randrange(len(pages))]
+            pages.append((text.replace(" the ", " a ", 1), url + "/print"))
+        else:
+            article = synthetic_text(chars_per_page, seed=seed + 100 + i)
+            pages.append((f"{header}\n\n{article}\n\n{footer}", f"https://example.org/page{i}.html"))
+    return pages
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _wrap_lines(text, width=95):
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+    return lines
+
+
+def write_pdf(path, page_texts):
+    """
+    Writes a minimal, valid PDF file with one text page per entry of page_texts.
+    Uses only the standard Helvetica font, so no external PDF library is needed.
+    """
+    objects = []
+
+    def add_object(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog_id  = add_object(None)
+    pages_id    = add_object(None)
+    font_id     = add_object(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for text in page_texts:
+        content_lines = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        for line in _wrap_lines(text)[:70]:
+            content_lines.append(f"({_pdf_escape(line)}) Tj T*")
+        content_lines.append("ET")
+        content = "\n".join(content_lines).encode("latin-1", errors="replace")
+
+        content_id = add_object(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        page_id = add_object(
+            (
+                f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 595 842] "
+                f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"
+            ).encode("ascii")
+        )
+        page_ids.append(page_id)
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[catalog_id - 1] = f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode("ascii")
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("ascii")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for obj_num, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % obj_num + body + b"\nendobj\n"
+
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n" % (len(objects) + 1)
+    output += b"0000000000 65535 f \n"
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_offset)
+
+    Path(path).write_bytes(bytes(output))
+    return Path(path)
+
+
+def write_pdf_fixture(path, n_pages, seed=DEFAULT_SEED, chars_per_page=3000):
+    page_texts = [synthetic_text(chars_per_page, seed=seed + page) for page in range(n_pages)]
+    return write_pdf(path, page_texts)
+
+
+def build_fixture_corpus(fixture_dir, pdf_pages=(1, 10, 50), html_paragraphs=(20, 200, 1000), text_chars=(10_000, 100_000, 1_000_000)):
+    """
+    Generates (or reuses) the fixture files in fixture_dir and returns a dict
+    with the paths per fixture type and size.
+    """
+    fixture_dir = Path(fixture_dir)
+    fixture_dir.mkdir(parents=True, exist_ok=True)
+
+    corpus = {"pdf": {}, "html": {}, "text": {}}
+
+    for n_pages in pdf_pages:
+        path = fixture_dir / f"synthetic_{n_pages}_pages.pdf"
+        if not path.exists():
+            write_pdf_fixture(path, n_pages)
+        corpus["pdf"][n_pages] = path
+
+    for n_paragraphs in html_paragraphs:
+        path = fixture_dir / f"synthetic_{n_paragraphs}_paragraphs.html"
+        if not path.exists():
+            path.write_text(synthetic_html(n_paragraphs), encoding="utf-8")
+        corpus["html"][n_paragraphs] = path
+
+    for n_chars in text_chars:
+        path = fixture_dir / f"synthetic_{n_chars}_chars.txt"
+        if not path.exists():
+            path.write_text(synthetic_text(n_chars), encoding="utf-8")
+        corpus["text"][n_chars] = path
+
+    return corpus
@@ -0,0 +1,324 @@
+"""
+Load generator for /v1/chat/completions that measures the overhead of the
+Chatshell proxy against the fake llama-server stand-in.
+
+Every concurrency level is run twice: directly against the stand-in and through
+the Chatshell proxy (optionally with RAG enabled). The report contains the
+added latency, throughput, tail percentiles, the event loop lag and the CPU time
+per streamed token of both servers. With --turns every worker runs multi-turn
+conversations, which shows how many prompt tokens the upstream has to prefill
+per request (prompt cache hits, see "prompt-layout" in the proxy config).
+
+Preparation:
+    1. python benchmarks/fake_llama_server.py --port 4000
+    2. Set "inference-endpoint-base-url" to "http://localhost:4000/v1" in
+       chatshell_server_config.json and start chatshell-server.
+
+Usage:
+    python benchmarks/loadtest_proxy.py --proxy-url http://localhost:4001 --upstream-url http://localhost:4000 --rag
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from common import percentiles, run_metadata, write_results
+from fixtures import build_fixture_corpus, synthetic_sentences
+
+
+class RequestResult:
+    def __init__(self):
+        self.status     = None
+        self.ttft_ms    = None
+        self.latency_ms = None
+        self.tokens     = 0
+        self.content    = ""
+        self.error      = None
+
+
+async def _read_body_chunks(reader, headers):
+    # Yields the raw body bytes, handling chunked transfer encoding
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                return
+            size = int(size_line.strip().split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()
+                return
+            data = await reader.readexactly(size)
+            await reader.readline()
+            yield data
+    elif "content-length" in headers:
+        yield await reader.readexactly(int(headers["content-length"]))
+    else:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            yield data
+
+
+async def http_request(base_url, method, path, payload=None, timeout=300.0):
+    """
+    Minimal HTTP/1.1 client on plain asyncio streams. Returns (status, headers, body reader, writer).
+    """
+    parsed = urlparse(base_url)
+    host = parsed.hostname
+    port = parsed.port or 80
+
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    request_head = (
+        f"{method} {path} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Content-Type: application/json\r\n"
+        "Accept: text/event-stream, application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    writer.write(request_head.encode("ascii") + body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    return status, headers, reader, writer
+
+
+async def fetch_json(base_url, method, path, payload=None):
+    status, headers, reader, writer = await http_request(base_url, method, path, payload)
+    body = b""
+    async for data in _read_body_chunks(reader, headers):
+        body += data
+    writer.close()
+    return status, json.loads(body) if body else None
+
+
+async def stream_chat_completion(base_url, payload):
+    result = RequestResult()
+    t_start = time.perf_counter()
+
+    try:
+        status, headers, reader, writer = await http_request(base_url, "POST", "/v1/chat/completions", payload)
+        result.status = status
+
+        buffer = b""
+        async for data in _read_body_chunks(reader, headers):
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data_str = line[5:].strip()
+                if data_str == b"[DONE]":
+                    continue
+                try:
+                    chunk = json.loads(data_str)
+                    content = chunk["choices"][0].get("delta", {}).get("content")
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if content:
+                    result.content += content
+                    if result.ttft_ms is None:
+                        result.ttft_ms = (time.perf_counter() - t_start) * 1000.0
+                    result.tokens += 1
+
+        writer.close()
+    except Exception as e:
+        result.error = str(e)
+
+    result.latency_ms = (time.perf_counter() - t_start) * 1000.0
+    return result
+
+
+async def run_level(base_url, concurrency, requests_per_worker, max_tokens, prompts, turns=1):
+    results = []
+
+    async def worker(worker_id):
+        messages = []
+        for i in range(requests_per_worker):
+            if i % turns == 0:
+                # Start a new conversation
+                messages = []
+            prompt = prompts[(worker_id * requests_per_worker + i) % len(prompts)]
+            messages.append({"role": "user", "content": prompt})
+            payload = {
+                "model": "generic",
+                "messages": list(messages),
+                "stream": True,
+                "max_tokens": max_tokens,
+            }
+            result = await stream_chat_completion(base_url, payload)
+            messages.append({"role": "assistant", "content": result.content})
+            results.append(result)
+
+    t_start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    duration = time.perf_counter() - t_start
+
+    ok = [r for r in results if r.error is None and r.status == 200]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "duration_s": duration,
+        "requests_per_s": len(ok) / duration,
+        "tokens_per_s": sum(r.tokens for r in ok) / duration,
+        "ttft_ms": percentiles([r.ttft_ms for r in ok if r.ttft_ms is not None]),
+        "latency_ms": percentiles([r.latency_ms for r in ok]),
+    }
+
+
+async def read_server_metrics(base_url, reset=False):
+    try:
+        _, snapshot = await fetch_json(base_url, "GET", "/chatshell/metrics?reset=true" if reset else "/chatshell/metrics")
+        return snapshot
+    except Exception:
+        return None
+
+
+async def send_proxy_command(proxy_url, command):
+    payload = {"model": "generic", "messages": [{"role": "user", "content": command}], "stream": True}
+    result = await stream_chat_completion(proxy_url, payload)
+    if result.error is not None or result.status != 200:
+        print(f"--> Command '{command}' failed: {result.error or result.status}")
+        return False
+    return True
+
+
+def added_latency(proxy_metrics, direct_metrics):
+    output = {}
+    for key in ("ttft_ms", "latency_ms"):
+        output[key] = {
+            p: (proxy_metrics[key][p] - direct_metrics[key][p])
+            if proxy_metrics[key][p] is not None and direct_metrics[key][p] is not None else None
+            for p in proxy_metrics[key]
+        }
+    return output
+
+
+async def run(args):
+    prompts = synthetic_sentences(64, seed=7)
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    modes = ["plain"]
+    if args.rag:
+        modes.append("rag")
+
+    results = []
+    for mode in modes:
+        if mode == "rag":
+            corpus = build_fixture_corpus(args.fixture_dir)
+            pdf_path = corpus["pdf"][max(corpus["pdf"].keys())]
+            print(f"--> Enabling RAG in proxy with {pdf_path}...")
+            if not await send_proxy_command(args.proxy_url, f"/chatwithfile {pdf_path}"):
+                continue
+
+        for concurrency in levels:
+            entry = {"params": {"mode": mode, "concurrency": concurrency, "max_tokens": args.max_tokens, "turns": args.turns}, "metrics": {}}
+
+            targets = [("proxy", args.proxy_url)]
+            if mode == "plain":
+                # Direct baseline does not depend on the proxy mode
+                targets.insert(0, ("direct", args.upstream_url))
+
+            for target_name, url in targets:
+                print(f"--> {mode}: {target_name} with concurrency {concurrency}...")
+                before = await read_server_metrics(url, reset=True)
+                level_metrics = await run_level(url, concurrency, args.requests_per_worker, args.max_tokens, prompts, args.turns)
+                after = await read_server_metrics(url)
+
+                if before is not None and after is not None:
+                    level_metrics["event_loop_lag_ms"] = after["observations"].get("event_loop_lag_ms")
+                    # Prompt tokens processed by the upstream per request (reported by llama-server timings)
+                    level_metrics["prefill_tokens"] = after["observations"].get("prefill_tokens")
+                    # Server CPU time spent per streamed token
+                    tokens = level_metrics["tokens_per_s"] * level_metrics["duration_s"]
+                    cpu_ms = (after["process_cpu_s"] - before["process_cpu_s"]) * 1000.0
+                    level_metrics["server_cpu_ms_per_token"] = cpu_ms / tokens if tokens > 0 else None
+                else:
+                    level_metrics["event_loop_lag_ms"] = None
+                    level_metrics["prefill_tokens"] = None
+                    level_metrics["server_cpu_ms_per_token"] = None
+
+                entry["metrics"][target_name] = level_metrics
+
+            results.append(entry)
+
+        if mode == "rag":
+            await send_proxy_command(args.proxy_url, "/forgetdoc")
+
+    # Compare every proxy run with the direct run at the same concurrency
+    direct_by_level = {e["params"]["concurrency"]: e["metrics"]["direct"] for e in results if "direct" in e["metrics"]}
+    for entry in results:
+        direct = direct_by_level.get(entry["params"]["concurrency"])
+        if direct is not None:
+            entry["metrics"]["added"] = added_latency(entry["metrics"]["proxy"], direct)
+
+    return results
+
+
+def print_report(results):
+    print("\n| Mode | Conc. | Target | req/s | tok/s | TTFT p50 | TTFT p99 | Lat. p50 | Lat. p99 | Loop lag p99 | CPU ms/tok | Prefill tok | Errors |")
+    print("|------|-------|--------|-------|-------|----------|----------|----------|----------|--------------|------------|-------------|--------|")
+    for entry in results:
+        for target in ("direct", "proxy"):
+            m = entry["metrics"].get(target)
+            if m is None:
+                continue
+            fmt = lambda v, digits=1: f"{v:.{digits}f}" if v is not None else "-"
+            lag = (m.get("event_loop_lag_ms") or {}).get("p99")
+            prefill = (m.get("prefill_tokens") or {}).get("mean")
+            print(
+                f"| {entry['params']['mode']} | {entry['params']['concurrency']} | {target} "
+                f"| {m['requests_per_s']:.2f} | {m['tokens_per_s']:.1f} "
+                f"| {fmt(m['ttft_ms']['p50'])} | {fmt(m['ttft_ms']['p99'])} "
+                f"| {fmt(m['latency_ms']['p50'])} | {fmt(m['latency_ms']['p99'])} "
+                f"| {fmt(lag)} | {fmt(m.get('server_cpu_ms_per_token'), 3)} | {fmt(prefill)} | {m['errors']} |"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the Chatshell proxy")
+    parser.add_argument("--proxy-url", default="http://localhost:4001")
+    parser.add_argument("--upstream-url", default="http://localhost:4000", help="URL of the fake llama-server")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="Comma separated concurrency levels")
+    parser.add_argument("--requests-per-worker", type=int, default=4)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--turns", type=int, default=1, help="Requests per conversation, history is sent with every turn")
+    parser.add_argument("--rag", action="store_true", help="Additionally run all levels with RAG enabled in the proxy")
+    parser.add_argument("--fixture-dir", default=str(BENCH_DIR / "data"))
+    parser.add_argument("--output", default="", help="Result file (default: benchmarks/results/loadtest-<timestamp>.json)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    metadata = run_metadata()
+    metadata["proxy_url"] = args.proxy_url
+    metadata["upstream_url"] = args.upstream_url
+
+    output = args.output or str(BENCH_DIR / "results" / f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    path = write_results(output, metadata, {"proxy_loadtest": results})
+    print(f"--> Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
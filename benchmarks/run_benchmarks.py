@@ -0,0 +1,80 @@
+"""
+Runs the Chatshell benchmark suite and stores the results as JSON.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--only chunking,hnsw] [--quick] [--output results.json]
+
+All benchmarks run offline on deterministic synthetic fixtures. The embedding
+model has to be available in the local model cache (it is downloaded on first
+use of Chatshell).
+"""
+import argparse
+import importlib
+import sys
+import time
+import traceback
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from common import BENCHMARKS, BenchmarkContext, run_metadata, write_results
+from fixtures import build_fixture_corpus
+
+# Modules containing @benchmark functions
+BENCHMARK_MODULES = [
+    "bench_rag",
+    "bench_download",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chatshell benchmark suite")
+    parser.add_argument("--only", default="", help="Comma separated list of benchmarks to run")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes and a single run per measurement")
+    parser.add_argument("--repeat", type=int, default=3, help="Measured runs per benchmark entry")
+    parser.add_argument("--fixture-dir", default=str(BENCH_DIR / "data"), help="Directory for generated fixture files")
+    parser.add_argument("--output", default="", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--list", action="store_true", help="List available benchmarks and exit")
+    parser.add_argument("--embedding-url", default="", help="Base URL of a llama-server with --embeddings for embedding_backends (e.g. http://localhost:8080/v1)")
+    args = parser.parse_args()
+
+    for module_name in BENCHMARK_MODULES:
+        importlib.import_module(module_name)
+
+    if args.list:
+        for name in BENCHMARKS:
+            print(name)
+        return
+
+    selected = [name.strip() for name in args.only.split(",") if name.strip()] or list(BENCHMARKS.keys())
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(unknown)}")
+        sys.exit(1)
+
+    print("--> Generating fixture corpus...")
+    corpus = build_fixture_corpus(args.fixture_dir)
+    ctx = BenchmarkContext(args.fixture_dir, corpus, quick=args.quick, repeat=args.repeat, embedding_url=args.embedding_url)
+
+    results = {}
+    for name in selected:
+        print(f"--> Running benchmark '{name}'...")
+        t_start = time.perf_counter()
+        try:
+            results[name] = BENCHMARKS[name](ctx)
+        except Exception as e:
+            traceback.print_exc()
+            results[name] = {"error": str(e)}
+        print(f"--> Benchmark '{name}' finished in {time.perf_counter() - t_start:.1f}s")
+
+    metadata = run_metadata()
+    metadata["quick"] = args.quick
+
+    output = args.output or str(BENCH_DIR / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    path = write_results(output, metadata, results)
+    print(f"--> Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
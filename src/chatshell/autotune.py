@@ -0,0 +1,220 @@
+import os
+import time
+
+import requests
+
+from .hardware import detect_hardware, peak_rss
+from .server_props import server_root_url
+
+
+# KV cache quantizations of llama-server (--cache-type-k / --cache-type-v)
+KV_CACHE_TYPES = ("f16", "q8_0", "q4_0")
+
+# Configurations within this share of the fastest one count as equally fast
+SCORE_TOLERANCE = 0.03
+
+FILLER_SENTENCE = "The quick brown fox jumps over the lazy dog while the cat watches from the warm window sill. "
+
+
+class TuningRun:
+    def __init__(self, params):
+        self.params     = dict(params)
+        self.score_ms   = None
+        self.prompt_tps = None
+        self.gen_tps    = None
+        self.peak_rss   = None
+        self.fits       = True
+        self.error      = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.score_ms is not None and self.fits
+
+
+class EndpointAutotuner:
+    """
+    Finds fast llama-server launch parameters for an endpoint config set on this machine.
+
+    Every candidate configuration is started on the port of the endpoint and
+    measured with short requests (prompt processing and generation speed from
+    the llama-server timings). The score is the time of a reference request of
+    prompt_tokens prompt and gen_tokens generated tokens. Configurations whose
+    peak memory exceeds memory_share of the RAM available at the start are
+    discarded.
+
+    The grid (threads, batch-size, KV cache types, no-mmap, ctx-size) is searched
+    one parameter at a time with the others fixed at the best values so far,
+    which needs a few runs per parameter instead of one run per combination.
+    For ctx-size, the largest context within SCORE_TOLERANCE of the fastest is chosen.
+    """
+
+    def __init__(self, llm_server, prompt_tokens=512, gen_tokens=64, repetitions=2,
+                 memory_share=0.9, startup_timeout_s=300.0, request_timeout_s=300.0):
+        self.llm_server         = llm_server
+        self.prompt_tokens      = prompt_tokens
+        self.gen_tokens         = gen_tokens
+        self.repetitions        = repetitions
+        self.memory_share       = memory_share
+        self.startup_timeout_s  = startup_timeout_s
+        self.request_timeout_s  = request_timeout_s
+
+    def candidate_grid(self, hardware, conf) -> list:
+        """
+        List of (parameter names, list of value tuples) in search order.
+        """
+        physical, logical = hardware["physical_cores"], hardware["logical_cores"]
+        threads = sorted({max(1, physical // 2), physical, logical})
+
+        try:
+            configured_ctx = int(conf.get("ctx-size") or 0)
+        except ValueError:
+            configured_ctx = 0
+        ctx_sizes = sorted({4096, 8192, 16384, 32768} | ({configured_ctx} if configured_ctx > 0 else set()))
+
+        return [
+            (("threads",), [(str(t),) for t in threads]),
+            (("batch-size",), [("512",), ("1024",), ("2048",)]),
+            (("cache-type-k", "cache-type-v"), [(kv, kv) for kv in KV_CACHE_TYPES]),
+            (("no-mmap",), [("False",), ("True",)]),
+            (("ctx-size",), [(str(c),) for c in ctx_sizes]),
+        ]
+
+    def _wait_ready(self, process, root_url):
+        deadline = time.monotonic() + self.startup_timeout_s
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                return f"llama-server exited with code {process.returncode}"
+            try:
+                if requests.get(f"{root_url}/health", timeout=2.0).status_code == 200:
+                    return None
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        return "llama-server did not become ready"
+
+    def _benchmark_request(self, base_url):
+        payload = {
+            "model": "autotune",
+            "messages": [{"role": "user", "content": FILLER_SENTENCE * max(1, self.prompt_tokens // 20)}],
+            "max_tokens": self.gen_tokens,
+            "temperature": 0.0,
+            # Measure the full prefill and a fixed number of generated tokens
+            "cache_prompt": False,
+            "ignore_eos": True,
+        }
+        start = time.perf_counter()
+        response = requests.post(f"{base_url}/chat/completions", json=payload, timeout=self.request_timeout_s)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        response.raise_for_status()
+
+        timings = response.json().get("timings") or {}
+        if timings.get("prompt_n") and timings.get("predicted_n") and timings.get("prompt_ms") and timings.get("predicted_ms"):
+            prompt_tps = timings["prompt_n"] / timings["prompt_ms"] * 1000.0
+            gen_tps = timings["predicted_n"] / timings["predicted_ms"] * 1000.0
+            score_ms = self.prompt_tokens / prompt_tps * 1000.0 + self.gen_tokens / gen_tps * 1000.0
+            return score_ms, prompt_tps, gen_tps
+        # No llama-server timings, use the request time
+        return elapsed_ms, None, None
+
+    def measure(self, name, params, memory_budget) -> TuningRun:
+        run = TuningRun(params)
+        start_ok, output = self.llm_server.create_endpoint(name, overrides=params)
+        process = self.llm_server.processes.get(name)
+        if not start_ok or process is None:
+            run.error = output
+            return run
+
+        base_url = self.llm_server.get_endpoint_base_url(name)
+        try:
+            run.error = self._wait_ready(process, server_root_url(base_url))
+            if run.error is None:
+                # Warmup (loading of the weights), then keep the best measurement
+                self._benchmark_request(base_url)
+                for _ in range(self.repetitions):
+                    score_ms, prompt_tps, gen_tps = self._benchmark_request(base_url)
+                    if run.score_ms is None or score_ms < run.score_ms:
+                        run.score_ms, run.prompt_tps, run.gen_tps = score_ms, prompt_tps, gen_tps
+
+                run.peak_rss = peak_rss(process.pid)
+                if run.peak_rss is not None and memory_budget is not None:
+                    run.fits = run.peak_rss <= memory_budget
+        except (requests.RequestException, ValueError) as e:
+            run.error = str(e)
+        finally:
+            self.llm_server.stop_process(name)
+        return run
+
+    def run(self, name, progress=print):
+        """
+        Tune the endpoint config set name and write the best parameters back into it.
+        Returns (best parameters or None, list of TuningRun).
+        """
+        conf = self.llm_server.get_endpoint_config(name)
+        if conf is None:
+            raise ValueError(f"No configuration found for LLM with name '{name}'.")
+        if self.llm_server.use_python_server_lib:
+            raise ValueError("Autotuning requires the llama-server executable (use-llama-server-python: False).")
+        if name in self.llm_server.get_running_endpoints():
+            raise ValueError(f"Endpoint '{name}' is running, stop it before autotuning.")
+
+        hardware = detect_hardware()
+        memory_budget = int(hardware["ram_available"] * self.memory_share) if hardware["ram_available"] else None
+
+        model_path = self.llm_server.resolve_model_path(conf.get("model", ""))
+        if model_path is not None and memory_budget is not None and os.path.getsize(model_path) > memory_budget:
+            raise ValueError(f"Model file {model_path} is larger than the available memory.")
+
+        progress(f"--> Autotuning '{name}': {hardware['physical_cores']} cores ({hardware['logical_cores']} threads), "
+                 f"{(hardware['ram_available'] or 0) / 2**30:.1f} GiB RAM available")
+
+        best = {}
+        runs = []
+        for keys, values in self.candidate_grid(hardware, conf):
+            stage_runs = []
+            for value in values:
+                params = dict(best, **dict(zip(keys, value)))
+                run = self.measure(name, params, memory_budget)
+                runs.append(run)
+                stage_runs.append((value, run))
+                progress(f"--> {params}: " + (f"{run.score_ms:.0f} ms" if run.ok else f"discarded ({run.error or 'exceeds memory'})"))
+
+            valid = [(value, run) for value, run in stage_runs if run.ok]
+            if len(valid) == 0:
+                # Keep the configured value of this parameter
+                continue
+
+            fastest = min(run.score_ms for _, run in valid)
+            if keys == ("ctx-size",):
+                # Largest context that is not noticeably slower
+                value, _ = max(
+                    ((value, run) for value, run in valid if run.score_ms <= fastest * (1 + SCORE_TOLERANCE)),
+                    key=lambda item: int(item[0][0])
+                )
+            else:
+                value, _ = min(valid, key=lambda item: item[1].score_ms)
+            best.update(zip(keys, value))
+
+        if len(best) == 0:
+            return None, runs
+
+        self.llm_server.update_llm_conf(name, best)
+        return best, runs
+
+    @staticmethod
+    def results_table(runs) -> str:
+        rows = [
+            "| Parameters | Request time | Prompt tok/s | Generated tok/s | Peak memory |",
+            "|--------------|--------------|--------------|--------------|--------------|",
+        ]
+        for run in runs:
+            params = ", ".join(f"{key}={value}" for key, value in run.params.items())
+            if run.error is not None:
+                rows.append(f"| {params} | failed: {run.error} | | | |")
+                continue
+            memory = f"{run.peak_rss / 2**20:.0f} MiB" if run.peak_rss is not None else "-"
+            if not run.fits:
+                memory += " (too large)"
+            prompt_tps = f"{run.prompt_tps:.1f}" if run.prompt_tps is not None else "-"
+            gen_tps = f"{run.gen_tps:.1f}" if run.gen_tps is not None else "-"
+            rows.append(f"| {params} | {run.score_ms:.0f} ms | {prompt_tps} | {gen_tps} | {memory} |")
+        return "\n".join(rows)
@@ -1,13 +1,14 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
 from sse_starlette import EventSourceResponse
 import asyncio, uvicorn
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
 from pathlib import Path
 from urllib.parse import urlparse
-from PyPDF2 import PdfReader
 import json
 import os, appdirs, time, json
 import uuid
@@ -15,6 +16,25 @@ import re
 from multiprocessing import Process, Event
 import pyperclip
 from .llm_server import LocalLLMServer
+from .tracing import RequestTrace, set_current_trace, trace_span
+from .metrics import ProxyMetrics, EventLoopLagMonitor
+from .sse_passthrough import build_sources_event, passthrough_stream, TimingsSniffer
+from .commands import CommandContext, CommandRegistry, ReadWriteLock
+from .utils_rag import crawl_website
+from .server_props import ServerPropsCache
+from .slot_router import SlotRouter, conversation_key
+from .autotune import EndpointAutotuner
+from .client_disconnect import ClientDisconnected, cancel_on_disconnect, close_upstream
+from .scheduler import RequestScheduler, SchedulerRejected, PRIORITY_INTERACTIVE, PRIORITY_RANKS
+from .context_window import ContextWindowManager, CONTEXT_MANAGEMENT_DROP, CONTEXT_MANAGEMENT_OFF, CONTEXT_MANAGEMENT_SUMMARIZE
+from .response_cache import SemanticResponseCache, ExactResponseCache, StreamTranscript, is_cacheable, replay_chunks, build_completion
+from .prompt_layout import PromptAssembler, split_llama_server_params, PROMPT_LAYOUT_APPEND, PROMPT_LAYOUT_CACHE
+from .proxy_workers import listen_socket, unix_listen_socket
+from .shared_index import SharedRagState
+from .folder_index import FolderIndex, change_summary
+from .rag_collections import CollectionSearch, RagCollections
+from .pdf_extract import PdfExtractor, PDF_BACKEND_PYPDF2
+from .embeddings import create_embedding_backend, DEFAULT_EMBEDDING_MODEL, EMBEDDING_BACKEND_LIGHT_EMBED
 
 
 class Chatshell:
@@ -22,12 +42,15 @@ class Chatshell:
     def __init__(self, termux_paths=False):
         self.version = "0.2.0"
         self.process = None
+        self.worker_processes = []
         self.shutdown_event = None
 
         self.termux                 = termux_paths
 
         CONFIG_DIR                  = Path(appdirs.user_config_dir(appname='chatshell'))
+        self.config_dir             = CONFIG_DIR
         self.chatshell_config_path  = CONFIG_DIR / 'chatshell_server_config.json'
+        self.profile_dir            = CONFIG_DIR / 'profiles'
         self.chatshell_config       = None
         self.doc_base_dir           = None
         self.website_crawl_depth    = 1
@@ -38,6 +61,25 @@ class Chatshell:
         self.rag_score_thresh       = 0.5
         self.rag_max_chunks         = 10
 
+        self.request_tracing        = True
+        self.request_profiling      = False
+        self.stream_passthrough     = False
+        self.command_worker_threads = 4
+        self.proxy_workers          = 1
+        self.rag_folder_index       = False
+        self.rag_folder_scan_interval_s = 60.0
+        self.rag_collections_memory_mb  = 1024.0
+        self.pdf_backend            = PDF_BACKEND_PYPDF2
+        self.pdf_cache_max_mb       = 256.0
+        self.rag_chunk_tokens       = 128
+        self.rag_chunk_overlap_tokens = 16
+        self.rag_dedup              = True
+        self.embedding_backend      = EMBEDDING_BACKEND_LIGHT_EMBED
+        self.embedding_model        = DEFAULT_EMBEDDING_MODEL
+        self.embedding_base_url     = ""
+        self.embedding_dim          = 0
+        self.embedding_quantize     = False
+
         self.load_config()
 
     def load_config(self):
@@ -60,7 +102,41 @@ class Chatshell:
                     "chatshell-proxy-server-port": "4001",
                     "inference-endpoint-base-url": "http://localhost:4000/v1",
                     "use-openai-public-api": "False",
-                    "openai-api-token": "mytoken"
+                    "openai-api-token": "mytoken",
+                    "request-tracing": "True",
+                    "request-profiling": "False",
+                    "stream-passthrough": "False",
+                    "command-worker-threads": "4",
+                    "prompt-layout": "append",
+                    "slot-affinity": "False",
+                    "context-management": "drop",
+                    "context-window-share": "0.75",
+                    "response-cache": "False",
+                    "response-cache-similarity": "0.95",
+                    "response-cache-ttl-s": "3600",
+                    "response-cache-max-entries": "512",
+                    "response-cache-max-temperature": "0.2",
+                    "exact-cache": "False",
+                    "exact-cache-max-entries": "1024",
+                    "exact-cache-ttl-s": "86400",
+                    "scheduler": "True",
+                    "scheduler-max-inflight": "auto",
+                    "scheduler-max-queue": "64",
+                    "scheduler-queue-timeout-s": "60",
+                    "proxy-workers": "1",
+                    "rag-folder-index": "False",
+                    "rag-folder-scan-interval-s": "60",
+                    "rag-collections-memory-mb": "1024",
+                    "pdf-backend": "pypdf2",
+                    "pdf-cache-max-mb": "256",
+                    "rag-chunk-tokens": "128",
+                    "rag-chunk-overlap-tokens": "16",
+                    "rag-dedup": "True",
+                    "embedding-backend": "light_embed",
+                    "embedding-model": DEFAULT_EMBEDDING_MODEL,
+                    "embedding-base-url": "",
+                    "embedding-dim": "0",
+                    "embedding-quantize": "False"
                     }
 
                 with self.chatshell_config_path.open('w') as f:
@@ -75,36 +151,99 @@ class Chatshell:
                 self.rag_chunk_count        = int(self.chatshell_config["rag-chunk-count"])
                 self.use_openai_api         = json.loads(str(self.chatshell_config["use-openai-public-api"]).lower())
                 self.openai_api_token        = self.chatshell_config["openai-api-token"]
+                self.request_tracing        = json.loads(str(self.chatshell_config.get("request-tracing", "True")).lower())
+                self.request_profiling      = json.loads(str(self.chatshell_config.get("request-profiling", "False")).lower())
+                self.stream_passthrough     = json.loads(str(self.chatshell_config.get("stream-passthrough", "False")).lower())
+                self.command_worker_threads = int(self.chatshell_config.get("command-worker-threads", "4"))
+                self.prompt_layout          = str(self.chatshell_config.get("prompt-layout", PROMPT_LAYOUT_APPEND)).lower()
+                self.slot_affinity          = json.loads(str(self.chatshell_config.get("slot-affinity", "False")).lower())
+                self.context_management     = str(self.chatshell_config.get("context-management", CONTEXT_MANAGEMENT_DROP)).lower()
+                self.context_window_share   = float(self.chatshell_config.get("context-window-share", "0.75"))
+                self.response_cache         = json.loads(str(self.chatshell_config.get("response-cache", "False")).lower())
+                self.response_cache_similarity  = float(self.chatshell_config.get("response-cache-similarity", "0.95"))
+                self.response_cache_ttl_s       = float(self.chatshell_config.get("response-cache-ttl-s", "3600"))
+                self.response_cache_max_entries = int(self.chatshell_config.get("response-cache-max-entries", "512"))
+                self.response_cache_max_temperature = float(self.chatshell_config.get("response-cache-max-temperature", "0.2"))
+                self.exact_cache            = json.loads(str(self.chatshell_config.get("exact-cache", "False")).lower())
+                self.exact_cache_max_entries = int(self.chatshell_config.get("exact-cache-max-entries", "1024"))
+                self.exact_cache_ttl_s      = float(self.chatshell_config.get("exact-cache-ttl-s", "86400"))
+                self.scheduler              = json.loads(str(self.chatshell_config.get("scheduler", "True")).lower())
+                self.scheduler_max_inflight = str(self.chatshell_config.get("scheduler-max-inflight", "auto"))
+                self.scheduler_max_queue    = int(self.chatshell_config.get("scheduler-max-queue", "64"))
+                self.scheduler_queue_timeout_s = float(self.chatshell_config.get("scheduler-queue-timeout-s", "60"))
+                self.proxy_workers          = max(1, int(self.chatshell_config.get("proxy-workers", "1")))
+                self.rag_folder_index       = json.loads(str(self.chatshell_config.get("rag-folder-index", "False")).lower())
+                self.rag_folder_scan_interval_s = float(self.chatshell_config.get("rag-folder-scan-interval-s", "60"))
+                self.rag_collections_memory_mb  = float(self.chatshell_config.get("rag-collections-memory-mb", "1024"))
+                self.pdf_backend            = str(self.chatshell_config.get("pdf-backend", PDF_BACKEND_PYPDF2)).lower()
+                self.pdf_cache_max_mb       = float(self.chatshell_config.get("pdf-cache-max-mb", "256"))
+                self.rag_chunk_tokens       = int(self.chatshell_config.get("rag-chunk-tokens", "128"))
+                self.rag_chunk_overlap_tokens = int(self.chatshell_config.get("rag-chunk-overlap-tokens", "16"))
+                self.rag_dedup              = json.loads(str(self.chatshell_config.get("rag-dedup", "True")).lower())
+                self.embedding_backend      = str(self.chatshell_config.get("embedding-backend", EMBEDDING_BACKEND_LIGHT_EMBED)).lower()
+                self.embedding_model        = str(self.chatshell_config.get("embedding-model", DEFAULT_EMBEDDING_MODEL))
+                self.embedding_base_url     = str(self.chatshell_config.get("embedding-base-url", ""))
+                self.embedding_dim          = int(self.chatshell_config.get("embedding-dim", "0"))
+                self.embedding_quantize     = json.loads(str(self.chatshell_config.get("embedding-quantize", "False")).lower())
+
+                if self.proxy_workers > 1:
+                    # Slot pins, remembered prompt injections, context summaries and cached responses are
+                    # kept in the memory of each worker, the turns of a conversation can reach different workers
+                    if self.slot_affinity:
+                        print("--> slot-affinity is not supported with several proxy-workers, disabled.")
+                        self.slot_affinity = False
+                    if self.prompt_layout == PROMPT_LAYOUT_CACHE:
+                        print(f"--> prompt-layout {PROMPT_LAYOUT_CACHE} is not supported with several proxy-workers, using {PROMPT_LAYOUT_APPEND}.")
+                        self.prompt_layout = PROMPT_LAYOUT_APPEND
+                    if self.context_management == CONTEXT_MANAGEMENT_SUMMARIZE or self.response_cache or self.exact_cache:
+                        print("--> Context summaries and cached responses are kept per proxy worker, other workers compute them again.")
 
         except Exception as e:
             print(f"Failed to load config file {self.chatshell_config_path}: {e}")
             self.llm_server_config = None
 
-    def _run_server(self, shutdown_event):
+    def _run_server(self, shutdown_event, worker_id=0, listen_sock=None):
+        """
+        Run the proxy. With several workers, every worker runs this on the shared
+        listen_sock. Worker 0 is the primary: it manages the endpoint processes,
+        executes the slash commands (forwarded by the other workers through a
+        unix socket) and publishes the RAG state for the other workers.
+        """
         self.doc_base_dir.mkdir(parents=True, exist_ok=True)
 
+        primary             = worker_id == 0
+        primary_socket_path = self.config_dir / 'proxy_primary.sock'
+
         self.command_list = [
             "/chatwithfile",
+            "/chatwithfolder",
             "/chatwithwebsite",
+            "/usecollection",
             "/forgetcontext"
         ]
 
         # Start LLM server
-        llm_server                  = LocalLLMServer(termux_paths=self.termux)
+        llm_server                  = LocalLLMServer(termux_paths=self.termux, manage_processes=primary)
         llm_config_path        = llm_server.get_llm_config_path()
         llm_server_config_path = llm_server.get_llm_server_config_path()
 
         # Configure OpenAI API key
         if self.use_openai_api:
-            client = OpenAI(
+            client = AsyncOpenAI(
                 api_key=self.openai_api_token
             )
         else:
-            client = OpenAI(
+            client = AsyncOpenAI(
                 api_key="dummy",  # not used locally
                 base_url=self.endpoint_base_url  # llama.cpp server endpoint
             )
 
+        # Raw HTTP client for streaming passthrough (no parsing of the upstream chunks)
+        http_client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0))
+
+        # OpenAI clients for other upstream endpoints than the configured one (slot affinity)
+        upstream_clients = {}
+
         app = FastAPI(
             title="Open Prompt Proxy",
             description="A drop-in compatible OpenAI API wrapper that logs prompts and forwards requests.",
@@ -112,14 +251,149 @@ class Chatshell:
         )
 
         from .vectorstore import ChatshellVectorsearch
-        rag_provider    = ChatshellVectorsearch()
+        # Page texts of PDF files, cached by document hash for /summarize and RAG
+        pdf_extractor   = PdfExtractor(self.pdf_backend, self.config_dir / 'pdf_cache', self.pdf_cache_max_mb)
+
+        # In-process ONNX model or the embeddings endpoint of a llama-server (the inference endpoint if no URL is set)
+        embedding_backend = create_embedding_backend(
+            self.embedding_backend,
+            self.embedding_model,
+            self.embedding_base_url or self.endpoint_base_url,
+            self.embedding_dim,
+            self.embedding_quantize
+        )
+
+        rag_provider    = ChatshellVectorsearch(
+            embedding_model=embedding_backend,
+            pdf_extractor=pdf_extractor,
+            chunk_tokens=self.rag_chunk_tokens,
+            chunk_overlap_tokens=self.rag_chunk_overlap_tokens,
+            dedup=self.rag_dedup
+        )
         rag_enabled     = False
         context_enabled = False
 
+        # Persistent index of the whole document folder, kept up to date by the primary worker
+        folder_index    = None
+        if self.rag_folder_index and primary:
+            folder_index = FolderIndex(
+                ChatshellVectorsearch(embedding_model=rag_provider.embedding_model, pdf_extractor=pdf_extractor, chunker=rag_provider.chunker),
+                self.doc_base_dir,
+                self.config_dir / 'folder_index'
+            )
+            folder_index.load()
+
+        # Named collections, documents are loaded into the active one (if exactly one is active)
+        rag_collections     = RagCollections(
+            self.config_dir / 'collections',
+            rag_provider.embedding_model,
+            self.rag_collections_memory_mb * 2**20,
+            pdf_extractor,
+            rag_provider.chunker,
+            self.rag_dedup
+        )
+        active_collections  = []
+
+        # What RAG searches: rag_provider, the folder index or the active collections
+        rag_index       = rag_provider
+
+        # RAG index and switches shared between the proxy workers
+        shared_state    = None
+        primary_client  = None
+        if self.proxy_workers > 1:
+            shared_state = SharedRagState(self.config_dir / 'rag_shared')
+            if primary:
+                shared_state.publish(rag_index, rag_enabled, context_enabled, rag_provider.context_list)
+            else:
+                primary_client = httpx.AsyncClient(
+                    transport=httpx.AsyncHTTPTransport(uds=str(primary_socket_path)),
+                    base_url="http://chatshell-primary",
+                    timeout=httpx.Timeout(None, connect=10.0)
+                )
+
+        # Slash commands, blocking work runs in the command worker pool
+        commands        = CommandRegistry(max_workers=self.command_worker_threads)
+
+        # Changes of the vectorstore (write) against searches in it (read), searches run concurrently
+        rag_lock        = ReadWriteLock()
+        # Serializes writing the shared RAG state for the other workers
+        publish_lock    = asyncio.Lock()
+        # Serializes starting and stopping of local LLM endpoints
+        endpoint_lock   = asyncio.Lock()
+        # Serializes scans of the document folder
+        folder_lock     = asyncio.Lock()
+
+        # Placement of RAG and clipboard context in the forwarded prompt
+        prompt_assembler = PromptAssembler(layout=self.prompt_layout)
+
+        # Proxy metrics and event loop responsiveness
+        metrics         = ProxyMetrics()
+        lag_monitor     = EventLoopLagMonitor(metrics)
+
+        # Cached llama-server properties (slots, context size) of the upstream endpoints
+        server_props    = ServerPropsCache(http_client)
+
+        # Conversation to llama-server slot pinning
+        slot_router     = SlotRouter(http_client, server_props, metrics)
+
+        # Admission control and priority queueing per upstream endpoint
+        request_scheduler = None
+        if self.scheduler and not self.use_openai_api:
+            request_scheduler = RequestScheduler(
+                server_props,
+                max_inflight=self.scheduler_max_inflight,
+                max_queue=self.scheduler_max_queue,
+                queue_timeout_s=self.scheduler_queue_timeout_s,
+                metrics=metrics,
+                workers=self.proxy_workers
+            )
+
+        # Answers to repeated questions
+        semantic_cache  = SemanticResponseCache(
+            similarity_threshold=self.response_cache_similarity,
+            ttl_s=self.response_cache_ttl_s,
+            max_entries=self.response_cache_max_entries,
+            metrics=metrics
+        )
+
+        # Complete responses to identical deterministic requests, persisted in the config dir
+        exact_cache     = None
+        if self.exact_cache:
+            exact_cache = ExactResponseCache(
+                self.config_dir / 'response_cache',
+                max_entries=self.exact_cache_max_entries,
+                ttl_s=self.exact_cache_ttl_s,
+                metrics=metrics,
+                # Cache files are written in the command worker pool, not on the event loop
+                executor=commands.executor
+            )
+
+        # Trimming or summarizing of long conversation histories
+        context_manager = ContextWindowManager(
+            http_client,
+            server_props,
+            mode=self.context_management,
+            context_share=self.context_window_share,
+            metrics=metrics
+        )
+
+        @app.get("/chatshell/metrics")
+        async def get_metrics(reset: bool = False):
+            """Return proxy metrics (counters, event loop lag), optionally resetting them."""
+            snapshot = metrics.snapshot()
+            if request_scheduler is not None:
+                snapshot["scheduler"] = request_scheduler.status()
+            if self.proxy_workers > 1:
+                # Metrics are per worker
+                snapshot["worker"] = worker_id
+            if reset:
+                metrics.reset()
+            return JSONResponse(snapshot)
+
         @app.get("/v1/models")
         async def list_models():
             """Return a list of available models (mirrors OpenAI API)."""
-            models = client.models.list()
+            models = await client.models.list()
             models = models.model_dump_json()
             model_list = json.loads(models)
 
@@ -132,7 +406,7 @@ class Chatshell:
             # Use .to_dict() to get a serializable dictionary.
             return JSONResponse(model_list)
         
-        def rag_update_file(document_path):
+        def rag_update_file(document_path, vectorsearch):
             # Split paths if more than one
             document_paths_arg = document_path.split(";")
 
@@ -156,15 +430,15 @@ class Chatshell:
                 return False
 
             # Update RAG
-            rag_update_ok = rag_provider.init_vectorstore_pdf(document_paths_exist)
+            rag_update_ok = vectorsearch.init_vectorstore_pdf(document_paths_exist)
             return rag_update_ok
         
-        def rag_update_web(url, deep):
+        def rag_update_web(url, deep, vectorsearch):
             # Split paths if more than one
             urls = url.split(";")
 
             # Update RAG
-            rag_update_ok = rag_provider.init_vectorstore_web(urls, deep)
+            rag_update_ok = vectorsearch.init_vectorstore_web(urls, deep)
 
             return rag_update_ok
 
@@ -200,32 +474,149 @@ class Chatshell:
                     ]
                 )
                 yield chunk_obj
-                time.sleep(0.1)  # simulate streaming delay
         
-        async def event_generator(generator, sources=None):
-            for element in generator:
-                yield element.model_dump_json()
-
-            # After streaming, append sources if present
-            if sources:
-                sources_text = "\n\n---\nSources:\n" + "\n".join(sources)
-                # Yield as a final chunk in OpenAI streaming format
-                sources_chunk = ChatCompletionChunk(
-                    id=f"chatcmpl-{uuid.uuid4().hex[:24]}",
-                    object="chat.completion.chunk",
-                    created=int(time.time()),
-                    model="generic",
-                    choices=[
-                        Choice(
-                            index=0,
-                            delta=ChoiceDelta(content=sources_text),
-                            finish_reason="stop"
-                        )
-                    ]
-                )
-                yield sources_chunk.model_dump_json()
-
-            yield "[DONE]"
+        async def event_generator(generator, sources=None, trace=None, leases=(), on_complete=None):
+            stream_start = time.perf_counter()
+            # Content and sent events are only collected if the complete response is needed
+            sent_events = [] if on_complete is not None else None
+            content_parts = []
+            finish_reason = None
+            generated_chunks = 0
+            try:
+                if hasattr(generator, "__aiter__"):
+                    # Upstream stream of the async OpenAI client
+                    timings_recorded = False
+                    async for element in generator:
+                        metrics.increment("stream_chunks")
+                        generated_chunks += 1
+                        if not timings_recorded and element.model_extra and "timings" in element.model_extra:
+                            record_upstream_timings(element.model_extra["timings"])
+                            timings_recorded = True
+                        event = element.model_dump_json()
+                        if sent_events is not None:
+                            sent_events.append(event)
+                            if element.choices:
+                                content_parts.append(element.choices[0].delta.content or "")
+                                finish_reason = element.choices[0].finish_reason or finish_reason
+                        yield event
+                else:
+                    for element in generator:
+                        metrics.increment("stream_chunks")
+                        yield element.model_dump_json()
+
+                # After streaming, append sources if present
+                if sources:
+                    sources_text = "\n\n---\nSources:\n" + "\n".join(sources)
+                    # Yield as a final chunk in OpenAI streaming format
+                    sources_chunk = ChatCompletionChunk(
+                        id=f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                        object="chat.completion.chunk",
+                        created=int(time.time()),
+                        model="generic",
+                        choices=[
+                            Choice(
+                                index=0,
+                                delta=ChoiceDelta(content=sources_text),
+                                finish_reason="stop"
+                            )
+                        ]
+                    )
+                    event = sources_chunk.model_dump_json()
+                    if sent_events is not None:
+                        sent_events.append(event)
+                    yield event
+
+                yield "[DONE]"
+
+                if on_complete is not None and finish_reason == "stop":
+                    # Complete response, e.g. for the response caches
+                    sent_events.append("[DONE]")
+                    on_complete("".join(content_parts), "".join(f"data: {event}\n\n" for event in sent_events).encode("utf-8"))
+
+            except (asyncio.CancelledError, GeneratorExit):
+                # Client closed the stream, the tokens generated so far are not read
+                record_client_disconnect(generated_chunks)
+                raise
+
+            finally:
+                if hasattr(generator, "close") and hasattr(generator, "__aiter__"):
+                    # Stop the generation on the upstream immediately
+                    await close_upstream(generator.close)
+                release_leases(leases)
+                if trace is not None:
+                    # Streamed request is complete -> record stream duration and log trace
+                    trace.add_span("stream", (time.perf_counter() - stream_start) * 1000.0)
+                    trace.finish()
+
+        def release_leases(leases):
+            # Slot leases and admission tickets of a completed request
+            for lease in leases:
+                lease.release()
+
+        def record_client_disconnect(generated_tokens=0):
+            # llama-server streams one token per event
+            metrics.increment("client_disconnects")
+            metrics.increment("wasted_tokens", generated_tokens)
+
+        def record_upstream_timings(timings):
+            # llama-server reports how many prompt tokens had to be processed (prompt_n)
+            # and how many were reused from the prompt cache (cache_n)
+            if not isinstance(timings, dict):
+                return
+            if "prompt_n" in timings:
+                metrics.observe("prefill_tokens", timings["prompt_n"])
+            if "cache_n" in timings:
+                metrics.observe("cached_prompt_tokens", timings["cache_n"])
+            if "prompt_ms" in timings:
+                metrics.observe("prefill_ms", timings["prompt_ms"])
+
+        async def passthrough_generator(upstream_response, sources=None, trace=None, leases=(), on_complete=None):
+            stream_start = time.perf_counter()
+            inject_event = build_sources_event(sources) if sources else None
+            timings_sniffer = TimingsSniffer()
+            # Content is only parsed and the stream kept if the complete response is needed
+            transcript = StreamTranscript() if on_complete is not None else None
+            sent_data = []
+            generated_events = 0
+            try:
+                async for data in passthrough_stream(upstream_response, inject_event):
+                    metrics.increment("passthrough_bytes", len(data))
+                    generated_events += data.count(b"data: ")
+                    timings_sniffer.feed(data)
+                    if transcript is not None:
+                        transcript.feed(data)
+                        sent_data.append(data)
+                    yield data
+
+                if transcript is not None and transcript.done and transcript.finish_reason == "stop":
+                    on_complete(transcript.text, b"".join(sent_data))
+
+            except (asyncio.CancelledError, GeneratorExit):
+                record_client_disconnect(generated_events)
+                raise
+
+            finally:
+                await close_upstream(upstream_response.aclose)
+                release_leases(leases)
+                if timings_sniffer.timings is not None:
+                    record_upstream_timings(timings_sniffer.timings)
+                if trace is not None:
+                    trace.add_span("stream", (time.perf_counter() - stream_start) * 1000.0)
+                    trace.finish()
+
+        async def open_upstream_stream(payload, base_url):
+            # Send the request to the upstream /chat/completions endpoint and return the unread streaming response
+            headers = {
+                "Authorization": f"Bearer {client.api_key}",
+                "Accept": "text/event-stream",
+            }
+            upstream_request = http_client.build_request(
+                "POST",
+                f"{base_url}/chat/completions",
+                json=payload,
+                headers=headers
+            )
+            return await http_client.send(upstream_request, stream=True)
 
         def get_text_clipboard():
             try:
@@ -240,12 +631,27 @@ class Chatshell:
             else:
                 return content
 
-        def endpoint_avail()->bool:
-            if self.use_openai_api == False and llm_server.process_started() == False:
-                # OpenAI endpoint turned off and no local endpoint available
-                return False
-            else:
+        # Time until which the configured upstream endpoint is known to be reachable
+        upstream_checked_until = 0.0
+
+        async def endpoint_avail()->bool:
+            nonlocal upstream_checked_until
+            if self.use_openai_api or llm_server.process_started():
+                return True
+
+            # No managed local endpoint -> check if the configured endpoint is served externally
+            if time.monotonic() < upstream_checked_until:
                 return True
+            try:
+                response = await http_client.get(f"{str(client.base_url).rstrip('/')}/models", timeout=2.0)
+                if response.status_code == 200:
+                    upstream_checked_until = time.monotonic() + 10.0
+                    return True
+            except httpx.HTTPError:
+                pass
+
+            # OpenAI endpoint turned off and no local endpoint available
+            return False
             
         def format_model_list(avail_models):
             header = (
@@ -264,222 +670,275 @@ class Chatshell:
                 rows.append(row)
             return header + "\n".join(rows)
 
-        @app.post("/v1/chat/completions")
-        async def chat_completions(request: Request):
-            nonlocal rag_enabled, rag_provider, context_enabled, llm_server
-            try:
-                payload = await request.json()
+        def command_response(text):
+            stream_response = generate_chat_completion_chunks(text)
+            return EventSourceResponse(event_generator(stream_response))
 
-                # Get last user message
-                messages = payload.get("messages", [])
+        def load_summary_input(input_path_url):
+            """
+            Collects the texts to summarize from clipboard, website or document.
+            Returns the list of texts and an error message (None if successful).
+            """
+            chunk_list = []
+
+            # Check if argument is clipboard content
+            if "/clipboard" in input_path_url:
+                # Handle as Clipboard content
+                clip_content = get_text_clipboard()
+                if clip_content != None:
+                    chunk_list = [clip_content]
+                else:
+                    return chunk_list, "The clipboard is empty or not valid text content."
 
-                # Remove any message whose content matches a command in command list, and the following message
-                # EXCEPT if the command is in the last message.
-                i = 0
-                while i < len(messages) - 1:  # never remove the last message
-                    content = messages[i].get("content", "")
-                    if any(content.strip().startswith(cmd) for cmd in self.command_list):
-                        del messages[i]
-                        # After deletion, the next message is now at index i (unless it was the last)
-                        if i < len(messages) - 1:
-                            del messages[i]
-                        # Do not increment i, as the next message is now at the same index
-                    else:
-                        i += 1
+            # Use is_url to check if input_path_url is a URL or a file path
+            elif is_url(input_path_url):
+                # Handle as URL
+                # Crawl website
+                print(f"-> Crawling {input_path_url}.")
+                page_contents = crawl_website(input_path_url, 5, max_depth=1)
 
-                last_message = messages[-1]  # This is a dict: {"role": "...", "content": "..."}
-                last_user_message = last_message.get("content", "")
+                if page_contents is not None and len(page_contents) > 0:
 
-                stream = payload.get("stream", False)
+                    for page_text, page_url in page_contents:
+                        chunk_list.append(page_text)
 
-                # ==== Start command control sequence ====
-                
-                tokens = last_user_message.split()
-                command = tokens[0].lower()
-                args = tokens[1:]
+            else:
+                # Handle as file path
+                doc_current = input_path_url
 
-                if command == "/help":
-                    # send back test message
-                    command_list = (
-                                    "| Command | Description |\n"
-                                    "|---------|-------------|\n"
-                                    "| `/help` | Show this help message |\n"
-                                    "| `/chatwithfile <filename.pdf>` | Load a PDF or text file and chat with it |\n"
-                                    "| `/chatwithwebsite <URL>` | Load a website and chat with it |\n"
-                                    "| `/chatwithwebsite /deep <URL>` | Load a website, visit all sublinks, and chat with it |\n"
-                                    "| `/chatwithclipbrd` | Fetch content from clipboard and chat with the contents |\n"
-                                    "| `/summarize <filename.pdf or URL>` | Summarize a document or website and chat with the summary |\n"
-                                    "| `/summarize /clipboard` | Summarize the contents of the clipboard and chat with the summary |\n"
-                                    "| `/addclipboard` | Add the content of the clipboard to every message in the chat |\n"
-                                    "| `/forgetcontext` | Disable background injection of every kind of content |\n"
-                                    "| `/forgetall` | Disable RAG and all inserted contexts |\n"
-                                    "| `/forgetctx` | Disable inserted context only |\n"
-                                    "| `/forgetdoc` | Disable RAG (document/website context) only |\n"
-                                    "| `/updatemodels` | Update the LLM model catalog from GitHub |\n"
-                                    "| `/startendpoint <Endpoint config name>` | Start a specific LLM endpoint |\n"
-                                    "| `/restartendpoint <Endpoint config name>` | Restart a specific LLM endpoint |\n"
-                                    "| `/stopendpoint <Endpoint config name>` | Stop a specific LLM endpoint |\n"
-                                    "| `/stopallendpnts` | Stop all LLM inference endpoints |\n"
-                                    "| `/llmstatus` | Show the status of local LLM inference endpoints |\n"
-                                    "| `/setautostartendpoint <LLM endpoint name>` | Set a specific LLM endpoint for autostart |\n"
-                                    "| `/listendpoints` | List all available LLM endpoint configs |\n"
-                                    "| `/shellmode` | Activate shell mode for this chat (no LLM interaction) |\n"
-                                    "| `/exit` | Quit chatshell server |\n"
-                                    )
+                if not os.path.isfile(doc_current):
+                    # Document is not available at absolute path, checking rel. path
+                    doc_current = os.path.join(self.doc_base_dir, doc_current)
+                    if not os.path.isfile(doc_current):
+                        # Document is not available -> return error
+                        print(f"--> Document {input_path_url} not found.")
+                        return chunk_list, f"The document {input_path_url} was not found.\nPlease enter a valid document path."
 
-                    stream_response = generate_chat_completion_chunks(command_list)
-                    return EventSourceResponse(event_generator(stream_response))
-                
-                if command == "/chatwithfile":
-                    if len(args) != 1:
-                        stream_response = generate_chat_completion_chunks("Usage: /chatwithfile <Path to PDF or txt file>")
-                        return EventSourceResponse(event_generator(stream_response))
-                   
-                    else:
-                        rag_update_ok = rag_update_file(args[0])
+                # --> Read PDF pages into chunk list, one entry per page (cached for a later /chatwithfile)
+                chunk_list = pdf_extractor.page_texts(doc_current)
 
-                        if rag_update_ok:
-                            rag_enabled = True
-                            stream_response = generate_chat_completion_chunks(f"Ready, you can now chat with {args[0]}!")
-                            return EventSourceResponse(event_generator(stream_response))
-                        else:
-                            rag_enabled = False
-                            stream_response = generate_chat_completion_chunks(f"There was an error while reading the document {args[0]}, please try again.")
-                            return EventSourceResponse(event_generator(stream_response))
-                        
-                if command == "/chatwithwebsite":
-                    if "/deep" in last_user_message:
-                        # If deep flag -> args must be 2
-                        deep_crawl = True
-
-                        if len(args) != 2:
-                            stream_response = generate_chat_completion_chunks("Usage: /chatwithwebsite /deep <URL>")
-                            return EventSourceResponse(event_generator(stream_response))
-
-                        com_index = 1
-    
-                    else:
-                        deep_crawl = False
+            return chunk_list, None
 
-                        if len(args) != 1:
-                            stream_response = generate_chat_completion_chunks("Usage: /chatwithwebsite <URL>")
-                            return EventSourceResponse(event_generator(stream_response))
+        def collection_target(name):
+            if not rag_collections.exists(name):
+                return rag_collections.create(name)
+            return rag_collections.get(name)
 
-                        com_index = 0
+        async def ingest(build):
+            """
+            Index documents with build(vectorsearch) into a staging vectorsearch while
+            searches continue. When it is complete, it replaces rag_provider or is added
+            to the active collection under rag_lock. Returns None if several collections
+            are active.
+            """
+            nonlocal rag_enabled, rag_index
+            if len(active_collections) > 1:
+                return None
+            collection = active_collections[0] if len(active_collections) == 1 else None
 
-                    rag_update_ok = rag_update_web(args[com_index], deep_crawl)
+            staging = rag_provider.new_staging()
+            rag_update_ok = await commands.run_blocking(build, staging)
+            if not rag_update_ok:
+                # The live index is untouched
+                return False
 
-                    if rag_update_ok:
-                        rag_enabled = True
-                        stream_response = generate_chat_completion_chunks(f"Ready, you can now chat with {args[com_index]}!")
-                        return EventSourceResponse(event_generator(stream_response))
-                    else:
-                        rag_enabled = False
-                        stream_response = generate_chat_completion_chunks(f"There was an error while reading the document {args[com_index]}, please try again.")
-                        return EventSourceResponse(event_generator(stream_response))
-                    
-                if command == "/chatwithclipbrd":
-
-                    # Handle as Clipboard content
-                    clip_content = get_text_clipboard()
-                    if clip_content != None:
-                        # RAG update with clipboard content
-                        rag_update_ok = rag_provider.init_vectorstore_str(clip_content)
-                    else:
-                        stream_response = generate_chat_completion_chunks(f"The clipboard is empty or not valid text content.")
-                        return EventSourceResponse(event_generator(stream_response))
-                    
-                    if rag_update_ok:
-                        rag_enabled = True
-                        stream_response = generate_chat_completion_chunks("Ready, you can now chat with the clipboard content!")
-                        return EventSourceResponse(event_generator(stream_response))
-                    else:
-                        rag_enabled = False
-                        stream_response = generate_chat_completion_chunks("There was an error while clipboard content, please try again.")
-                        return EventSourceResponse(event_generator(stream_response))
-                    
-                if command == "/summarize":
-                    additional_prompt = ""
-                    use_add_prompt = False
-
-                    # Regex to match /prompt:"...prompt text..." at the end
-                    prompt_pattern = r'/prompt:"([^"]+)"\s*$'
-
-                    # Check if /prompt is present at the end of the message
-                    prompt_match = re.search(prompt_pattern, last_user_message)
-                    if prompt_match:
-                        additional_prompt = prompt_match.group(1)
-                        use_add_prompt = True
-                        # Remove the /prompt:"..." part from args for further processing
-                        # Remove last arg if it is /prompt:"..."
-                        if args and args[-1].startswith('/prompt:'):
-                            args = args[:-1]
-
-                    if len(args) != 1:
-                        stream_response = generate_chat_completion_chunks("Usage: /summarize <Path to PDF URL> (/prompt:\"Additional instructions for summarization\")")
-                        return EventSourceResponse(event_generator(stream_response))
-                   
-                    else:
-                        if not endpoint_avail():
-                            # No public OpenAI connection configured and local endpoint not available
-                            stream_response = generate_chat_completion_chunks("There is no LLM inference endpoint available. Please configure first and try again.")
-                            return EventSourceResponse(event_generator(stream_response))
-                
-                        chunk_list = []
-                        input_path_url = args[0]
-
-                        # Check if argument is clipboard content
-                        if "/clipboard" in input_path_url:
-                            # Handle as Clipboard content
-                            clip_content = get_text_clipboard()
-                            if clip_content != None:
-                                chunk_list = [clip_content]
-                            else:
-                                stream_response = generate_chat_completion_chunks(f"The clipboard is empty or not valid text content.")
-                                return EventSourceResponse(event_generator(stream_response))
-
-                        # Use is_url to check if input_path_url is a URL or a file path
-                        elif is_url(input_path_url):
-                            # Handle as URL
-                            # Crawl website
-                            print(f"-> Crawling {input_path_url}.")
-                            from vectorstore import crawl_website
-                            page_contents = crawl_website(input_path_url, 5, max_depth=1)
-
-                            if page_contents is not None and len(page_contents) > 0:
-
-                                for page_text, page_url in page_contents:
-                                    chunk_list.append(page_text)
+            async with rag_lock.write():
+                if collection is None:
+                    rag_provider.swap_in(staging)
+                    ingested_index = rag_provider
+                else:
+                    # Documents are added to the collection, then it is saved and searched
+                    vectorsearch = await commands.run_blocking(collection_target, collection)
+                    await commands.run_blocking(vectorsearch.append, staging)
+                    await commands.run_blocking(rag_collections.save, collection)
+                    ingested_index = await commands.run_blocking(rag_collections.search, [collection])
+                    await commands.run_blocking(rag_collections.evict, [collection])
+
+                # Collections selected meanwhile stay selected
+                if active_collections == ([collection] if collection is not None else []):
+                    rag_index   = ingested_index
+                    rag_enabled = True
+            return True
+
+        several_collections_text = "Several collections are active, select the one to load documents into with /usecollection <name>."
+
+        # ==== Slash command handlers ====
+
+        @commands.command("/help", help=[("/help", "Show this help message")])
+        async def command_help(ctx: CommandContext):
+            return command_response(commands.help_table())
+
+        @commands.command("/chatwithfile", help=[("/chatwithfile <filename.pdf>", "Load a PDF or text file and chat with it")])
+        async def command_chatwithfile(ctx: CommandContext):
+            if len(ctx.args) != 1:
+                return command_response("Usage: /chatwithfile <Path to PDF or txt file>")
+
+            rag_update_ok = await ingest(lambda vectorsearch: rag_update_file(ctx.args[0], vectorsearch))
+            if rag_update_ok is None:
+                return command_response(several_collections_text)
+
+            if rag_update_ok:
+                return command_response(f"Ready, you can now chat with {ctx.args[0]}!")
+            else:
+                return command_response(f"There was an error while reading the document {ctx.args[0]}, please try again.")
 
-                        else:
-                            # Handle as file path
-                            doc_current = input_path_url
-
-                            if not os.path.isfile(doc_current):
-                                # Document is not available at absolute path, checking rel. path
-                                doc_current = os.path.join(self.doc_base_dir, doc_current)
-                                if not os.path.isfile(doc_current):
-                                    # Document is not available -> return error
-                                    print(f"--> Document {input_path_url} not found.")
-                                    stream_response = generate_chat_completion_chunks(f"The document {input_path_url} was not found.\nPlease enter a valid document path.")
-                                    return EventSourceResponse(event_generator(stream_response))
-
-                            # --> Read PDF pages into chunk list
-                            reader = PdfReader(doc_current)
-
-                            # Load each page's text into a list, one entry per page
-                            for page in reader.pages:
-                                text = page.extract_text()
-                                chunk_list.append(text)
-
-                        try:
-                            # Create summary
-                            print("--> Start summarization...")
-                            text_summary = rag_provider.generate_text_summary(chunk_list)
-                            print("--> Generated summary chunks.")
-
-                            # Build context
-                            instructions_summarization =   f"""Task:\n
+        @commands.command("/chatwithwebsite", help=[
+            ("/chatwithwebsite <URL>", "Load a website and chat with it"),
+            ("/chatwithwebsite /deep <URL>", "Load a website, visit all sublinks, and chat with it"),
+        ])
+        async def command_chatwithwebsite(ctx: CommandContext):
+            if "/deep" in ctx.message:
+                # If deep flag -> args must be 2
+                deep_crawl = True
+
+                if len(ctx.args) != 2:
+                    return command_response("Usage: /chatwithwebsite /deep <URL>")
+
+                com_index = 1
+
+            else:
+                deep_crawl = False
+
+                if len(ctx.args) != 1:
+                    return command_response("Usage: /chatwithwebsite <URL>")
+
+                com_index = 0
+
+            rag_update_ok = await ingest(lambda vectorsearch: rag_update_web(ctx.args[com_index], deep_crawl, vectorsearch))
+            if rag_update_ok is None:
+                return command_response(several_collections_text)
+
+            if rag_update_ok:
+                return command_response(f"Ready, you can now chat with {ctx.args[com_index]}!")
+            else:
+                return command_response(f"There was an error while reading the document {ctx.args[com_index]}, please try again.")
+
+        @commands.command("/chatwithfolder", help=[("/chatwithfolder", "Chat with all documents in the document folder (persistent index)")])
+        async def command_chatwithfolder(ctx: CommandContext):
+            nonlocal rag_enabled, rag_index, active_collections
+            if folder_index is None:
+                return command_response('The folder index is disabled, set "rag-folder-index" to "True" in chatshell_server_config.json.')
+
+            # Picks up changes since the last periodic scan
+            changes = await sync_folder_index()
+
+            if folder_index.vectorsearch.live_count() == 0:
+                return command_response(f"There are no readable documents in {self.doc_base_dir}.")
+
+            rag_index   = folder_index.vectorsearch
+            rag_enabled = True
+            active_collections = []
+            return command_response(f"Ready, you can now chat with the {len(folder_index.files)} documents in {self.doc_base_dir}! (Changes: {change_summary(changes)})")
+
+        @commands.command("/usecollection", help=[
+            ("/usecollection <name>", "Switch to a named RAG collection (created if new), documents are added to it"),
+            ("/usecollection <name1;name2>", "Chat with several collections at once"),
+        ])
+        async def command_usecollection(ctx: CommandContext):
+            nonlocal rag_enabled, rag_index, active_collections
+            if len(ctx.args) != 1:
+                return command_response("Usage: /usecollection <name> or /usecollection <name1;name2>")
+
+            names = [name for name in ctx.args[0].split(";") if name]
+            invalid = [name for name in names if not rag_collections.valid_name(name)]
+            if len(names) == 0 or len(invalid) > 0:
+                return command_response(f"Invalid collection name {', '.join(invalid)}, use letters, digits, '.', '-' and '_' only.")
+
+            missing = [name for name in names if not rag_collections.exists(name)]
+            if len(names) == 1 and len(missing) == 1:
+                rag_collections.create(names[0])
+                active_collections = names
+                rag_enabled = False
+                rag_index   = rag_provider
+                return command_response(f"Collection '{names[0]}' created. Load documents into it with /chatwithfile, /chatwithwebsite or /chatwithclipbrd.")
+            if len(missing) > 0:
+                return command_response(f"The collections {', '.join(missing)} do not exist.")
+
+            async with rag_lock.write():
+                try:
+                    collection_search = await commands.run_blocking(rag_collections.search, names)
+                except (OSError, ValueError, KeyError) as e:
+                    return command_response(f"There was an error while loading the collections {', '.join(names)}: {e}")
+                await commands.run_blocking(rag_collections.evict, names)
+
+            active_collections = names
+            rag_index   = collection_search
+            rag_enabled = True
+            return command_response(f"Ready, you can now chat with the collection{'s' if len(names) > 1 else ''} {', '.join(names)}!")
+
+        @commands.command("/listcollections", help=[("/listcollections", "List the RAG collections")])
+        async def command_listcollections(ctx: CommandContext):
+            rows = rag_collections.status()
+            if len(rows) == 0:
+                return command_response("There are no collections yet, create one with /usecollection <name>.")
+
+            table = "| Collection | Chunks | Sources | Memory |\n|--------------|--------------|--------------|--------------|\n"
+            table += "\n".join(
+                f"| {row['name']}{' (active)' if row['name'] in active_collections else ''} | {row['chunks']} | {row['sources']} | "
+                + (f"{row['memory_mb']:.1f} MB |" if row["resident"] else "on disk |")
+                for row in rows
+            )
+            return command_response(table)
+
+        @commands.command("/chatwithclipbrd", help=[("/chatwithclipbrd", "Fetch content from clipboard and chat with the contents")])
+        async def command_chatwithclipbrd(ctx: CommandContext):
+
+            # Handle as Clipboard content
+            clip_content = await commands.run_blocking(get_text_clipboard)
+            if clip_content == None:
+                return command_response("The clipboard is empty or not valid text content.")
+
+            # RAG update with clipboard content
+            rag_update_ok = await ingest(lambda vectorsearch: vectorsearch.init_vectorstore_str(clip_content))
+            if rag_update_ok is None:
+                return command_response(several_collections_text)
+
+            if rag_update_ok:
+                return command_response("Ready, you can now chat with the clipboard content!")
+            else:
+                return command_response("There was an error while clipboard content, please try again.")
+
+        @commands.command("/summarize", help=[
+            ("/summarize <filename.pdf or URL>", "Summarize a document or website and chat with the summary"),
+            ("/summarize /clipboard", "Summarize the contents of the clipboard and chat with the summary"),
+        ])
+        async def command_summarize(ctx: CommandContext):
+            args = ctx.args
+            additional_prompt = ""
+            use_add_prompt = False
+
+            # Regex to match /prompt:"...prompt text..." at the end
+            prompt_pattern = r'/prompt:"([^"]+)"\s*$'
+
+            # Check if /prompt is present at the end of the message
+            prompt_match = re.search(prompt_pattern, ctx.message)
+            if prompt_match:
+                additional_prompt = prompt_match.group(1)
+                use_add_prompt = True
+                # Remove the /prompt:"..." part from args for further processing
+                # Remove last arg if it is /prompt:"..."
+                if args and args[-1].startswith('/prompt:'):
+                    args = args[:-1]
+
+            if len(args) != 1:
+                return command_response("Usage: /summarize <Path to PDF URL> (/prompt:\"Additional instructions for summarization\")")
+
+            if not await endpoint_avail():
+                # No public OpenAI connection configured and local endpoint not available
+                return command_response("There is no LLM inference endpoint available. Please configure first and try again.")
+
+            chunk_list, error_text = await commands.run_blocking(load_summary_input, args[0])
+            if error_text is not None:
+                return command_response(error_text)
+
+            try:
+                # Create summary
+                print("--> Start summarization...")
+                text_summary = await commands.run_blocking(rag_provider.generate_text_summary, chunk_list)
+                print("--> Generated summary chunks.")
+
+                # Build context
+                instructions_summarization =   f"""Task:\n
                                 - You are a summarization assistant.\n
                                 - Your goal is to write a summary of a list of given texts that represent a docuemnt.\n
                                 Rewrite Requirements:\n
@@ -493,261 +952,689 @@ class Chatshell:
                                 Output Format:\n
                                 - Provide only the summary - no explanations or extra text.\n"""
 
-                            if use_add_prompt and additional_prompt:
-                                instructions_summarization += f"\nAdditional Prompt:\n{additional_prompt}\n"
-
-                            instructions_summarization += f"Text list:\n{text_summary}\nSummary:\n"
-
-                            # Invoke inference for summarization
-                            input_msg_summarization = [
-                                    {
-                                        "role": "user",
-                                        "content": instructions_summarization,
-                                    }
-                                ]
-                        
-                            response_summarization = client.chat.completions.create(
-                                                    model=payload.get("model", "generic"),
-                                                    messages=input_msg_summarization,
-                                                    stream=True,
-                                                    temperature=0.1,
-                                                )
-                        except Exception as e:
-                            stream_response = generate_chat_completion_chunks(f"There was an error while creating the summary: {str(e)}")
-                            return EventSourceResponse(event_generator(stream_response))
-
-                        return EventSourceResponse(event_generator(response_summarization))
-                        
-                if command == "/addclipboard":
-                    # Add all clipboard content to context list
-                    context_enabled = True
-
-                    clip_content = get_text_clipboard()
-                    if clip_content != None:
-                        rag_provider.add_context(clip_content)
-                        stream_response = generate_chat_completion_chunks(f"The clipboard content was inserted into context.")
-                        return EventSourceResponse(event_generator(stream_response))
-                    else:
-                        stream_response = generate_chat_completion_chunks(f"The clipboard is empty or not valid text content.")
-                        return EventSourceResponse(event_generator(stream_response))
-                
-                if command == "/forgetall":
-                    # Disable RAG and other inserted contexts
-                    rag_enabled     = False
-                    context_enabled = False
-                    rag_provider.reset_context()
-                    stream_response = generate_chat_completion_chunks("Document or website context is no longer included in chat.")
-                    return EventSourceResponse(event_generator(stream_response))
-                
-                if command == "/forgetctx":
-                    # Disable other inserted contexts
-                    context_enabled = False
-                    rag_provider.reset_context()
-                    stream_response = generate_chat_completion_chunks("Context is no longer included in chat.")
-                    return EventSourceResponse(event_generator(stream_response))
-                
-                if command == "/forgetdoc":
-                    # Disable RAG
-                    rag_enabled     = False
-                    stream_response = generate_chat_completion_chunks("Document or website context is no longer included in chat.")
-                    return EventSourceResponse(event_generator(stream_response))
-                
-                if command == "/updatemodels":
-                    # Fetch current version of model catalog from github
-                    update_models_ok = llm_server.update_model_catalog()
+                if use_add_prompt and additional_prompt:
+                    instructions_summarization += f"\nAdditional Prompt:\n{additional_prompt}\n"
 
-                    if update_models_ok:
-                        # Fetch model list and output
-                        models_avail = llm_server.get_endpoints()
-                        stream_response = generate_chat_completion_chunks(format_model_list(models_avail))
-                        return EventSourceResponse(event_generator(stream_response))
+                instructions_summarization += f"Text list:\n{text_summary}\nSummary:\n"
 
-                    else:
-                        stream_response = generate_chat_completion_chunks(f"Updating the LLM model catalog failed.")
-                        return EventSourceResponse(event_generator(stream_response))
-
-                if command == "/startendpoint":
-                    # Starts a specific LLM endpoint
-                    if len(args) != 1:
-                        stream_response = generate_chat_completion_chunks("Usage: /startendpoint <Endpoint config name>")
-                        return EventSourceResponse(event_generator(stream_response))
-                   
-                    else:
-                        start_endpoint_ok, output = llm_server.create_endpoint(args[0])
+                # Invoke inference for summarization
+                input_msg_summarization = [
+                        {
+                            "role": "user",
+                            "content": instructions_summarization,
+                        }
+                    ]
 
-                        stream_response = generate_chat_completion_chunks(output)
-                        return EventSourceResponse(event_generator(stream_response))
+                response_summarization = await client.chat.completions.create(
+                                        model=ctx.payload.get("model", "generic"),
+                                        messages=input_msg_summarization,
+                                        stream=True,
+                                        temperature=0.1,
+                                    )
+            except Exception as e:
+                return command_response(f"There was an error while creating the summary: {str(e)}")
 
-                if command == "/restartendpoint":
-                    # Restart a certain LLM inference endpoint
-                    if len(args) != 1:
-                        stream_response = generate_chat_completion_chunks("Usage: /restartendpoint <Endpoint config name>")
-                        return EventSourceResponse(event_generator(stream_response))
-                   
-                    else:
-                        start_endpoint_ok, output = llm_server.restart_process(args[0])
+            return EventSourceResponse(event_generator(response_summarization))
 
-                        stream_response = generate_chat_completion_chunks(output)
-                        return EventSourceResponse(event_generator(stream_response))
+        @commands.command("/addclipboard", help=[("/addclipboard", "Add the content of the clipboard to every message in the chat")])
+        async def command_addclipboard(ctx: CommandContext):
+            nonlocal context_enabled
+            # Add all clipboard content to context list
+            context_enabled = True
 
-                if command == "/stopendpoint":
-                    # Stop a certain LLM inference endpoint
-                    if len(args) != 1:
-                        stream_response = generate_chat_completion_chunks("Usage: /stopendpoint <Endpoint config name>")
-                        return EventSourceResponse(event_generator(stream_response))
-                   
-                    else:
-                        stop_endpoint_ok, output = llm_server.stop_process(args[0])
+            clip_content = await commands.run_blocking(get_text_clipboard)
+            if clip_content != None:
+                rag_provider.add_context(clip_content)
+                return command_response("The clipboard content was inserted into context.")
+            else:
+                return command_response("The clipboard is empty or not valid text content.")
+
+        @commands.command("/forgetall", help=[("/forgetall", "Disable RAG and all inserted contexts")])
+        @commands.command("/forgetcontext", help=[("/forgetcontext", "Disable background injection of every kind of content")])
+        async def command_forgetall(ctx: CommandContext):
+            nonlocal rag_enabled, context_enabled, rag_index, active_collections
+            # Disable RAG and other inserted contexts
+            rag_enabled     = False
+            context_enabled = False
+            active_collections  = []
+            rag_index           = rag_provider
+            rag_provider.reset_context()
+            return command_response("Document or website context is no longer included in chat.")
+
+        @commands.command("/forgetctx", help=[("/forgetctx", "Disable inserted context only")])
+        async def command_forgetctx(ctx: CommandContext):
+            nonlocal context_enabled
+            # Disable other inserted contexts
+            context_enabled = False
+            rag_provider.reset_context()
+            return command_response("Context is no longer included in chat.")
+
+        @commands.command("/forgetdoc", help=[("/forgetdoc", "Disable RAG (document/website context) only")])
+        async def command_forgetdoc(ctx: CommandContext):
+            nonlocal rag_enabled, rag_index, active_collections
+            # Disable RAG, documents are loaded without collection again
+            rag_enabled     = False
+            active_collections  = []
+            rag_index           = rag_provider
+            return command_response("Document or website context is no longer included in chat.")
+
+        @commands.command("/updatemodels", help=[("/updatemodels", "Update the LLM model catalog from GitHub")])
+        async def command_updatemodels(ctx: CommandContext):
+            # Fetch current version of model catalog from github
+            update_models_ok = await commands.run_blocking(llm_server.update_model_catalog)
+
+            if update_models_ok:
+                # Fetch model list and output
+                models_avail = llm_server.get_endpoints()
+                return command_response(format_model_list(models_avail))
+            else:
+                return command_response("Updating the LLM model catalog failed.")
+
+        @commands.command("/downloadmodel", help=[("/downloadmodel <Endpoint config name>", "Download the model file of an endpoint config")])
+        async def command_downloadmodel(ctx: CommandContext):
+            # Download the model of a config set (hf-repo / hf-file) into the model dir
+            if len(ctx.args) != 1:
+                return command_response("Usage: /downloadmodel <Endpoint config name>")
+
+            download_ok, output = await commands.run_blocking(llm_server.download_model, ctx.args[0])
+            return command_response(output)
+
+        @commands.command("/startendpoint", help=[("/startendpoint <Endpoint config name>", "Start a specific LLM endpoint")])
+        async def command_startendpoint(ctx: CommandContext):
+            # Starts a specific LLM endpoint
+            if len(ctx.args) != 1:
+                return command_response("Usage: /startendpoint <Endpoint config name>")
+
+            async with endpoint_lock:
+                start_endpoint_ok, output = await commands.run_blocking(llm_server.create_endpoint, ctx.args[0])
+                server_props.invalidate()
+
+            return command_response(output)
+
+        @commands.command("/restartendpoint", help=[("/restartendpoint <Endpoint config name>", "Restart a specific LLM endpoint")])
+        async def command_restartendpoint(ctx: CommandContext):
+            # Restart a certain LLM inference endpoint
+            if len(ctx.args) != 1:
+                return command_response("Usage: /restartendpoint <Endpoint config name>")
+
+            async with endpoint_lock:
+                start_endpoint_ok, output = await commands.run_blocking(llm_server.restart_process, ctx.args[0])
+                server_props.invalidate()
+
+            return command_response(output)
+
+        @commands.command("/autotune", help=[("/autotune <Endpoint config name>", "Benchmark llama-server launch parameters on this machine and save the fastest")])
+        async def command_autotune(ctx: CommandContext):
+            # Find fast launch parameters of an endpoint, runs several minutes
+            if len(ctx.args) != 1:
+                return command_response("Usage: /autotune <Endpoint config name>")
+
+            autotuner = EndpointAutotuner(llm_server)
+            async with endpoint_lock:
+                try:
+                    best, runs = await commands.run_blocking(autotuner.run, ctx.args[0])
+                except ValueError as e:
+                    return command_response(str(e))
+                finally:
+                    server_props.invalidate()
+
+            output = EndpointAutotuner.results_table(runs)
+            if best is None:
+                return command_response("No configuration could be measured, the config set was not changed.\n\n" + output)
+            best_text = ", ".join(f"{key}={value}" for key, value in best.items())
+            return command_response(f"Saved the fastest configuration for '{ctx.args[0]}': {best_text}\n\n" + output)
+
+        @commands.command("/stopendpoint", help=[("/stopendpoint <Endpoint config name>", "Stop a specific LLM endpoint")])
+        async def command_stopendpoint(ctx: CommandContext):
+            # Stop a certain LLM inference endpoint
+            if len(ctx.args) != 1:
+                return command_response("Usage: /stopendpoint <Endpoint config name>")
+
+            async with endpoint_lock:
+                stop_endpoint_ok, output = await commands.run_blocking(llm_server.stop_process, ctx.args[0])
+                server_props.invalidate()
+
+            return command_response(output)
+
+        @commands.command("/stopallendpnts", help=[("/stopallendpnts", "Stop all LLM inference endpoints")])
+        async def command_stopallendpnts(ctx: CommandContext):
+            # Stop all LLM inference endpoints
+            async with endpoint_lock:
+                output = await commands.run_blocking(llm_server.stop_all_processes)
+                server_props.invalidate()
+
+            return command_response("\n".join(output))
+
+        @commands.command("/llmstatus", help=[("/llmstatus", "Show the status of local LLM inference endpoints")])
+        async def command_llmstatus(ctx: CommandContext):
+            # Show the current status of local LLM inference endpoints
+            endpoint_processes = llm_server.list_processes()
+            print(endpoint_processes)
+
+            if len(endpoint_processes) > 0:
+                header = (
+                    "| Inference Endpoints |\n"
+                    "|--------------|\n"
+                )
 
-                        stream_response = generate_chat_completion_chunks(output)
-                        return EventSourceResponse(event_generator(stream_response))
+                rows = []
+                for endpoint in endpoint_processes:
+                    row = f"| {endpoint} |"
+                    rows.append(row)
 
-                if command == "/stopallendpnts":
-                    # Stop all LLM inference endpoints
-                    output = llm_server.stop_all_processes()
+                header = header + "\n".join(rows)
 
-                    stream_response = generate_chat_completion_chunks("\n".join(output))
-                    return EventSourceResponse(event_generator(stream_response))
-                
-                if command == "/llmstatus":
-                    # Show the current status of local LLM inference endpoints
-                    endpoint_processes = llm_server.list_processes()
-                    print(endpoint_processes)
-
-                    if len(endpoint_processes) > 0:
-                        header = (
-                            "| Inference Endpoints |\n"
-                            "|--------------|\n"
-                        )
+                slot_status = slot_router.status()
+                if len(slot_status) > 0:
+                    header += "\n\n| Endpoint | Pinned conversation slots |\n|--------------|--------------|\n"
+                    header += "\n".join(f"| {base_url} | {owned}/{total} |" for base_url, (total, owned) in slot_status.items())
 
-                        rows = []
-                        for endpoint in endpoint_processes:
-                            row = f"| {endpoint} |"
-                            rows.append(row)
+                if request_scheduler is not None and len(request_scheduler.queues) > 0:
+                    header += "\n\n| Endpoint | In flight | Queued | Last queue wait |\n|--------------|--------------|--------------|--------------|\n"
+                    header += "\n".join(
+                        f"| {base_url} | {status['inflight']}/{status['max_inflight']} | {status['queued']}/{status['max_queue']} | {status['last_wait_ms']:.0f} ms |"
+                        for base_url, status in request_scheduler.status().items()
+                    )
 
-                        header = header + "\n".join(rows)
+                print(header)
 
-                        print(header)
+                return command_response(header)
+            else:
+                return command_response("There are currently no running LLM inference endpoints.")
 
-                        stream_response = generate_chat_completion_chunks(header)
-                    else:
-                        stream_response = generate_chat_completion_chunks("There are currently no running LLM inference endpoints.")
+        @commands.command("/setautostartendpoint", help=[("/setautostartendpoint <LLM endpoint name>", "Set a specific LLM endpoint for autostart")])
+        async def command_setautostartendpoint(ctx: CommandContext):
+            # Set a specific LLM endpoint for autostart at application startup
+            if len(ctx.args) != 1:
+                return command_response("Usage: /setautostartendpoint <LLM endpoint name>")
 
-                    return EventSourceResponse(event_generator(stream_response))
-                
-                if command == "/setautostartendpoint":
-                    # Set a specific LLM endpoint for autostart at application startup
-                    if len(args) != 1:
-                        stream_response = generate_chat_completion_chunks("Usage: /setautostartendpoint <LLM endpoint name>")
-                        return EventSourceResponse(event_generator(stream_response))
-                   
+            set_as_endpoint_ok = llm_server.set_autostart_endpoint(ctx.args[0])
+
+            if set_as_endpoint_ok:
+                return command_response(f"The LLM endpoint '{ctx.args[0]}' was set correcty and will be started automatically on next start of chatshell.")
+            else:
+                return command_response(f"There was an error setting the LLM endpoint '{ctx.args[0]}' for automatic startup.\nEnsure that the model file exists at the path in configuration.")
+
+        @commands.command("/listendpoints", help=[("/listendpoints", "List all available LLM endpoint configs")])
+        async def command_listendpoints(ctx: CommandContext):
+            # Outputs all available LLM endpoint configs
+            models_avail = llm_server.get_endpoints()
+            return command_response(format_model_list(models_avail))
+
+        @commands.command("/shellmode", help=[("/shellmode", "Activate shell mode for this chat (no LLM interaction)")])
+        async def command_shellmode(ctx: CommandContext):
+            # Activate shell mode for specific chat by inserting the keyword
+            return command_response("This chat is now marked as shell-chat, no LLM interaction will be performed on future inputs.")
+
+        @commands.command("/exit", help=[("/exit", "Quit chatshell server")])
+        async def command_exit(ctx: CommandContext):
+            # Quit chatshell server
+            quit()
+
+        # ================================
+
+        def start_request_trace(request: Request):
+            # Profiling can be requested per request by header or for all requests by config
+            profile_header = str(request.headers.get("x-chatshell-profile", "")).lower()
+            enable_profile = self.request_profiling or profile_header in ("1", "true", "yes")
+
+            if not self.request_tracing and not enable_profile:
+                trace = None
+            else:
+                trace = RequestTrace("chat_completions", profile_dir=self.profile_dir, enable_profile=enable_profile)
+
+            set_current_trace(trace)
+            return trace
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            metrics.increment("chat_requests")
+            trace = start_request_trace(request)
+
+            try:
+                response = await handle_chat_completions(request, trace)
+            except Exception:
+                if trace is not None:
+                    trace.finish()
+                raise
+
+            if trace is not None:
+                trace.attach_headers(response)
+                if not trace.deferred:
+                    trace.finish()
+
+            return response
+
+        def affinity_endpoints(model):
+            # Managed endpoints by name (model field), all running managed endpoints or the configured upstream
+            running = llm_server.get_running_endpoints()
+            slot_router.set_save_dirs({base_url: llm_server.get_slot_save_dir(name) for name, base_url in running.items()})
+            if model in running:
+                return [running[model]]
+            if len(running) > 0:
+                return list(running.values())
+            return [str(client.base_url).rstrip("/")]
+
+        def get_upstream_client(base_url):
+            # OpenAI client for an upstream endpoint, sharing the connection pool of the default client
+            if base_url == str(client.base_url).rstrip("/"):
+                return client
+            if base_url not in upstream_clients:
+                upstream_clients[base_url] = client.with_options(base_url=base_url)
+            return upstream_clients[base_url]
+
+        async def summarize_history(model, base_url, previous_summary, turns):
+            # Summary of older turns of a conversation, extending the previous summary
+            transcript = "\n\n".join(f"{turn.get('role', '')}: {turn.get('content', '')}" for turn in turns)
+            prompt = "Summarize the following conversation concisely. Keep facts, names, decisions and open questions.\n\n"
+            if previous_summary:
+                prompt += f"Summary of the conversation before:\n{previous_summary}\n\n"
+            prompt += f"Conversation:\n{transcript}"
+
+            response = await get_upstream_client(base_url).chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=512,
+                stream=False
+            )
+            return response.choices[0].message.content.strip()
+
+        async def forward_command(payload):
+            # Commands change endpoints and the RAG index, they run in the primary worker
+            upstream_response = await primary_client.send(
+                primary_client.build_request("POST", "/v1/chat/completions", json=payload),
+                stream=True
+            )
+            headers = {}
+            if "cache-control" in upstream_response.headers:
+                headers["Cache-Control"] = upstream_response.headers["cache-control"]
+            return StreamingResponse(
+                upstream_response.aiter_raw(),
+                status_code=upstream_response.status_code,
+                media_type=upstream_response.headers.get("content-type"),
+                headers=headers,
+                background=BackgroundTask(upstream_response.aclose)
+            )
+
+        async def publish_shared_state():
+            # Primary worker: make the RAG state of the last command visible to the other workers
+            async with publish_lock, rag_lock.read():
+                if isinstance(rag_index, CollectionSearch):
+                    # Workers load the saved collections themselves
+                    await commands.run_blocking(shared_state.publish, rag_provider, rag_enabled, context_enabled, rag_provider.context_list, rag_index.generations())
+                else:
+                    await commands.run_blocking(shared_state.publish, rag_index, rag_enabled, context_enabled, rag_provider.context_list)
+
+        async def sync_folder_index():
+            # Documents are embedded while searches continue, these wait only for the index updates
+            async with folder_lock:
+                changes = await commands.run_blocking(folder_index.scan)
+                for change in changes:
+                    prepared = await commands.run_blocking(folder_index.prepare, change)
+                    async with rag_lock.write():
+                        await commands.run_blocking(folder_index.apply, change, prepared)
+                if changes:
+                    print(f"--> Document folder updated: {change_summary(changes)}")
+                    async with rag_lock.write():
+                        await commands.run_blocking(folder_index.compact_if_needed)
+                await commands.run_blocking(folder_index.save)
+
+            if changes and shared_state is not None and rag_index is folder_index.vectorsearch:
+                await publish_shared_state()
+            return changes
+
+        async def watch_document_folder():
+            # Periodic scans keep the folder index up to date
+            while True:
+                try:
+                    await sync_folder_index()
+                except Exception as e:
+                    print(f"--> Scan of the document folder failed: {e}")
+                await asyncio.sleep(self.rag_folder_scan_interval_s)
+
+        async def sync_shared_state():
+            # Other workers: take over a changed RAG state of the primary worker
+            nonlocal rag_enabled, context_enabled, rag_index
+            state = shared_state.poll()
+            if state is None:
+                return
+            async with rag_lock.write():
+                try:
+                    await commands.run_blocking(shared_state.load, rag_provider, state)
+                    collections = state.get("collections")
+                    if collections:
+                        rag_index = await commands.run_blocking(rag_collections.search, list(collections), collections)
+                        await commands.run_blocking(rag_collections.evict, list(collections))
                     else:
-                        set_as_endpoint_ok = llm_server.set_autostart_endpoint(args[0])
+                        rag_index = rag_provider
+                except (OSError, ValueError, KeyError) as e:
+                    # E.g. replaced by a newer generation meanwhile, retry with the next request
+                    print(f"--> Loading the shared RAG index failed: {e}")
+                    shared_state.stat_key = None
+                    return
+            rag_enabled     = bool(state.get("rag_enabled"))
+            context_enabled = bool(state.get("context_enabled"))
+
+        def proxy_state_fingerprint():
+            # Proxy state that changes the forwarded prompt besides the request payload
+            context = rag_provider.get_context() if context_enabled else ""
+            return f"{rag_enabled}:{rag_index.corpus_version}:{self.prompt_layout}:{self.endpoint_base_url}:{context}"
+
+        def exact_cached_completion(entry, stream, model):
+            # Stored response of an identical request, the endpoint is not contacted
+            if stream:
+                if "stream_body" in entry:
+                    return Response(entry["stream_body"], media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+                return EventSourceResponse(event_generator(replay_chunks(entry["text"], model)))
+
+            if "response" in entry:
+                return JSONResponse(entry["response"])
+            return JSONResponse(build_completion(entry["text"], model))
+
+        def cached_completion(cached, stream, trace):
+            # Answer from the response cache, the endpoint is not contacted
+            if stream:
+                if trace is not None:
+                    trace.defer()
+                return EventSourceResponse(event_generator(replay_chunks(cached.text, cached.model), cached.sources, trace))
+
+            completion = build_completion(cached.text, cached.model)
+            if cached.sources is not None:
+                completion["choices"][0]["message"]["content"] += "\n\n---\nSources:\n" + "".join(f"{source}\n" for source in cached.sources)
+            return JSONResponse(completion)
+
+        async def forward_completion(request, payload, stream, rag_sources, trace, base_url, leases=(), on_complete=None):
+            upstream_client = get_upstream_client(base_url)
+
+            # Streaming mode, forwarding the upstream byte stream as-is
+            if stream and self.stream_passthrough:
+                with trace_span("upstream_request"):
+                    upstream_response = await cancel_on_disconnect(request, open_upstream_stream(payload, base_url))
+
+                if upstream_response.status_code != 200:
+                    # Forward upstream errors
+                    error_body = await upstream_response.aread()
+                    await upstream_response.aclose()
+                    try:
+                        error_content = json.loads(error_body)
+                    except ValueError:
+                        error_content = {"error": error_body.decode("utf-8", errors="replace")}
+                    release_leases(leases)
+                    return JSONResponse(error_content, status_code=upstream_response.status_code)
+
+                if trace is not None:
+                    trace.defer()
+                return StreamingResponse(
+                    passthrough_generator(upstream_response, rag_sources, trace, leases, on_complete),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+                )
 
-                        if set_as_endpoint_ok:
-                            stream_response = generate_chat_completion_chunks(f"The LLM endpoint '{args[0]}' was set correcty and will be started automatically on next start of chatshell.")
-                            return EventSourceResponse(event_generator(stream_response))
-                        else:
-                            stream_response = generate_chat_completion_chunks(f"There was an error setting the LLM endpoint '{args[0]}' for automatic startup.\nEnsure that the model file exists at the path in configuration.")
-                            return EventSourceResponse(event_generator(stream_response))
+            # Streaming mode
+            if stream:
+                with trace_span("upstream_request"):
+                    stream_response = await cancel_on_disconnect(
+                        request, upstream_client.chat.completions.create(**split_llama_server_params(payload))
+                    )
+
+                if trace is not None:
+                    trace.defer()
+                return EventSourceResponse(event_generator(stream_response, rag_sources, trace, leases, on_complete))
+
+            # Non-streaming mode
+            with trace_span("upstream_request"):
+                # Cancelled if the client disconnects, which also stops the generation upstream
+                response = await cancel_on_disconnect(
+                    request, upstream_client.chat.completions.create(**split_llama_server_params(payload))
+                )
 
-                if command == "/listendpoints":
-                    # Outputs all available LLM endpoint configs
-                    models_avail = llm_server.get_endpoints()
-                    stream_response = generate_chat_completion_chunks(format_model_list(models_avail))
-                    return EventSourceResponse(event_generator(stream_response))
-                
-                if command == "/status":
-                    # Outputs the status of the system overall context + RAG + LLM server
-                    # TODO
-                    pass
-
-                if command == "/shellmode":
-                    # Activate shell mode for specific chat by inserting the keyword
-                    stream_response = generate_chat_completion_chunks(f"This chat is now marked as shell-chat, no LLM interaction will be performed on future inputs.")
-                    return EventSourceResponse(event_generator(stream_response))
+            release_leases(leases)
 
-                if command == "/exit":
-                    # Quit chatshell server
-                    quit()
-                
-                # ========================================
+            if response.model_extra and "timings" in response.model_extra:
+                record_upstream_timings(response.model_extra["timings"])
 
-                if not endpoint_avail():
-                    # No public OpenAI connection configured and local endpoint not available
-                    stream_response = generate_chat_completion_chunks("There is no LLM inference endpoint available. Please configure first and try again.")
-                    return EventSourceResponse(event_generator(stream_response))
+            finish_reason = response.choices[0].finish_reason if response.choices else None
+            answer = response.choices[0].message.content if response.choices else None
 
-                rag_sources = None
+            # Append RAG sources
+            if rag_sources is not None:
+                try:
+                    response.choices[0].message.content += "\n\n---\nSources:\n"
+                    for source in rag_sources:
+                        response.choices[0].message.content += f"{source}\n"
+                except Exception as e:
+                    print(f"--> Failed to append RAG sources: {e}")
 
-                if rag_enabled:
-                    # --- Inject RAG context before forwarding ---
-                    search_query = last_user_message
+            response_content = response.model_dump()
+            if on_complete is not None and finish_reason == "stop":
+                on_complete(answer, response_content)
+            return JSONResponse(response_content)
 
-                    # Query Vectorstore
-                    rag_output = rag_provider.search_knn(search_query, num_chunks=self.rag_max_chunks)
+        def request_priority(request: Request):
+            """
+            Priority class and queue deadline (s) of a request, from the headers
+            X-Chatshell-Priority (interactive, batch) and X-Chatshell-Deadline-Ms.
+            """
+            priority = request.headers.get("x-chatshell-priority", PRIORITY_INTERACTIVE).lower()
+            if priority not in PRIORITY_RANKS:
+                priority = PRIORITY_INTERACTIVE
+            deadline_s = None
+            try:
+                deadline_s = float(request.headers["x-chatshell-deadline-ms"]) / 1000.0
+            except (KeyError, ValueError):
+                pass
+            return priority, deadline_s
 
-                    rag_context = "The following parts of a document or website should be considered when generating responses and/or answers to the users questions:\n"
-                    rag_sources = []
+        async def handle_chat_completions(request: Request, trace):
+            try:
+                with trace_span("parse_request"):
+                    payload = await request.json()
 
-                    time.sleep(0.01)
+                # Get last user message
+                messages = payload.get("messages", [])
 
-                    num = 1
-                    for result in rag_output:
-                        if result.get("similarity", 0) < self.rag_score_thresh:
-                            # Skip source if similarity is too low
-                            continue
+                # Remove any message whose content matches a command in command list, and the following message
+                # EXCEPT if the command is in the last message.
+                with trace_span("filter_messages"):
+                    i = 0
+                    while i < len(messages) - 1:  # never remove the last message
+                        content = messages[i].get("content", "")
+                        if any(content.strip().startswith(cmd) for cmd in self.command_list):
+                            del messages[i]
+                            # After deletion, the next message is now at index i (unless it was the last)
+                            if i < len(messages) - 1:
+                                del messages[i]
+                            # Do not increment i, as the next message is now at the same index
+                        else:
+                            i += 1
 
-                        rag_context += f"[\n{num}:\n"
-                        rag_context += result.get("chunk", "")
+                # Conversation key from the messages of the client (before context is inserted)
+                # Conversation header or user field of the client, if sent
+                client_id = request.headers.get("x-chatshell-conversation") or payload.get("user")
+                affinity_key = conversation_key(messages, client_id)
+                first_turn_key = conversation_key(messages, client_id, first_turn=True)
 
-                        # Include source meta info for output
-                        source_info     = result.get("source_info")
-                        source_position = result.get("source_position")
+                last_message = messages[-1]  # This is a dict: {"role": "...", "content": "..."}
+                last_user_message = last_message.get("content", "")
 
-                        if source_info is not None or source_position is not None:
-                            if source_position != 0:
-                                rag_sources.append(f"{num}: {source_info}, Page: {source_position}")
-                            else:
-                                rag_sources.append(f"{num}: {source_info}")
+                stream = payload.get("stream", False)
 
-                        rag_context += f"\n],\n"
-                        num += 1
+                # ==== Start command control sequence ====
 
-                    if len(rag_sources) == 0:
-                        rag_context += f"There are no information in the document that can answer the user's question. Do not answer anything that you think it  may be correct.\n"
-                    else:
-                        rag_context += f"All of the parts of a document or website should only be used if it is helpful in answering the user's question. Do not output filenames or URLs that may be included in the context.\n"
+                tokens = last_user_message.split()
+                command = tokens[0].lower() if len(tokens) > 0 else ""
+                args = tokens[1:]
 
-                    payload["messages"][-1]["content"] += "\n" + rag_context # insert at end of last user message
+                if commands.get(command) is not None:
+                    if primary_client is not None:
+                        with trace_span("command"):
+                            return await forward_command(payload)
 
-                if context_enabled:
-                    # Adding context if there is something
-                    current_context = rag_provider.get_context()
+                    with trace_span("command"):
+                        dispatch_response = await commands.dispatch(CommandContext(command, args, last_user_message, payload))
+                    if shared_state is not None:
+                        await publish_shared_state()
+                    return dispatch_response
 
-                    if current_context != "":
-                        current_context += f"There is some additional information in the context that can help answer the user's question. Do not refer directly to this context.\n"
+                # ========================================
 
-                    payload["messages"][-1]["content"] += "\n" + current_context # insert at end of last user message
-                
-                # Streaming mode
-                if stream:
-                    stream_response = client.chat.completions.create(**payload)
-                    return EventSourceResponse(event_generator(stream_response, rag_sources))
+                if primary_client is not None:
+                    await sync_shared_state()
 
-                # Non-streaming mode
-                response = client.chat.completions.create(**payload)
+                exact_key = None
+                if exact_cache is not None and is_cacheable(payload, 0.0):
+                    with trace_span("exact_cache"):
+                        exact_key = ExactResponseCache.request_key(payload, proxy_state_fingerprint())
+                        cached_entry = exact_cache.lookup(exact_key)
+                    if cached_entry is not None:
+                        return exact_cached_completion(cached_entry, stream, payload.get("model", "generic"))
+
+                if not await endpoint_avail():
+                    # No public OpenAI connection configured and local endpoint not available
+                    stream_response = generate_chat_completion_chunks("There is no LLM inference endpoint available. Please configure first and try again.")
+                    return EventSourceResponse(event_generator(stream_response))
+
+                rag_sources     = None
+                rag_retrieval   = None
+                rag_preamble    = None
+                rag_chunk_ids   = []
+                current_context = None
+
+                cache_candidate = self.response_cache and is_cacheable(payload, self.response_cache_max_temperature)
+                query_embedding = None
+                if rag_enabled or cache_candidate:
+                    # Question embedding for the vectorstore search and the response cache
+                    query_embedding = await commands.run_blocking(rag_provider.embed_query, last_user_message)
 
-                # Append RAG sources
                 if rag_enabled:
-                    try:
-                        response.choices[0].message.content += "\n\n---\nSources:\n"
-                        for source in rag_sources:
-                            response.choices[0].message.content += f"{source}\n"
-                    except Exception as e:
-                        print(f"--> Failed to append RAG sources: {e}")
+                    # --- Inject RAG context before forwarding ---
+                    search_query = last_user_message
 
-                    return JSONResponse(response.model_dump_json())
+                    # Query Vectorstore
+                    with trace_span("rag_search"):
+                        async with rag_lock.read():
+                            rag_output = await commands.run_blocking(rag_index.search_knn, search_query, num_chunks=self.rag_max_chunks, query_embedding=query_embedding)
+
+                    with trace_span("build_context"):
+                        rag_context = ""
+                        rag_sources = []
+
+                        num = 1
+                        for result in rag_output:
+                            if result.get("similarity", 0) < self.rag_score_thresh:
+                                # Skip source if similarity is too low
+                                continue
+
+                            rag_context += f"[\n{num}:\n"
+                            rag_context += result.get("chunk", "")
+                            rag_chunk_ids.append(result.get("chunk_id", ""))
+
+                            # Include source meta info for output
+                            source_info     = result.get("source_info")
+                            source_position = result.get("source_position")
+
+                            if source_info is not None or source_position is not None:
+                                if source_position != 0:
+                                    rag_sources.append(f"{num}: {source_info}, Page: {source_position}")
+                                else:
+                                    # Deduplicated chunks of crawls list every page they were found on
+                                    rag_sources.append(f"{num}: " + ", ".join(result.get("sources") or [str(source_info)]))
+
+                            rag_context += f"\n],\n"
+                            num += 1
+
+                        if len(rag_sources) == 0:
+                            rag_context += f"There are no information in the document that can answer the user's question. Do not answer anything that you think it  may be correct.\n"
+                        else:
+                            rag_context += f"All of the parts of a document or website should only be used if it is helpful in answering the user's question. Do not output filenames or URLs that may be included in the context.\n"
+
+                        rag_retrieval = rag_context
+                        if self.prompt_layout == PROMPT_LAYOUT_CACHE:
+                            rag_preamble = "Parts of a document or website are added at the end of the user's messages. They should be considered when generating responses and/or answers to the users questions.\n"
+                        else:
+                            rag_preamble = "The following parts of a document or website should be considered when generating responses and/or answers to the users questions:\n"
+
+                if context_enabled:
+                    # Adding context if there is something
+                    with trace_span("build_context"):
+                        current_context = rag_provider.get_context()
+
+                        if current_context != "":
+                            current_context += f"There is some additional information in the context that can help answer the user's question. Do not refer directly to this context.\n"
+
+                cache_scope = None
+                if cache_candidate:
+                    # Same question (by similarity) in the same setting answered before?
+                    with trace_span("response_cache"):
+                        cache_scope = SemanticResponseCache.scope_key(payload.get("model"), rag_chunk_ids, messages[:-1], current_context)
+                        cached = semantic_cache.lookup(cache_scope, query_embedding)
+                    if cached is not None:
+                        return cached_completion(cached, stream, trace)
+
+                def store_response(text, transcript):
+                    if cache_scope is not None:
+                        semantic_cache.store(cache_scope, query_embedding, text, rag_sources, payload.get("model", "generic"))
+                    if exact_key is not None:
+                        exact_cache.store(exact_key, text, transcript)
+
+                with trace_span("build_context"):
+                    prompt_assembler.assemble(payload["messages"], retrieval=rag_retrieval, document_preamble=rag_preamble, context=current_context)
+
+                if not self.use_openai_api:
+                    # Let llama-server reuse the KV cache of the common prompt prefix
+                    payload.setdefault("cache_prompt", True)
+                
+                leases = []
+                base_url = str(client.base_url).rstrip("/")
+                if self.slot_affinity and not self.use_openai_api:
+                    # Pin the conversation to a slot of a llama-server endpoint
+                    with trace_span("slot_routing"):
+                        slot_lease = await slot_router.acquire(
+                            affinity_key, affinity_endpoints(payload.get("model")),
+                            first_turn_key if first_turn_key != affinity_key else None
+                        )
+                    if slot_lease is not None:
+                        payload["id_slot"] = slot_lease.id_slot
+                        base_url = slot_lease.base_url
+                        leases.append(slot_lease)
+
+                try:
+                    if request_scheduler is not None:
+                        # Wait for a free place on the endpoint, reject fast if its queue is full
+                        priority, deadline_s = request_priority(request)
+                        with trace_span("admission"):
+                            try:
+                                leases.append(await cancel_on_disconnect(request, request_scheduler.admit(base_url, priority, deadline_s)))
+                            except SchedulerRejected as e:
+                                release_leases(leases)
+                                return JSONResponse(
+                                    {"error": {"message": e.message, "type": "overloaded", "code": e.status_code}},
+                                    status_code=e.status_code,
+                                    headers={"Retry-After": str(e.retry_after)}
+                                )
+
+                    if self.context_management != CONTEXT_MANAGEMENT_OFF and not self.use_openai_api:
+                        # Keep the history within the context size of the endpoint
+                        with trace_span("context_window"):
+                            payload["messages"] = await context_manager.fit(
+                                payload["messages"],
+                                base_url,
+                                affinity_key,
+                                summarize=lambda summary, turns: summarize_history(payload.get("model", "generic"), base_url, summary, turns)
+                            )
+
+                    return await forward_completion(
+                        request, payload, stream, rag_sources, trace, base_url, leases,
+                        on_complete=store_response if cache_scope is not None or exact_key is not None else None
+                    )
+                except ClientDisconnected:
+                    release_leases(leases)
+                    record_client_disconnect()
+                    return Response(status_code=499)
+                except BaseException:
+                    # Also on cancellation, e.g. client disconnect while queued
+                    release_leases(leases)
+                    raise
 
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
@@ -756,13 +1643,30 @@ class Chatshell:
         config = uvicorn.Config(app, host="0.0.0.0", port=int(self.chatshell_proxy_serve_port), loop="asyncio")
         server = uvicorn.Server(config)
 
+        sockets = None
+        if listen_sock is not None:
+            # Workers accept connections from the shared socket
+            sockets = [listen_sock]
+            if primary:
+                sockets.append(unix_listen_socket(primary_socket_path))
+
         async def serve_until_event():
-            server_task = asyncio.create_task(server.serve())
+            lag_monitor.start()
+            server_task = asyncio.create_task(server.serve(sockets=sockets))
+            folder_task = None
+            if folder_index is not None:
+                folder_task = asyncio.create_task(watch_document_folder())
             while not shutdown_event.is_set():
                 await asyncio.sleep(0.5)
+            if folder_task is not None:
+                folder_task.cancel()
             if server.started:
                 # Shutdown if loop was completed
                 await server.shutdown()
+                await http_client.aclose()
+                if primary_client is not None:
+                    await primary_client.aclose()
+                commands.shutdown()
                 return
             await server_task
 
@@ -778,9 +1682,23 @@ class Chatshell:
         # Starts the server in a non-blocking separate process.
         if self.process is None or not self.process.is_alive():
             self.shutdown_event = Event()
-            self.process = Process(target=self._run_server, args=(self.shutdown_event,))
-            self.process.start()
-            print(f"--> RAG server started in separate process (PID={self.process.pid})")
+            if self.proxy_workers > 1:
+                # Workers share one listening socket, worker 0 is the primary
+                sock = listen_socket("0.0.0.0", self.chatshell_proxy_serve_port)
+                self.worker_processes = [
+                    Process(target=self._run_server, args=(self.shutdown_event, worker_id, sock))
+                    for worker_id in range(self.proxy_workers)
+                ]
+                for process in self.worker_processes:
+                    process.start()
+                sock.close()
+                self.process = self.worker_processes[0]
+                print(f"--> RAG server started with {self.proxy_workers} worker processes (PIDs={[p.pid for p in self.worker_processes]})")
+            else:
+                self.process = Process(target=self._run_server, args=(self.shutdown_event,))
+                self.worker_processes = [self.process]
+                self.process.start()
+                print(f"--> RAG server started in separate process (PID={self.process.pid})")
         else:
             print("--> RAG server is already running.")
 
@@ -790,10 +1708,11 @@ class Chatshell:
             print(f"--> Stopping RAG server (PID={self.process.pid}), sending shutdown signal...")
             if self.shutdown_event:
                 self.shutdown_event.set()
-                self.process.join(timeout=5)
-                if self.process.is_alive():
-                    # Server process hanging -> terminate signal
-                    self.process.terminate()
-                else:
+                for process in self.worker_processes:
+                    process.join(timeout=5)
+                    if process.is_alive():
+                        # Server process hanging -> terminate signal
+                        process.terminate()
+                if not any(process.is_alive() for process in self.worker_processes):
                     print("--> RAG server stopped gracefully.")
 
@@ -0,0 +1,199 @@
+import json
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+
+# Source id and position of chunks without source metadata (e.g. clipboard)
+NO_SOURCE   = -1
+NO_POSITION = -1
+# Character offset of chunks that were not split from a known text
+NO_OFFSET   = -1
+
+
+class ChunkStore:
+    """
+    Columnar store of chunk texts and their sources.
+
+    The texts are one contiguous UTF-8 buffer with an offsets array, the source
+    of every chunk is an integer id into an interned source table (file names,
+    URLs) plus a position (page) and the character offset of the chunk in the
+    text of that page. Chunk i is found without any per-chunk Python
+    objects. A chunk found on several pages (deduplicated crawls) has further
+    sources as (chunk, source id) pairs. A store loaded with mmap maps the
+    files read-only, the first append copies them into memory.
+    """
+
+    def __init__(self):
+        self._text          = bytearray()
+        self._offsets       = array("q", [0])
+        self._source_ids    = array("i")
+        self._positions     = array("q")
+        self._char_offsets  = array("q")
+        # Further sources of chunks, as pairs of columns and by chunk
+        self._extra_chunks      = array("q")
+        self._extra_source_ids  = array("i")
+        self._extra_sources     = {}
+        self.sources        = []
+        self._source_table  = {}
+        # Loaded columns are numpy arrays (memory-mapped if mapped)
+        self._frozen        = False
+        self.mapped         = False
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _writable(self):
+        if self._frozen:
+            self._text          = bytearray(self._text)
+            self._offsets       = array("q", np.asarray(self._offsets).tobytes())
+            self._source_ids    = array("i", np.asarray(self._source_ids).tobytes())
+            self._positions     = array("q", np.asarray(self._positions).tobytes())
+            self._char_offsets  = array("q", np.asarray(self._char_offsets).tobytes())
+            self._extra_chunks      = array("q", np.asarray(self._extra_chunks).tobytes())
+            self._extra_source_ids  = array("i", np.asarray(self._extra_source_ids).tobytes())
+            self._frozen        = False
+            self.mapped         = False
+
+    def source_id(self, source_info):
+        # Id of a source in the interned source table
+        if source_info is None:
+            return NO_SOURCE
+        source_id = self._source_table.get(source_info)
+        if source_id is None:
+            source_id = len(self.sources)
+            self.sources.append(source_info)
+            self._source_table[source_info] = source_id
+        return source_id
+
+    def add(self, chunk, source_info=None, source_position=None, char_offset=None) -> int:
+        """
+        Append a chunk, returns its index.
+        """
+        self._writable()
+        self._text += chunk.encode("utf-8")
+        self._offsets.append(len(self._text))
+        self._source_ids.append(self.source_id(source_info))
+        self._positions.append(NO_POSITION if source_position is None else int(source_position))
+        self._char_offsets.append(NO_OFFSET if char_offset is None else int(char_offset))
+        return len(self) - 1
+
+    def add_source(self, index, source_info):
+        """
+        Add a further source of chunk index (a page with the same chunk).
+        """
+        source_id = self.source_id(source_info)
+        if source_id == NO_SOURCE or source_id == self._source_ids[index] or source_id in self._extra_sources.get(index, ()):
+            return
+        self._writable()
+        self._extra_chunks.append(int(index))
+        self._extra_source_ids.append(source_id)
+        self._extra_sources.setdefault(int(index), []).append(source_id)
+
+    def extend(self, chunks, source_info=None, source_position=None):
+        """
+        Append chunks of the same source, returns the range of their indices.
+        """
+        start = len(self)
+        for chunk in chunks:
+            self.add(chunk, source_info, source_position)
+        return range(start, len(self))
+
+    def text(self, index) -> str:
+        return str(self._text[self._offsets[index]:self._offsets[index + 1]], "utf-8")
+
+    def source_info(self, index):
+        source_id = self._source_ids[index]
+        return self.sources[source_id] if source_id != NO_SOURCE else None
+
+    def all_sources(self, index) -> list:
+        # Source of the chunk followed by its further sources
+        sources = [self.sources[source_id] for source_id in self._extra_sources.get(int(index), ())]
+        source_info = self.source_info(index)
+        return [source_info] + sources if source_info is not None else sources
+
+    def source_position(self, index):
+        position = self._positions[index]
+        return int(position) if position != NO_POSITION else None
+
+    def char_offset(self, index):
+        offset = self._char_offsets[index]
+        return int(offset) if offset != NO_OFFSET else None
+
+    def metadata(self, index) -> dict:
+        if self._source_ids[index] == NO_SOURCE and self._positions[index] == NO_POSITION:
+            if self._char_offsets[index] == NO_OFFSET:
+                return {}
+            return {"char_offset": self.char_offset(index)}
+        return {
+            "source_info": self.source_info(index),
+            "source_position": self.source_position(index),
+            "char_offset": self.char_offset(index),
+            "sources": self.all_sources(index),
+        }
+
+    def texts(self):
+        for index in range(len(self)):
+            yield self.text(index)
+
+    def nbytes(self) -> int:
+        # Memory of the columns (text buffer and arrays)
+        return (len(self._text) + len(self._offsets) * 8 + len(self._source_ids) * 4
+                + len(self._positions) * 8 + len(self._char_offsets) * 8 + len(self._extra_chunks) * 12
+                + sum(len(source) for source in self.sources))
+
+    def save(self, path):
+        """
+        Write the store to the directory path.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / "chunks.bin", "wb") as f:
+            f.write(self._text)
+        np.save(path / "chunk_offsets.npy", np.asarray(self._offsets, dtype=np.int64))
+        np.save(path / "chunk_sources.npy", np.asarray(self._source_ids, dtype=np.int32))
+        np.save(path / "chunk_positions.npy", np.asarray(self._positions, dtype=np.int64))
+        np.save(path / "chunk_char_offsets.npy", np.asarray(self._char_offsets, dtype=np.int64))
+        np.save(path / "chunk_extra_chunks.npy", np.asarray(self._extra_chunks, dtype=np.int64))
+        np.save(path / "chunk_extra_sources.npy", np.asarray(self._extra_source_ids, dtype=np.int32))
+        with open(path / "sources.json", "w", encoding="utf-8") as f:
+            json.dump(self.sources, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a store written by save. With mmap, the columns are mapped read-only
+        and shared with other processes mapping the same files.
+        """
+        path = Path(path)
+        store = cls()
+        mmap_mode = "r" if mmap else None
+        offsets = np.load(path / "chunk_offsets.npy", mmap_mode=mmap_mode)
+        if mmap and offsets[-1] > 0:
+            text = np.memmap(path / "chunks.bin", dtype=np.uint8, mode="r")
+            # Slices of a memoryview decode without copying the buffer
+            store._text = memoryview(text)
+        else:
+            # np.memmap can not map empty files
+            store._text = bytearray((path / "chunks.bin").read_bytes())
+        store._offsets      = offsets
+        store._source_ids   = np.load(path / "chunk_sources.npy", mmap_mode=mmap_mode)
+        store._positions    = np.load(path / "chunk_positions.npy", mmap_mode=mmap_mode)
+        if (path / "chunk_char_offsets.npy").exists():
+            store._char_offsets = np.load(path / "chunk_char_offsets.npy", mmap_mode=mmap_mode)
+        else:
+            # Saved before chunks had offsets
+            store._char_offsets = np.full(len(store._positions), NO_OFFSET, dtype=np.int64)
+        if (path / "chunk_extra_chunks.npy").exists():
+            # Few pairs, read into memory
+            store._extra_chunks     = np.load(path / "chunk_extra_chunks.npy")
+            store._extra_source_ids = np.load(path / "chunk_extra_sources.npy")
+            for index, source_id in zip(store._extra_chunks.tolist(), store._extra_source_ids.tolist()):
+                store._extra_sources.setdefault(index, []).append(source_id)
+        with open(path / "sources.json", "r", encoding="utf-8") as f:
+            store.sources = json.load(f)
+        store._source_table = {source: source_id for source_id, source in enumerate(store.sources)}
+        store._frozen = True
+        store.mapped = mmap
+        return store
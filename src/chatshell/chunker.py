@@ -0,0 +1,272 @@
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, compress, repeat
+from operator import is_
+
+import numpy as np
+
+
+# Chunk size in tokens of the embedding model, including its special tokens
+DEFAULT_CHUNK_TOKENS    = 128
+DEFAULT_OVERLAP_TOKENS  = 16
+
+# Long texts are split window by window, cut at paragraph breaks
+DEFAULT_WINDOW_CHARS    = 1 << 20
+
+# A chunk ends at the coarsest break that leaves it at least this full
+MIN_FILL = 0.5
+
+# Break levels between two words, coarsest first
+BREAK_PARAGRAPH = 0
+BREAK_LINE      = 1
+BREAK_SENTENCE  = 2
+BREAK_WORD      = 3
+# Cut inside a word longer than a chunk
+BREAK_TOKEN     = 4
+
+
+def _char_table(chars, size=None):
+    table = np.zeros(size or max(map(ord, chars)) + 2, dtype=bool)
+    table[[ord(c) for c in chars]] = True
+    return table
+
+
+# Whitespace as in str.split (there is none above U+3000)
+SPACE_TABLE         = _char_table([chr(c) for c in range(0x3001) if chr(c).isspace()], 0x3002)
+SENTENCE_END_TABLE  = _char_table(".!?:")
+CLOSING_TABLE       = _char_table("\"')]")
+
+# Approximate tokens if the model has no Hugging Face tokenizer: CJK
+# characters, pieces of up to 8 word characters and punctuation marks
+CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+APPROX_TOKEN = re.compile(rf"[{CJK}]|[^\W{CJK}]{{1,8}}|[^\w\s]")
+
+
+def _lookup(table, codes):
+    # Characters above the table map to its last entry, which is False
+    return np.take(table, codes, mode="clip")
+
+
+class TokenCounter:
+    """
+    Token counts of whitespace separated words for a Hugging Face tokenizer.
+
+    Tokenizers like the WordPiece tokenizer of the default model split text at
+    whitespace before anything else, so the tokens of a span are the sum of the
+    tokens of its words. Every distinct word is tokenized once and its count
+    cached; as words repeat, only a small part of a long text reaches the
+    tokenizer. Without a tokenizer, words and punctuation are counted as
+    tokens.
+    """
+
+    def __init__(self, tokenizer=None, max_cached_words=500_000):
+        self.tokenizer = None
+        self.special_tokens = 0
+        self.model_max_length = None
+        if tokenizer is not None:
+            from tokenizers import Tokenizer
+
+            # Copy without truncation and padding (the embedding model sets both)
+            truncation = tokenizer.truncation
+            self.tokenizer = Tokenizer.from_str(tokenizer.to_str())
+            self.tokenizer.no_truncation()
+            self.tokenizer.no_padding()
+            self.special_tokens = self.tokenizer.num_special_tokens_to_add(False)
+            if truncation:
+                self.model_max_length = truncation.get("max_length")
+
+        self.cache = {}
+        self.max_cached_words = max_cached_words
+
+    @classmethod
+    def for_model(cls, embedding_model):
+        """
+        Counter for the tokenizer of an embedding backend (a light_embed model),
+        approximate if the model has none.
+        """
+        wrapper = getattr(embedding_model, "tokenizer", None)
+        tokenizer = getattr(wrapper, "tokenizer", wrapper)
+        if tokenizer is None or not hasattr(tokenizer, "to_str"):
+            return cls()
+        return cls(tokenizer)
+
+    def _encode(self, words):
+        if self.tokenizer is None:
+            return [len(APPROX_TOKEN.findall(word)) for word in words]
+        return [len(encoding) for encoding in self.tokenizer.encode_batch_fast(words, add_special_tokens=False)]
+
+    def count_words(self, words) -> list:
+        """
+        Number of tokens of every word.
+        """
+        counts = list(map(self.cache.get, words))
+        if None in counts:
+            missing = list(set(compress(words, map(is_, counts, repeat(None)))))
+            if len(self.cache) + len(missing) > self.max_cached_words:
+                self.cache.clear()
+            # Other threads may clear the cache meanwhile, new counts are kept apart
+            new_counts = dict(zip(missing, self._encode(missing)))
+            self.cache.update(new_counts)
+            counts = [new_counts[word] if count is None else count for word, count in zip(words, counts)]
+        return counts
+
+    def count(self, text) -> int:
+        return sum(self.count_words(text.split()))
+
+    def cut_points(self, word, max_tokens) -> list:
+        """
+        Character offsets that cut a word into pieces of at most max_tokens.
+        """
+        if self.tokenizer is None:
+            starts = [match.start() for match in APPROX_TOKEN.finditer(word)]
+        else:
+            starts = [start for start, _ in self.tokenizer.encode(word, add_special_tokens=False).offsets]
+        return [start for start in starts[max_tokens::max_tokens] if start > 0]
+
+
+class Chunker:
+    """
+    Streaming, structure aware text splitter with chunk sizes in tokens of the
+    embedding model.
+
+    Like a recursive character splitter, chunks end at paragraph breaks, then
+    line breaks, sentence ends and word boundaries, but no chunk exceeds
+    chunk_tokens of the model (so nothing is truncated at encoding) and every
+    chunk has the character offset where it starts in the text. The text is
+    processed in windows of window_chars; word boundaries and breaks are found
+    with numpy on the code points of a window, token counts come from the
+    cached word counts of the TokenCounter.
+    """
+
+    def __init__(self, token_counter=None, chunk_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS, window_chars=DEFAULT_WINDOW_CHARS):
+        self.token_counter = token_counter or TokenCounter()
+        if self.token_counter.model_max_length:
+            chunk_tokens = min(chunk_tokens, self.token_counter.model_max_length)
+        # Tokens left for the text of a chunk
+        self.budget         = max(1, chunk_tokens - self.token_counter.special_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.budget // 2))
+        self.window_chars   = window_chars
+
+    def _words(self, text, start, end):
+        """
+        Words of text[start:end] as arrays of start and end offsets, the list
+        of token counts and the array of break levels after every word.
+        """
+        window = text[start:end]
+        codes = np.frombuffer(window.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+        # Words start and end where whitespace and text alternate
+        padded = np.concatenate(([1], _lookup(SPACE_TABLE, codes).view(np.int8), [1]))
+        edges = np.flatnonzero(np.diff(padded))
+        word_starts = edges[0::2]
+        word_ends = edges[1::2]
+        tokens = self.token_counter.count_words(window.split())
+
+        # Break after every word, from the whitespace that follows it
+        breaks = np.full(len(word_starts), BREAK_WORD, dtype=np.int8)
+        if len(word_starts) > 1:
+            last_chars = codes[word_ends[:-1] - 1]
+            before_last = codes[np.maximum(word_ends[:-1] - 2, 0)]
+            sentence_ends = _lookup(SENTENCE_END_TABLE, last_chars) | (
+                _lookup(CLOSING_TABLE, last_chars) & _lookup(SENTENCE_END_TABLE, before_last))
+            newlines = np.flatnonzero(codes == 10)
+            gap_newlines = np.searchsorted(newlines, word_starts[1:]) - np.searchsorted(newlines, word_ends[:-1])
+            breaks[:-1][sentence_ends] = BREAK_SENTENCE
+            breaks[:-1][gap_newlines == 1] = BREAK_LINE
+            breaks[:-1][gap_newlines >= 2] = BREAK_PARAGRAPH
+
+        starts = word_starts + start
+        ends = word_ends + start
+        if max(tokens, default=0) <= self.budget:
+            return starts, ends, tokens, breaks
+
+        # Cut words longer than a chunk at token boundaries
+        starts, ends, breaks = starts.tolist(), ends.tolist(), breaks.tolist()
+        for i in reversed([i for i, count in enumerate(tokens) if count > self.budget]):
+            word_start, word_end = starts[i], ends[i]
+            cuts = [word_start + cut for cut in self.token_counter.cut_points(text[word_start:word_end], self.budget)]
+            bounds = [word_start] + cuts + [word_end]
+            pieces = list(zip(bounds, bounds[1:]))
+            starts[i:i + 1] = [piece_start for piece_start, _ in pieces]
+            ends[i:i + 1] = [piece_end for _, piece_end in pieces]
+            tokens[i:i + 1] = [min(self.budget, self.token_counter.count(text[a:b])) for a, b in pieces]
+            breaks[i:i + 1] = [BREAK_TOKEN] * (len(pieces) - 1) + [breaks[i]]
+        return np.asarray(starts), np.asarray(ends), tokens, np.asarray(breaks, dtype=np.int8)
+
+    def _window_end(self, text, start):
+        end = start + self.window_chars
+        if end >= len(text):
+            return len(text)
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, start, end)
+            if cut > start:
+                return cut
+        return end
+
+    def _pack(self, tokens, breaks, final):
+        """
+        Chunks of a window as (first word, last word, tokens). Without final,
+        the last chunk is left out and its first word returned to continue.
+        """
+        budget = self.budget
+        cumulative = list(accumulate(tokens, initial=0))
+        # Word indices after which a break of each level (or coarser) follows,
+        # every word boundary is one unless words were cut
+        levels = [np.flatnonzero(breaks <= max_level).tolist() for max_level in range(BREAK_WORD)]
+        word_cuts = bool((breaks == BREAK_TOKEN).any())
+        if word_cuts:
+            levels.append(np.flatnonzero(breaks <= BREAK_WORD).tolist())
+
+        chunks = []
+        first = 0
+        n_words = len(tokens)
+        while first < n_words:
+            # Last word that fits into the budget
+            last = max(first, min(bisect_right(cumulative, cumulative[first] + budget) - 2, n_words - 1))
+            if last == n_words - 1:
+                if not final and first > 0:
+                    return chunks, first
+            else:
+                # Coarsest break that keeps the chunk at least MIN_FILL full
+                min_last = max(first, bisect_left(cumulative, cumulative[first] + MIN_FILL * budget) - 1)
+                for candidates in levels:
+                    i = bisect_right(candidates, last) - 1
+                    if i >= 0 and candidates[i] >= min_last:
+                        last = candidates[i]
+                        break
+                # Otherwise at the last word that fits
+            chunks.append((first, last, cumulative[last + 1] - cumulative[first]))
+            if last == n_words - 1:
+                break
+
+            # Next chunk repeats the words of the last overlap_tokens
+            next_first = bisect_left(cumulative, cumulative[last + 1] - self.overlap_tokens)
+            first = min(max(next_first, first + 1), last + 1)
+        return chunks, n_words
+
+    def iter_chunks(self, text):
+        """
+        Yield (chunk, start offset, tokens) for every chunk of the text.
+        """
+        start = 0
+        while start < len(text):
+            end = self._window_end(text, start)
+            starts, ends, tokens, breaks = self._words(text, start, end)
+            chunks, resume = self._pack(tokens, breaks, end >= len(text))
+            for first, last, n_tokens in chunks:
+                chunk_start = int(starts[first])
+                yield text[chunk_start:int(ends[last])], chunk_start, n_tokens
+            if resume >= len(starts):
+                start = end
+            else:
+                # The unfinished last chunk is packed again with the next window
+                start = int(starts[resume])
+
+    def split(self, text) -> list:
+        """
+        List of (chunk, start offset) pairs.
+        """
+        return [(chunk, offset) for chunk, offset, _ in self.iter_chunks(text)]
+
+    def split_text(self, text) -> list:
+        return [chunk for chunk, _, _ in self.iter_chunks(text)]
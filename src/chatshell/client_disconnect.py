@@ -0,0 +1,55 @@
+import asyncio
+
+import anyio
+
+
+class ClientDisconnected(Exception):
+    """
+    The client closed the connection before the response was complete.
+    """
+
+
+async def wait_for_disconnect(request):
+    # After the request body was read, the next ASGI message is http.disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request, awaitable):
+    """
+    Await awaitable (e.g. a non-streaming upstream request) and cancel it as
+    soon as the client disconnects. Raises ClientDisconnected in that case.
+
+    Streaming responses need no watcher, their generators are cancelled by the
+    response classes on a disconnect.
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+
+    if task.cancelled():
+        raise ClientDisconnected()
+    return task.result()
+
+
+async def close_upstream(close):
+    """
+    Close an upstream response (coroutine function close), also while the
+    calling stream is being cancelled because the client disconnected.
+    """
+    with anyio.CancelScope(shield=True):
+        try:
+            await close()
+        except Exception as e:
+            print(f"--> Closing the upstream response failed: {e}")
@@ -0,0 +1,143 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import inspect
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .tracing import run_traced
+
+
+class CommandContext:
+    """
+    Arguments of a single slash command invocation inside a chat.
+    """
+
+    def __init__(self, command, args, message, payload):
+        self.command    = command
+        self.args       = args
+        self.message    = message
+        self.payload    = payload
+
+
+class ChatCommand:
+    def __init__(self, name, handler, help_entries):
+        self.name           = name
+        self.handler        = handler
+        self.help_entries   = help_entries
+
+
+class ReadWriteLock:
+    """
+    asyncio lock held by any number of readers at once or by one writer.
+    Waiting writers keep new readers out, so a stream of readers can not
+    starve them.
+    """
+
+    def __init__(self):
+        self.condition          = asyncio.Condition()
+        self.readers            = 0
+        self.writer             = False
+        self.writers_waiting    = 0
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writer and self.writers_waiting == 0)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self.condition:
+            self.writers_waiting += 1
+            try:
+                await self.condition.wait_for(lambda: not self.writer and self.readers == 0)
+            finally:
+                self.writers_waiting -= 1
+                # Readers held back by a cancelled writer may continue
+                self.condition.notify_all()
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+
+class CommandRegistry:
+    """
+    Registry of the in-chat slash commands.
+
+    Handlers are coroutines, so they never block the event loop themselves.
+    Blocking work (file parsing, crawling, embedding, endpoint management) is
+    moved to a worker thread pool with run_blocking().
+    """
+
+    def __init__(self, max_workers=4):
+        self.commands = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chatshell-command")
+
+    def command(self, *names, help=None):
+        """
+        Decorator to register an async handler for one or more command names.
+        help is a list of (usage, description) tuples shown by /help.
+        """
+        def decorator(handler):
+            if not inspect.iscoroutinefunction(handler):
+                raise TypeError(f"Handler for command {names[0]} must be a coroutine function.")
+
+            for i, name in enumerate(names):
+                # Help entries are only listed once, for the first name
+                self.commands[name] = ChatCommand(name, handler, help if i == 0 and help else [])
+            return handler
+        return decorator
+
+    def get(self, name):
+        return self.commands.get(name)
+
+    def names(self):
+        return list(self.commands.keys())
+
+    def help_table(self):
+        rows = [
+            "| Command | Description |",
+            "|---------|-------------|",
+        ]
+        for chat_command in self.commands.values():
+            for usage, description in chat_command.help_entries:
+                rows.append(f"| `{usage}` | {description} |")
+        return "\n".join(rows) + "\n"
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """
+        Run a blocking function in the command worker pool and wait for it without
+        blocking the event loop. The current context (e.g. request trace) is preserved,
+        a profiled request also profiles the call.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, run_traced, func, *args, **kwargs))
+
+    async def dispatch(self, context: CommandContext):
+        """
+        Run the handler for the given command. Returns None for unknown commands.
+        """
+        chat_command = self.commands.get(context.command)
+        if chat_command is None:
+            return None
+        return await chat_command.handler(context)
+
+    def shutdown(self):
+        if sys.version_info >= (3, 9):
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            # cancel_futures is not available before Python 3.9
+            self.executor.shutdown(wait=False)
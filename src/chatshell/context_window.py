@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+import httpx
+
+from .server_props import server_root_url
+
+
+CONTEXT_MANAGEMENT_OFF = "off"
+CONTEXT_MANAGEMENT_DROP = "drop"
+CONTEXT_MANAGEMENT_SUMMARIZE = "summarize"
+
+# Tokens of the chat template around every message (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 8
+
+SUMMARY_HEADER = "Summary of the earlier part of this conversation:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    # Fallback if the endpoint has no tokenizer API, ~4 characters per token
+    return len(text) // 4 + 1
+
+
+class CompactionState:
+    def __init__(self, cutoff, prefix_hash, summary):
+        self.cutoff         = cutoff
+        self.prefix_hash    = prefix_hash
+        self.summary        = summary
+
+
+class ContextWindowManager:
+    """
+    Keeps the forwarded messages within a share of the context size of the endpoint.
+
+    Tokens are counted with the tokenizer of the loaded model (llama-server
+    /tokenize, cached per message), with a character based estimate as fallback.
+    If the history is too long, the oldest turns are dropped ("drop") or replaced
+    by a summary ("summarize"). Leading system messages and the last message are
+    always kept.
+
+    The cut is made with some headroom (compact_share) and remembered per
+    conversation, so it only moves every few turns and the prompt prefix stays
+    stable for the prompt cache. Summaries are computed incrementally from the
+    previous summary and the newly cut turns, each only once per conversation.
+    """
+
+    def __init__(self, http_client, server_props, mode=CONTEXT_MANAGEMENT_DROP, context_share=0.75,
+                 compact_share=0.5, metrics=None, max_conversations=512, max_token_cache=8192):
+        self.http_client        = http_client
+        self.server_props       = server_props
+        self.mode               = mode
+        self.context_share      = context_share
+        self.compact_share      = compact_share
+        self.metrics            = metrics
+        self.max_conversations  = max_conversations
+        self.max_token_cache    = max_token_cache
+
+        self.token_counts       = OrderedDict() # (base_url, content hash) -> tokens
+        self.tokenize_failed    = {}            # base_url -> time of last failed /tokenize
+        self.compactions        = OrderedDict() # conversation key -> CompactionState
+
+    def _count(self, name, value=1):
+        if self.metrics is not None:
+            self.metrics.increment(name, value)
+
+    async def count_tokens(self, text, base_url):
+        """
+        Number of tokens of text with the tokenizer of the endpoint.
+        """
+        cache_key = (base_url, hashlib.sha1(text.encode("utf-8")).digest())
+        if cache_key in self.token_counts:
+            self.token_counts.move_to_end(cache_key)
+            return self.token_counts[cache_key]
+
+        tokens = None
+        if time.monotonic() - self.tokenize_failed.get(base_url, -60.0) > 60.0:
+            try:
+                response = await self.http_client.post(
+                    f"{server_root_url(base_url)}/tokenize", json={"content": text}, timeout=10.0
+                )
+                if response.status_code == 200:
+                    tokens = len(response.json().get("tokens", []))
+            except (httpx.HTTPError, ValueError):
+                tokens = None
+
+            if tokens is None:
+                # No tokenizer API, use the estimate for a while
+                self.tokenize_failed[base_url] = time.monotonic()
+
+        if tokens is None:
+            return estimate_tokens(text)
+
+        self.token_counts[cache_key] = tokens
+        while len(self.token_counts) > self.max_token_cache:
+            self.token_counts.popitem(last=False)
+        return tokens
+
+    async def count_messages(self, messages, base_url):
+        counts = await asyncio.gather(
+            *(self.count_tokens(str(message.get("content", "")), base_url) for message in messages)
+        )
+        return [count + MESSAGE_OVERHEAD_TOKENS for count in counts]
+
+    @staticmethod
+    def _prefix_hash(messages):
+        digest = hashlib.sha1()
+        for message in messages:
+            digest.update(str(message.get("role", "")).encode("utf-8") + b"\x00" + str(message.get("content", "")).encode("utf-8") + b"\x00")
+        return digest.digest()
+
+    def _remember(self, key, state):
+        self.compactions[key] = state
+        self.compactions.move_to_end(key)
+        while len(self.compactions) > self.max_conversations:
+            self.compactions.popitem(last=False)
+
+    @staticmethod
+    def _insert_summary(messages, summary):
+        summary_text = SUMMARY_HEADER + summary
+        if len(messages) > 0 and messages[0].get("role") == "system" and isinstance(messages[0].get("content"), str):
+            messages[0] = dict(messages[0], content=messages[0]["content"] + "\n\n" + summary_text)
+        else:
+            messages.insert(0, {"role": "system", "content": summary_text})
+        return messages
+
+    async def fit(self, messages, base_url, conversation, summarize=None):
+        """
+        Returns the messages that fit into the context of the endpoint.
+
+        conversation:   stable key of the conversation (see slot_router.conversation_key)
+        summarize:      coroutine (previous summary, messages) -> summary, required for "summarize"
+        """
+        if self.mode == CONTEXT_MANAGEMENT_OFF or len(messages) < 2:
+            return messages
+
+        n_ctx = await self.server_props.context_size(base_url)
+        if n_ctx is None:
+            return messages
+        budget = int(n_ctx * self.context_share)
+
+        head = 0
+        while head < len(messages) - 1 and messages[head].get("role") in ("system", "developer"):
+            head += 1
+
+        counts = await self.count_messages(messages, base_url)
+
+        # Cut of an earlier turn of this conversation, if the history still matches
+        cutoff, summary = head, None
+        state = self.compactions.get(conversation)
+        if state is not None and state.cutoff < len(messages) and self._prefix_hash(messages[head:state.cutoff]) == state.prefix_hash:
+            cutoff, summary = state.cutoff, state.summary
+            self.compactions.move_to_end(conversation)
+
+        summary_tokens = await self.count_tokens(SUMMARY_HEADER + summary, base_url) if summary else 0
+        if sum(counts[:head]) + summary_tokens + sum(counts[cutoff:]) > budget:
+            # Move the cut forward to the start of a user turn, until the rest fits with headroom
+            target = int(budget * self.compact_share)
+            new_cutoff = cutoff
+            while new_cutoff < len(messages) - 1 and sum(counts[:head]) + summary_tokens + sum(counts[new_cutoff:]) > target:
+                new_cutoff += 1
+                while new_cutoff < len(messages) - 1 and messages[new_cutoff].get("role") != "user":
+                    new_cutoff += 1
+
+            if self.mode == CONTEXT_MANAGEMENT_SUMMARIZE and summarize is not None:
+                # Summarize in parts that fit into the context of the summary request
+                start = cutoff
+                while start < new_cutoff:
+                    end, size = start, 0
+                    while end < new_cutoff and (end == start or size + counts[end] <= target):
+                        size += counts[end]
+                        end += 1
+                    try:
+                        summary = await summarize(summary, messages[start:end])
+                        self._count("context_summaries")
+                    except Exception as e:
+                        # Continue with the turns dropped
+                        print(f"--> Summarizing the conversation history failed: {e}")
+                    start = end
+
+            self._count("context_trimmed_messages", new_cutoff - cutoff)
+            cutoff = new_cutoff
+            self._remember(conversation, CompactionState(cutoff, self._prefix_hash(messages[head:cutoff]), summary))
+
+        if cutoff == head:
+            return messages
+
+        fitted = list(messages[:head]) + list(messages[cutoff:])
+        if summary:
+            fitted = self._insert_summary(fitted, summary)
+        return fitted
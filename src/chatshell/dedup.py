@@ -0,0 +1,193 @@
+import hashlib
+import re
+from zlib import crc32
+
+import numpy as np
+
+
+# Shingles are runs of this many words
+SHINGLE_WORDS = 3
+
+# Pages are near duplicates if their 64 bit SimHash fingerprints differ in at
+# most this many bits (template pages with a changed date or counter)
+SIMHASH_MAX_DISTANCE = 3
+# Shorter pages are only compared exactly, SimHash is unreliable on little text
+SIMHASH_MIN_SHINGLES = 24
+
+# Chunks are near duplicates if the estimated Jaccard similarity of their
+# shingles is at least MINHASH_THRESHOLD
+MINHASH_PERMUTATIONS    = 64
+MINHASH_BANDS           = 16
+MINHASH_THRESHOLD       = 0.8
+
+WORD = re.compile(r"\w+")
+
+# Seeds of the MinHash permutations, fixed so signatures are reproducible
+MINHASH_SEEDS = np.random.default_rng(0x5eed).integers(0, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def _mix(x):
+    # splitmix64 finalizer, spreads the bits of 64 bit integers (wraps on overflow)
+    with np.errstate(over="ignore"):
+        x = x ^ (x >> np.uint64(30))
+        x = x * np.uint64(0xbf58476d1ce4e5b9)
+        x = x ^ (x >> np.uint64(27))
+        x = x * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
+
+
+def exact_hash(text) -> bytes:
+    """
+    Hash of a text with normalized whitespace.
+    """
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).digest()
+
+
+def shingle_hashes(text):
+    """
+    64 bit hashes of the word shingles of a text (lower case, without punctuation).
+    """
+    words = WORD.findall(text.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    hashes = np.fromiter((crc32(word.encode("utf-8")) for word in words), dtype=np.uint64, count=len(words))
+    n = min(SHINGLE_WORDS, len(words))
+    count = len(words) - n + 1
+    shingles = hashes[:count].copy()
+    with np.errstate(over="ignore"):
+        for i in range(1, n):
+            shingles = shingles * np.uint64(0x100000001b3) + hashes[i:i + count]
+    return _mix(shingles)
+
+
+def simhash(shingles) -> int:
+    """
+    64 bit SimHash fingerprint: every bit is set if it is set in most shingle hashes.
+    """
+    bits = np.unpackbits(shingles.view(np.uint8).reshape(-1, 8), axis=1)
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def minhash(shingles):
+    """
+    MinHash signature: the minimum of every hash permutation over the distinct shingles.
+    """
+    return _mix(np.unique(shingles)[:, None] ^ MINHASH_SEEDS[None, :]).min(axis=0)
+
+
+class SimHashIndex:
+    """
+    Fingerprints with a Hamming distance of at most max_distance. The
+    fingerprint is split into max_distance + 1 blocks; two fingerprints within
+    the distance share at least one block exactly, only fingerprints sharing a
+    block are compared.
+    """
+
+    def __init__(self, max_distance=SIMHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        blocks = max_distance + 1
+        self.bounds = [64 * i // blocks for i in range(blocks + 1)]
+        self.tables = [{} for _ in range(blocks)]
+
+    def _keys(self, fingerprint):
+        return [(fingerprint >> low) & ((1 << (high - low)) - 1) for low, high in zip(self.bounds, self.bounds[1:])]
+
+    def find(self, fingerprint):
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            for other, value in table.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return value
+        return None
+
+    def add(self, fingerprint, value):
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            table.setdefault(key, []).append((fingerprint, value))
+
+
+class MinHashIndex:
+    """
+    MinHash signatures with an estimated Jaccard similarity of at least
+    threshold. Locality sensitive hashing: signatures are split into bands,
+    only signatures with an identical band are compared.
+    """
+
+    def __init__(self, threshold=MINHASH_THRESHOLD, bands=MINHASH_BANDS):
+        self.threshold  = threshold
+        self.bands      = bands
+        self.tables     = [{} for _ in range(bands)]
+
+    def _keys(self, signature):
+        data = signature.tobytes()
+        step = len(data) // self.bands
+        return [data[i:i + step] for i in range(0, step * self.bands, step)]
+
+    def find(self, signature):
+        for table, key in zip(self.tables, self._keys(signature)):
+            for other, value in table.get(key, ()):
+                if np.count_nonzero(other == signature) >= self.threshold * len(signature):
+                    return value
+        return None
+
+    def add(self, signature, value):
+        for table, key in zip(self.tables, self._keys(signature)):
+            table.setdefault(key, []).append((signature, value))
+
+
+class Deduplicator:
+    """
+    Exact and near-duplicate detection of pages and chunks before they are
+    embedded. Pages are compared by a hash of their text and by SimHash (same
+    page under several URLs, template pages), chunks by hash and by MinHash
+    (boilerplate paragraphs repeated on many pages). Every page or chunk is
+    registered with a value (e.g. its chunk labels) that is returned for its
+    later duplicates.
+    """
+
+    def __init__(self, simhash_distance=SIMHASH_MAX_DISTANCE, minhash_threshold=MINHASH_THRESHOLD):
+        self.exact_pages        = {}
+        self.exact_chunks       = {}
+        self.similar_pages      = SimHashIndex(simhash_distance)
+        self.similar_chunks     = MinHashIndex(minhash_threshold)
+        self.duplicate_pages    = 0
+        self.duplicate_chunks   = 0
+
+    def check_page(self, text, value):
+        """
+        Value of an earlier duplicate of the page; if there is none, the page
+        is registered with value and None returned.
+        """
+        key = exact_hash(text)
+        duplicate = self.exact_pages.get(key)
+        if duplicate is None:
+            shingles = shingle_hashes(text)
+            fingerprint = simhash(shingles) if len(shingles) >= SIMHASH_MIN_SHINGLES else None
+            if fingerprint is not None:
+                duplicate = self.similar_pages.find(fingerprint)
+            if duplicate is None:
+                self.exact_pages[key] = value
+                if fingerprint is not None:
+                    self.similar_pages.add(fingerprint, value)
+                return None
+        self.duplicate_pages += 1
+        return duplicate
+
+    def check_chunk(self, text, value):
+        """
+        Value of an earlier duplicate of the chunk; if there is none, the chunk
+        is registered with value and None returned.
+        """
+        key = exact_hash(text)
+        duplicate = self.exact_chunks.get(key)
+        if duplicate is None:
+            shingles = shingle_hashes(text)
+            signature = minhash(shingles) if len(shingles) > 1 else None
+            if signature is not None:
+                duplicate = self.similar_chunks.find(signature)
+            if duplicate is None:
+                self.exact_chunks[key] = value
+                if signature is not None:
+                    self.similar_chunks.add(signature, value)
+                return None
+        self.duplicate_chunks += 1
+        return duplicate
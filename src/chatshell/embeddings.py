@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+import requests
+
+from .tracing import trace_span
+
+
+EMBEDDING_BACKEND_LIGHT_EMBED   = "light_embed"
+EMBEDDING_BACKEND_LLAMA_SERVER  = "llama-server"
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def _normalize(embeddings):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class EmbeddingBackend:
+    """
+    Text embedding model. encode returns a float32 matrix with one row per
+    text; dim is the length of the rows, found with a first encode if the
+    model does not tell. The model_id identifies model and dimension of an
+    index, indexes of another model_id can not be searched with it.
+    """
+
+    model_id = None
+    # Hugging Face tokenizer of the model for the chunk sizes, if there is one
+    tokenizer = None
+
+    def __init__(self):
+        self._dim = None
+
+    def encode(self, texts, normalize_embeddings=True):
+        raise NotImplementedError
+
+    @property
+    def dim(self) -> int:
+        if self._dim is None:
+            self._dim = int(self.encode(["dimension"]).shape[1])
+        return self._dim
+
+
+class LightEmbedBackend(EmbeddingBackend):
+    """
+    ONNX model of light_embed in the process. quantize selects the quantized
+    model files, if the model has them.
+    """
+
+    def __init__(self, model_name=DEFAULT_EMBEDDING_MODEL, quantize=False, batch_size=32):
+        super().__init__()
+        from light_embed import TextEmbedding
+
+        self.model      = TextEmbedding(model_name, quantize=quantize) if quantize else TextEmbedding(model_name)
+        self.batch_size = batch_size
+        self.model_id   = f"{EMBEDDING_BACKEND_LIGHT_EMBED}:{model_name}" + (":quantized" if quantize else "")
+
+    @property
+    def tokenizer(self):
+        return getattr(self.model, "tokenizer", None)
+
+    def encode(self, texts, normalize_embeddings=True):
+        embeddings = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=normalize_embeddings)
+        return np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+
+
+class LlamaServerBackend(EmbeddingBackend):
+    """
+    Embeddings endpoint of a running llama-server (started with --embeddings),
+    OpenAI compatible: POST <base_url>/embeddings. Texts are sent in batches of
+    batch_size over one keep-alive connection. The model_id names the model the
+    server runs (GET <base_url>/models), not the configured model name.
+    """
+
+    def __init__(self, base_url, model=None, batch_size=64, timeout=120):
+        super().__init__()
+        self.base_url   = base_url.rstrip("/")
+        self.model      = model
+        self.batch_size = batch_size
+        self.timeout    = timeout
+        self.session    = requests.Session()
+        self._model_id  = None
+
+    @property
+    def model_id(self):
+        if self._model_id is None:
+            response = self.session.get(f"{self.base_url}/models", timeout=self.timeout)
+            response.raise_for_status()
+            # Alias (--alias) or model file of the server, the configured model if the server lists several
+            served = [str(item["id"]) for item in response.json().get("data", []) if item.get("id")]
+            if len(served) == 0:
+                model = self.model or self.base_url
+            elif self.model in served:
+                model = self.model
+            else:
+                model = os.path.basename(served[0])
+            self._model_id = f"{EMBEDDING_BACKEND_LLAMA_SERVER}:{model}"
+        return self._model_id
+
+    def encode(self, texts, normalize_embeddings=True):
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            payload = {"input": list(texts[start:start + self.batch_size])}
+            if self.model:
+                payload["model"] = self.model
+            with trace_span("embedding_request"):
+                response = self.session.post(f"{self.base_url}/embeddings", json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            # Items carry their index, the order is not guaranteed
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+            rows.extend(item["embedding"] for item in data)
+
+        embeddings = np.asarray(rows, dtype=np.float32).reshape(len(texts), -1)
+        return _normalize(embeddings) if normalize_embeddings else embeddings
+
+
+class MatryoshkaBackend(EmbeddingBackend):
+    """
+    The first dim components of the embeddings of another backend, normalized
+    again. Models trained with Matryoshka representation learning (e.g.
+    nomic-embed-text-v1.5) keep most of their quality at a fraction of the
+    dimensions; index memory and search time shrink with the dimension.
+    """
+
+    def __init__(self, backend, dim):
+        super().__init__()
+        self.backend        = backend
+        self.truncate_dim   = dim
+
+    @property
+    def model_id(self):
+        return f"{self.backend.model_id}@{self.truncate_dim}"
+
+    @property
+    def tokenizer(self):
+        return self.backend.tokenizer
+
+    @property
+    def dim(self) -> int:
+        return min(self.truncate_dim, self.backend.dim)
+
+    def encode(self, texts, normalize_embeddings=True):
+        embeddings = self.backend.encode(texts, normalize_embeddings=False)[:, :self.truncate_dim]
+        return _normalize(embeddings) if normalize_embeddings else np.ascontiguousarray(embeddings)
+
+
+def create_embedding_backend(backend=EMBEDDING_BACKEND_LIGHT_EMBED, model=DEFAULT_EMBEDDING_MODEL, base_url=None, dim=0, quantize=False):
+    """
+    Embedding backend from the configuration, truncated to dim (Matryoshka) if
+    dim is set and smaller than the dimension of the model.
+    """
+    backend = str(backend).lower()
+    if backend == EMBEDDING_BACKEND_LLAMA_SERVER:
+        if not base_url:
+            raise ValueError("The llama-server embedding backend needs a base URL")
+        embedding_backend = LlamaServerBackend(base_url, model)
+    else:
+        if backend != EMBEDDING_BACKEND_LIGHT_EMBED:
+            print(f"--> Embedding backend '{backend}' is unknown, using {EMBEDDING_BACKEND_LIGHT_EMBED}.")
+        embedding_backend = LightEmbedBackend(model or DEFAULT_EMBEDDING_MODEL, quantize)
+
+    if dim and dim > 0:
+        return MatryoshkaBackend(embedding_backend, int(dim))
+    return embedding_backend
@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+from .model_download import file_sha256
+from .tracing import trace_span
+
+
+MANIFEST_FILE = "files.json"
+
+# Documents of the folder that are indexed
+FOLDER_DOCUMENT_SUFFIXES = (".pdf", ".txt", ".md")
+
+# Store and index are rebuilt without the removed chunks once they are
+# at least this many and outnumber the searchable ones
+COMPACT_MIN_DELETED = 1000
+
+CHANGE_ADDED    = "added"
+CHANGE_CHANGED  = "changed"
+CHANGE_REMOVED  = "removed"
+
+
+def read_document(path, pdf_extractor):
+    """
+    Text of a document as a list of (position, text), one entry per PDF page.
+    """
+    if str(path).lower().endswith(".pdf"):
+        return [(page_num, text) for page_num, text in enumerate(pdf_extractor.page_texts(path)) if text]
+
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return [(0, f.read())]
+
+
+def change_summary(changes):
+    counts = {kind: 0 for kind in (CHANGE_ADDED, CHANGE_CHANGED, CHANGE_REMOVED)}
+    for kind, _, _ in changes:
+        counts[kind] += 1
+    return ", ".join(f"{count} {kind}" for kind, count in counts.items())
+
+
+class FolderIndex:
+    """
+    Persistent index of all documents in a folder, updated incrementally.
+
+    A scan compares every file with the manifest of the indexed files by mtime
+    and size, and by content hash if these differ. Only added and changed files
+    are read and embedded, the chunks of changed and removed files are marked
+    as deleted in the hnswlib index. Index, chunks and manifest are saved to
+    index_dir and loaded again on the next start, so the whole folder is
+    searchable without an ingestion step.
+
+    Changes are applied in three steps (scan, prepare, apply), which lets the
+    caller embed documents while searches in the index continue and lock
+    only the index updates.
+    """
+
+    def __init__(self, vectorsearch, doc_dir, index_dir):
+        self.vectorsearch   = vectorsearch
+        self.doc_dir        = Path(doc_dir)
+        self.index_dir      = Path(index_dir)
+        # Relative path -> mtime_ns, size, sha256 and label range of its chunks
+        self.files          = {}
+        self.dirty          = False
+
+    def load(self) -> bool:
+        """
+        Load the saved index, returns False if there is none for the folder.
+        """
+        path = self.index_dir / "current"
+        if not path.exists() and (self.index_dir / "previous").exists():
+            # Save was interrupted between the renames
+            path = self.index_dir / "previous"
+
+        try:
+            with open(path / MANIFEST_FILE, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("doc_dir") != str(self.doc_dir):
+                print(f"--> Folder index in {path} belongs to another folder, rebuilding.")
+                return False
+            if (path / "metadata.json").exists():
+                self.vectorsearch.load_index(path, mmap=False, writable=True)
+            self.files = manifest["files"]
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            print(f"--> Folder index in {path} could not be loaded, rebuilding: {e}")
+            return False
+
+        print(f"--> Folder index loaded: {len(self.files)} documents, {self.vectorsearch.live_count()} chunks.")
+        return True
+
+    def scan(self):
+        """
+        Compare the folder with the manifest. Returns the changes as a list of
+        (kind, relative path, file state). Files with a new mtime but the same
+        content only get their manifest entry updated.
+        """
+        changes = []
+        seen = set()
+
+        with trace_span("folder_scan"):
+            for root, dirs, filenames in os.walk(self.doc_dir):
+                # Skip hidden directories
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                for filename in filenames:
+                    if filename.startswith(".") or not filename.lower().endswith(FOLDER_DOCUMENT_SUFFIXES):
+                        continue
+                    path = os.path.join(root, filename)
+                    rel_path = os.path.relpath(path, self.doc_dir)
+                    try:
+                        stat = os.stat(path)
+                        entry = self.files.get(rel_path)
+                        if entry is not None and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                            seen.add(rel_path)
+                            continue
+                        state = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": file_sha256(path)}
+                    except OSError:
+                        # Removed meanwhile
+                        continue
+                    seen.add(rel_path)
+
+                    if entry is not None and entry["sha256"] == state["sha256"]:
+                        entry.update(state)
+                        self.dirty = True
+                        continue
+                    changes.append((CHANGE_CHANGED if entry is not None else CHANGE_ADDED, rel_path, state))
+
+        for rel_path in self.files:
+            if rel_path not in seen:
+                changes.append((CHANGE_REMOVED, rel_path, None))
+        return changes
+
+    def prepare(self, change):
+        """
+        Read, split and embed the document of an added or changed file.
+        Returns chunks, their positions, character offsets and embeddings.
+        """
+        kind, rel_path, _ = change
+        if kind == CHANGE_REMOVED:
+            return None
+
+        chunks = []
+        positions = []
+        offsets = []
+        try:
+            for position, text in read_document(self.doc_dir / rel_path, self.vectorsearch.pdf_extractor):
+                with trace_span("chunking"):
+                    for chunk, offset, _ in self.vectorsearch.chunker.iter_chunks(text):
+                        chunks.append(chunk)
+                        positions.append(position)
+                        offsets.append(offset)
+        except Exception as e:
+            # Indexed without chunks, read again when the file changes
+            print(f"--> Error while reading {rel_path}: {e}")
+            return [], [], [], None
+
+        if len(chunks) == 0:
+            return [], [], [], None
+        return chunks, positions, offsets, self.vectorsearch.embed_chunks(chunks)
+
+    def apply(self, change, prepared):
+        """
+        Update index and manifest with a change and its prepared chunks.
+        """
+        kind, rel_path, state = change
+        entry = self.files.pop(rel_path, None)
+        if entry is not None and entry["labels"][1] > entry["labels"][0]:
+            self.vectorsearch.remove_chunks(range(*entry["labels"]))
+
+        if kind != CHANGE_REMOVED:
+            chunks, positions, offsets, embeddings = prepared
+            labels = range(0)
+            if chunks:
+                labels = self.vectorsearch.add_chunks(chunks, embeddings, rel_path, positions, offsets)
+            self.files[rel_path] = dict(state, labels=[labels.start, labels.stop])
+        self.dirty = True
+
+    def compact_if_needed(self) -> bool:
+        deleted = len(self.vectorsearch.deleted_labels)
+        if deleted < COMPACT_MIN_DELETED or deleted < self.vectorsearch.live_count():
+            return False
+
+        print(f"--> Compacting folder index ({deleted} removed chunks)...")
+        mapping = self.vectorsearch.compact()
+        # Chunks keep their order, the range of every file stays contiguous
+        for entry in self.files.values():
+            start, stop = entry["labels"]
+            if stop > start:
+                entry["labels"] = [int(mapping[start]), int(mapping[start]) + stop - start]
+        self.dirty = True
+        return True
+
+    def save(self):
+        """
+        Write index, chunks and manifest. The saved state is replaced only
+        after the new one is complete.
+        """
+        if not self.dirty:
+            return
+
+        current = self.index_dir / "current"
+        previous = self.index_dir / "previous"
+        new = self.index_dir / "new"
+        shutil.rmtree(new, ignore_errors=True)
+
+        with trace_span("folder_save"):
+            if self.vectorsearch.has_index():
+                self.vectorsearch.save_index(new)
+            else:
+                new.mkdir(parents=True)
+            with open(new / MANIFEST_FILE, "w", encoding="utf-8") as f:
+                json.dump({"doc_dir": str(self.doc_dir), "files": self.files}, f)
+
+        shutil.rmtree(previous, ignore_errors=True)
+        if current.exists():
+            os.rename(current, previous)
+        os.rename(new, current)
+        shutil.rmtree(previous, ignore_errors=True)
+        self.dirty = False
+
+    def sync(self):
+        """
+        Scan and apply all changes at once, returns the changes.
+        """
+        changes = self.scan()
+        for change in changes:
+            self.apply(change, self.prepare(change))
+        self.compact_if_needed()
+        self.save()
+        return changes
@@ -0,0 +1,270 @@
+import mmap
+import struct
+from collections import Counter
+
+
+GGUF_MAGIC = b"GGUF"
+GGUF_DEFAULT_ALIGNMENT = 32
+
+# GGUF metadata value types
+GGUF_TYPE_UINT8     = 0
+GGUF_TYPE_INT8      = 1
+GGUF_TYPE_UINT16    = 2
+GGUF_TYPE_INT16     = 3
+GGUF_TYPE_UINT32    = 4
+GGUF_TYPE_INT32     = 5
+GGUF_TYPE_FLOAT32   = 6
+GGUF_TYPE_BOOL      = 7
+GGUF_TYPE_STRING    = 8
+GGUF_TYPE_ARRAY     = 9
+GGUF_TYPE_UINT64    = 10
+GGUF_TYPE_INT64     = 11
+GGUF_TYPE_FLOAT64   = 12
+
+SCALAR_FORMATS = {
+    GGUF_TYPE_UINT8: "<B", GGUF_TYPE_INT8: "<b", GGUF_TYPE_UINT16: "<H", GGUF_TYPE_INT16: "<h",
+    GGUF_TYPE_UINT32: "<I", GGUF_TYPE_INT32: "<i", GGUF_TYPE_FLOAT32: "<f", GGUF_TYPE_BOOL: "<?",
+    GGUF_TYPE_UINT64: "<Q", GGUF_TYPE_INT64: "<q", GGUF_TYPE_FLOAT64: "<d",
+}
+
+# ggml tensor types: name, elements per block, bytes per block
+GGML_TYPES = {
+    0: ("F32", 1, 4), 1: ("F16", 1, 2), 2: ("Q4_0", 32, 18), 3: ("Q4_1", 32, 20),
+    6: ("Q5_0", 32, 22), 7: ("Q5_1", 32, 24), 8: ("Q8_0", 32, 34), 9: ("Q8_1", 32, 36),
+    10: ("Q2_K", 256, 84), 11: ("Q3_K", 256, 110), 12: ("Q4_K", 256, 144), 13: ("Q5_K", 256, 176),
+    14: ("Q6_K", 256, 210), 15: ("Q8_K", 256, 292), 16: ("IQ2_XXS", 256, 66), 17: ("IQ2_XS", 256, 74),
+    18: ("IQ3_XXS", 256, 98), 19: ("IQ1_S", 256, 50), 20: ("IQ4_NL", 32, 18), 21: ("IQ3_S", 256, 110),
+    22: ("IQ2_S", 256, 82), 23: ("IQ4_XS", 256, 136), 24: ("I8", 1, 1), 25: ("I16", 1, 2),
+    26: ("I32", 1, 4), 27: ("I64", 1, 8), 28: ("F64", 1, 8), 29: ("IQ1_M", 256, 56),
+    30: ("BF16", 1, 2), 34: ("TQ1_0", 256, 54), 35: ("TQ2_0", 256, 66), 39: ("MXFP4", 32, 17),
+}
+
+# Bytes per element of the llama-server KV cache types (--cache-type-k / --cache-type-v)
+KV_CACHE_TYPE_BYTES = {
+    "f32": 4.0, "f16": 2.0, "bf16": 2.0, "q8_0": 34 / 32, "q4_0": 18 / 32,
+    "q4_1": 20 / 32, "iq4_nl": 18 / 32, "q5_0": 22 / 32, "q5_1": 24 / 32,
+}
+
+# llama-server default context size if ctx-size is not configured
+DEFAULT_CTX_SIZE = 4096
+
+# Compute buffers and runtime besides weights, KV cache and logits
+RUNTIME_OVERHEAD_BYTES = 256 * 2**20
+
+
+class GGUFError(Exception):
+    pass
+
+
+class GGUFTensor:
+    def __init__(self, name, shape, ggml_type, offset):
+        self.name       = name
+        self.shape      = shape
+        self.ggml_type  = ggml_type
+        self.offset     = offset
+
+    @property
+    def n_elements(self):
+        count = 1
+        for dim in self.shape:
+            count *= dim
+        return count
+
+    @property
+    def n_bytes(self):
+        _, block_size, block_bytes = GGML_TYPES.get(self.ggml_type, ("?", 1, 4))
+        return self.n_elements // block_size * block_bytes
+
+
+class GGUFInfo:
+    """
+    Metadata and tensor infos of a GGUF model file (no tensor data).
+    """
+
+    def __init__(self, version, metadata, tensors, header_size):
+        self.version        = version
+        self.metadata       = metadata
+        self.tensors        = tensors
+        self.header_size    = header_size
+
+    def get(self, key, default=None):
+        return self.metadata.get(key, default)
+
+    def arch_value(self, key, default=None):
+        return self.metadata.get(f"{self.architecture}.{key}", default)
+
+    @property
+    def architecture(self):
+        return self.metadata.get("general.architecture", "unknown")
+
+    @property
+    def block_count(self):
+        return int(self.arch_value("block_count", 0))
+
+    @property
+    def context_length(self):
+        return self.arch_value("context_length")
+
+    @property
+    def weights_bytes(self):
+        return sum(tensor.n_bytes for tensor in self.tensors)
+
+    @property
+    def quantization(self):
+        # Tensor type holding most of the weights, e.g. Q4_K
+        by_type = Counter()
+        for tensor in self.tensors:
+            by_type[tensor.ggml_type] += tensor.n_bytes
+        if not by_type:
+            return "unknown"
+        return GGML_TYPES.get(by_type.most_common(1)[0][0], ("unknown",))[0]
+
+    def _per_layer(self, key, default):
+        # Some metadata is an array with a value per layer, e.g. head_count_kv
+        value = self.arch_value(key, default)
+        if isinstance(value, list):
+            return [int(v) for v in value]
+        return [int(value)] * self.block_count
+
+    def kv_elements_per_token(self):
+        """
+        Number of K and V elements per token over all layers, (0, 0) for models
+        without attention KV cache.
+        """
+        n_embd = self.arch_value("embedding_length")
+        n_head = self.arch_value("attention.head_count")
+        if not n_embd or not n_head or self.block_count == 0:
+            return 0, 0
+
+        heads = self._per_layer("attention.head_count", n_head)
+        heads_kv = self._per_layer("attention.head_count_kv", n_head)
+        max_heads = max(heads) if heads else 1
+        key_length = int(self.arch_value("attention.key_length", int(n_embd) // max(1, max_heads)))
+        value_length = int(self.arch_value("attention.value_length", key_length))
+
+        k_elements = sum(key_length * n_kv for n_kv in heads_kv)
+        v_elements = sum(value_length * n_kv for n_kv in heads_kv)
+        return k_elements, v_elements
+
+
+class _Reader:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.pos    = 0
+
+    def scalar(self, fmt):
+        value = struct.unpack_from(fmt, self.buffer, self.pos)[0]
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def string(self):
+        length = self.scalar("<Q")
+        value = bytes(self.buffer[self.pos:self.pos + length]).decode("utf-8", errors="replace")
+        self.pos += length
+        return value
+
+    def skip_string(self):
+        length = self.scalar("<Q")
+        self.pos += length
+
+    def value(self, value_type, keep_arrays=True):
+        if value_type in SCALAR_FORMATS:
+            return self.scalar(SCALAR_FORMATS[value_type])
+        if value_type == GGUF_TYPE_STRING:
+            return self.string()
+        if value_type == GGUF_TYPE_ARRAY:
+            item_type = self.scalar("<I")
+            length = self.scalar("<Q")
+            if not keep_arrays:
+                # Only skip, e.g. the vocabulary of the tokenizer
+                if item_type == GGUF_TYPE_STRING:
+                    for _ in range(length):
+                        self.skip_string()
+                elif item_type in SCALAR_FORMATS:
+                    self.pos += length * struct.calcsize(SCALAR_FORMATS[item_type])
+                else:
+                    for _ in range(length):
+                        self.value(item_type, keep_arrays=False)
+                return length
+            return [self.value(item_type) for _ in range(length)]
+        raise GGUFError(f"Unknown GGUF value type {value_type}")
+
+
+def read_gguf_header(path) -> GGUFInfo:
+    """
+    Read metadata and tensor infos of a GGUF file. The file is memory-mapped, only
+    the pages of the header are read from disk. Large arrays (tokenizer) are
+    skipped, their metadata value is the array length.
+    """
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise GGUFError(f"{path} is empty")
+        with buffer:
+            if buffer[:4] != GGUF_MAGIC:
+                raise GGUFError(f"{path} is not a GGUF file")
+
+            reader = _Reader(buffer)
+            reader.pos = 4
+            try:
+                version = reader.scalar("<I")
+                if version < 2:
+                    raise GGUFError(f"GGUF version {version} is not supported")
+                tensor_count = reader.scalar("<Q")
+                kv_count = reader.scalar("<Q")
+
+                metadata = {}
+                for _ in range(kv_count):
+                    key = reader.string()
+                    value_type = reader.scalar("<I")
+                    # Per-layer arrays are small, the vocabulary is not needed
+                    metadata[key] = reader.value(value_type, keep_arrays=not key.startswith("tokenizer."))
+
+                tensors = []
+                for _ in range(tensor_count):
+                    name = reader.string()
+                    n_dims = reader.scalar("<I")
+                    shape = [reader.scalar("<Q") for _ in range(n_dims)]
+                    ggml_type = reader.scalar("<I")
+                    offset = reader.scalar("<Q")
+                    tensors.append(GGUFTensor(name, shape, ggml_type, offset))
+            except struct.error as e:
+                raise GGUFError(f"Truncated GGUF header in {path}: {e}")
+
+            return GGUFInfo(version, metadata, tensors, reader.pos)
+
+
+class MemoryEstimate:
+    def __init__(self, weights, kv_cache, overhead, ctx_size):
+        self.weights    = weights
+        self.kv_cache   = kv_cache
+        self.overhead   = overhead
+        self.ctx_size   = ctx_size
+
+    @property
+    def total(self):
+        return self.weights + self.kv_cache + self.overhead
+
+    def __str__(self):
+        return (f"{self.total / 2**30:.1f} GiB (weights {self.weights / 2**30:.1f} GiB, "
+                f"KV cache {self.kv_cache / 2**30:.1f} GiB for {self.ctx_size} tokens)")
+
+
+def estimate_memory(info: GGUFInfo, ctx_size=None, cache_type_k="f16", cache_type_v="f16", batch_size=512) -> MemoryEstimate:
+    """
+    Memory of a llama-server running the model on the CPU: weights, KV cache for
+    ctx_size tokens with the given cache types, logits and runtime overhead.
+    """
+    ctx_size = int(ctx_size) if ctx_size else DEFAULT_CTX_SIZE
+    k_elements, v_elements = info.kv_elements_per_token()
+    kv_bytes = ctx_size * (
+        k_elements * KV_CACHE_TYPE_BYTES.get(str(cache_type_k or "f16").lower(), 2.0)
+        + v_elements * KV_CACHE_TYPE_BYTES.get(str(cache_type_v or "f16").lower(), 2.0)
+    )
+
+    n_vocab = info.get("tokenizer.ggml.tokens", 0)
+    n_vocab = n_vocab if isinstance(n_vocab, int) else len(n_vocab)
+    logits_bytes = n_vocab * int(batch_size or 512) * 4
+
+    return MemoryEstimate(info.weights_bytes, int(kv_bytes), logits_bytes + RUNTIME_OVERHEAD_BYTES, ctx_size)
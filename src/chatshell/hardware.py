@@ -0,0 +1,124 @@
+import os
+import subprocess
+
+
+def physical_cores():
+    # Unique (physical id, core id) pairs of /proc/cpuinfo, None if unavailable
+    try:
+        cores = set()
+        physical_id = core_id = None
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("physical id"):
+                    physical_id = line.split(":", 1)[1].strip()
+                elif line.startswith("core id"):
+                    core_id = line.split(":", 1)[1].strip()
+                elif not line.strip():
+                    if core_id is not None:
+                        cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+        if core_id is not None:
+            cores.add((physical_id, core_id))
+        return len(cores) or None
+    except OSError:
+        return None
+
+
+def memory_info():
+    """
+    Total and available RAM in bytes, available is None if unknown.
+    """
+    try:
+        values = {}
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                values[key] = int(value.split()[0]) * 1024
+        return values.get("MemTotal"), values.get("MemAvailable")
+    except (OSError, ValueError):
+        pass
+
+    try:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return os.sysconf("SC_PHYS_PAGES") * page_size, None
+    except (ValueError, OSError, AttributeError):
+        return None, None
+
+
+def detect_hardware() -> dict:
+    logical = os.cpu_count() or 1
+    ram_total, ram_available = memory_info()
+    return {
+        "logical_cores": logical,
+        "physical_cores": physical_cores() or logical,
+        "ram_total": ram_total,
+        "ram_available": ram_available if ram_available is not None else ram_total,
+    }
+
+
+def peak_rss(pid):
+    # Peak resident memory of a process in bytes (Linux), None if unknown
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def process_rss(pid):
+    # Current resident memory of a process in bytes (Linux), None if unknown
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def process_start_ticks(pid):
+    # Start time of a process, None if unknown: clock ticks since boot from /proc
+    # (Linux), otherwise the start time reported by ps (macOS, BSD). Only compared
+    # for equality: together with the PID it identifies a process, PIDs are reused.
+    if not os.path.isdir("/proc/self"):
+        return _ps_start_time(pid)
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        if fields[0] in ("Z", "X"):
+            # Zombie or dead
+            return None
+        return int(fields[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _ps_start_time(pid):
+    try:
+        result = subprocess.run(
+            ["ps", "-o", "stat=,lstart=", "-p", str(int(pid))],
+            capture_output=True, text=True, timeout=5, env={**os.environ, "LC_ALL": "C"}
+        )
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+    fields = result.stdout.split(None, 1)
+    if result.returncode != 0 or len(fields) != 2 or fields[0].startswith("Z"):
+        return None
+    return fields[1].strip()
+
+
+def process_alive(pid):
+    # True if a process with this PID exists, which may be a reused PID
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except (OSError, ValueError, TypeError):
+        return False
+    return True
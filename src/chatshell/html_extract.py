@@ -0,0 +1,189 @@
+import re
+
+import lxml.html
+from lxml import etree
+
+
+# Elements without readable content
+SKIP_TAGS = ("script", "style", "noscript", "template", "svg", "iframe", "object", "embed", "canvas")
+
+# Elements that start a new paragraph of the output
+BLOCK_TAGS = frozenset((
+    "address", "article", "aside", "blockquote", "details", "div", "dl", "fieldset",
+    "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6",
+    "header", "hr", "main", "nav", "ol", "p", "pre", "section", "summary", "table",
+    "ul",
+))
+# Elements that are lines of their block (list items, table rows)
+LINE_TAGS = frozenset(("dd", "dt", "li", "tr"))
+HEADING_LEVELS = {f"h{level}": level for level in range(1, 7)}
+
+# A child replaces its parent as main content if it has at least this share
+# of the parent's text outside of links (descends through wrappers and layout
+# columns, not into the longest paragraph of an article)
+DESCEND_SHARE = 0.9
+
+# Blocks inside the main content with more link text than this are left
+# out (link lists, tag clouds, "related" boxes)
+MAX_LINK_DENSITY = 0.5
+
+XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+
+def parse_html(html):
+    """
+    lxml tree of a HTML page (str or bytes), None if it has no content.
+    """
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # lxml refuses str with an encoding declaration (XHTML pages)
+        try:
+            return lxml.html.document_fromstring(XML_DECLARATION.sub("", html))
+        except (ValueError, etree.ParserError):
+            return None
+    except etree.ParserError:
+        return None
+
+
+def page_links(root):
+    """
+    Targets of all links of the page (as written, not resolved).
+    """
+    return root.xpath("//a/@href")
+
+
+def _text_lengths(root):
+    """
+    Text and link text length of every element, bottom-up in one pass:
+    every element is visited after its descendants and adds up its own text,
+    the lengths of its children and their tails.
+    """
+    text_len = {}
+    link_len = {}
+    for element in reversed(list(root.iter())):
+        text = len((element.text or "").strip())
+        links = 0
+        for child in element:
+            text += text_len[child] + len((child.tail or "").strip())
+            links += link_len[child]
+        text_len[element] = text
+        link_len[element] = text if element.tag == "a" else links
+    return text_len, link_len
+
+
+def main_content(root, text_len, link_len):
+    """
+    Element with the main content of the page.
+
+    The score of an element is its text outside of links, weighted by the
+    share of text outside of links (navigation, link lists and teasers score
+    low). Starting at body, the best child replaces the current element while
+    it is a container of blocks with nearly all text of the current element;
+    the walk stops at the element whose content is spread over several
+    children, like an article of paragraphs. A single paragraph never
+    replaces its article, even if it is much longer than the others.
+    """
+    def score(element):
+        text = text_len[element]
+        if text == 0:
+            return 0.0
+        return (text - link_len[element]) ** 2 / text
+
+    body = root.find("body")
+    node = body if body is not None else root
+    while True:
+        best = max(node, key=score, default=None)
+        if best is None or score(best) == 0:
+            break
+        if not any(child.tag in BLOCK_TAGS or child.tag in LINE_TAGS for child in best):
+            # Text block, its siblings belong to the content
+            break
+        if text_len[best] - link_len[best] < DESCEND_SHARE * (text_len[node] - link_len[node]):
+            break
+        node = best
+    return node
+
+
+def element_text(element, text_len=None, link_len=None) -> str:
+    """
+    Text of an element with its structure as plain text: blocks separated by
+    blank lines, list items, table rows and line breaks on lines of their
+    own, headings and list items marked like markdown, table cells
+    separated by "|". With the text lengths, link-dense blocks are left out.
+    """
+    blocks = []
+    lines = []
+    # Text pieces of the current line, inline elements continue it
+    pieces = []
+
+    def end_line():
+        if pieces:
+            lines.append(" ".join("".join(pieces).split()))
+            pieces.clear()
+
+    def end_block():
+        end_line()
+        text = "\n".join(line for line in lines if line)
+        if text:
+            blocks.append(text)
+        lines.clear()
+
+    walker = etree.iterwalk(element, events=("start", "end"))
+    for event, el in walker:
+        tag = el.tag
+        if event == "start":
+            if tag in BLOCK_TAGS or tag in LINE_TAGS:
+                if el is not element and text_len is not None and link_len[el] > MAX_LINK_DENSITY * text_len[el]:
+                    walker.skip_subtree()
+                    continue
+            if tag in BLOCK_TAGS:
+                end_block()
+                if tag == "pre":
+                    # Preformatted text is kept as it is
+                    text = el.text_content().strip("\n")
+                    if text.strip():
+                        blocks.append(text)
+                    walker.skip_subtree()
+                    continue
+                if tag in HEADING_LEVELS:
+                    pieces.append("#" * HEADING_LEVELS[tag] + " ")
+            elif tag in LINE_TAGS:
+                end_line()
+                if tag == "li":
+                    pieces.append("- ")
+            elif tag == "br":
+                end_line()
+            elif tag in ("td", "th") and pieces:
+                pieces.append(" | ")
+            if el.text:
+                pieces.append(el.text)
+        else:
+            if tag in BLOCK_TAGS:
+                end_block()
+            elif tag in LINE_TAGS:
+                end_line()
+            if el is not element and el.tail:
+                pieces.append(el.tail)
+    end_block()
+    return "\n\n".join(blocks)
+
+
+def extract_main_content(html) -> str:
+    """
+    Main content of a HTML page as structured plain text, empty if there is none.
+    """
+    root = parse_html(html)
+    if root is None:
+        return ""
+    return tree_main_content(root)
+
+
+def tree_main_content(root) -> str:
+    """
+    Main content of a parsed page, removes scripts, styles and comments from the tree.
+    """
+    # The tails stay, they belong to the parent
+    etree.strip_elements(root, etree.Comment, etree.ProcessingInstruction, *SKIP_TAGS, with_tail=False)
+    text_len, link_len = _text_lengths(root)
+    return element_text(main_content(root, text_len, link_len), text_len, link_len)
@@ -5,12 +5,62 @@ import requests
 import json
 import appdirs
 import sys
+import time
+import hashlib
 from pathlib import Path
 
+from .gguf import GGUFError, estimate_memory, read_gguf_header
+from .hardware import memory_info, process_alive, process_rss, process_start_ticks
+from .model_download import DownloadError, ModelDownloader, hf_file_url
+from .server_props import server_root_url
+
+# Endpoints started within this time may still be loading their model into memory
+MEMORY_SETTLE_S = 120.0
+
+# Timeout of the health check of endpoints of an earlier run
+REATTACH_HEALTH_TIMEOUT_S = 3.0
+
+
+class AdoptedProcess:
+    """
+    Endpoint process started by an earlier chatshell run. Provides the part of
+    the subprocess.Popen interface used by LocalLLMServer. The start time of
+    the process guards against a reused PID. Without a start time (not readable
+    on this system) only the PID is checked.
+    """
+
+    def __init__(self, pid, start_ticks):
+        self.pid            = pid
+        self.start_ticks    = start_ticks
+        self.returncode     = None
+
+    def poll(self):
+        if self.start_ticks is None:
+            running = process_alive(self.pid)
+        else:
+            running = process_start_ticks(self.pid) == self.start_ticks
+        if self.returncode is None and not running:
+            # Not a child of this process, the exit code is unknown
+            self.returncode = 0
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(str(self.pid), timeout)
+            time.sleep(0.1)
+        return self.returncode
+
 
 class LocalLLMServer:
-    def __init__(self, termux_paths=False):
+    def __init__(self, termux_paths=False, manage_processes=True):
+        """
+        manage_processes: False for secondary proxy workers, which only follow the
+        endpoint processes of the primary worker through process_list.json
+        """
         self.termux = termux_paths
+        self.manage_processes = manage_processes
 
         CONFIG_DIR = Path(appdirs.user_config_dir(appname='chatshell'))
         CONFIG_DIR.mkdir(parents=True, exist_ok=True)
@@ -18,10 +68,14 @@ class LocalLLMServer:
         self.llm_config_path        = CONFIG_DIR / 'llm_config.json'
         self.llm_server_config_path = CONFIG_DIR / 'llm_server_config.json'
         self.proc_list              = CONFIG_DIR / 'process_list.json'
+        self.slot_save_base_dir     = CONFIG_DIR / 'slots'
 
         self.target_server_app      = ""
         self.use_python_server_lib  = False
         self.autostart_endpoint     = ""
+        self.memory_budget_share    = 0.9
+        self.download_parts         = 8
+        self.reattach_endpoints     = True
 
         if self.termux:
             self.model_base_dir     = Path(os.path.expanduser("~/storage/shared/chatshell/Models"))
@@ -36,10 +90,21 @@ class LocalLLMServer:
         self.load_config()
 
         self.processes              = {}
+        self.process_start_times    = {}
+        self.memory_estimates       = {}
+        self.process_registry       = {}
+        self.registry_stat          = None
         self.llm_process_running    = False
 
+        if not self.manage_processes:
+            self.sync_process_registry()
+            return
+
+        # Take over endpoints that are still running from an earlier start
+        self.reattach_processes()
+
         # Start endpoint if autostart is enabled
-        if self.autostart_endpoint != "":
+        if self.autostart_endpoint != "" and self.autostart_endpoint not in self.processes:
             self.create_endpoint(self.autostart_endpoint)
 
         self.update_process_list_file()
@@ -74,8 +139,11 @@ class LocalLLMServer:
                             "cache-type-k": "",
                             "cache-type-v": "",
                             "n-gpu-layers": "",
+                            "threads": "",
+                            "batch-size": "",
                             "lora": "",
                             "no-context-shift": "",
+                            "parallel": "",
                             "api-key": ""
                         }
                     ]
@@ -99,7 +167,10 @@ class LocalLLMServer:
                 tmp_llm_server_config = {
                     "llama-server-path": "~/chatshell/Llamacpp/llama.cpp/build/bin/llama-server",
                     "use-llama-server-python": "True",
-                    "autostart-endpoint": ""
+                    "autostart-endpoint": "",
+                    "memory-budget-share": "0.9",
+                    "download-parts": "8",
+                    "reattach-endpoints": "True"
                     }
 
                 with self.llm_server_config_path.open('w') as f:
@@ -110,6 +181,9 @@ class LocalLLMServer:
                 self.target_server_app      = Path(os.path.expanduser(self.llm_server_config["llama-server-path"]))
                 self.use_python_server_lib  = json.loads(str(self.llm_server_config["use-llama-server-python"]).lower())
                 self.autostart_endpoint     = self.llm_server_config["autostart-endpoint"]
+                self.memory_budget_share    = float(self.llm_server_config.get("memory-budget-share", "0.9"))
+                self.download_parts         = int(self.llm_server_config.get("download-parts", "8"))
+                self.reattach_endpoints     = json.loads(str(self.llm_server_config.get("reattach-endpoints", "True")).lower())
 
                 # Check app file if python lib is not activated
                 if not self.use_python_server_lib:
@@ -152,7 +226,7 @@ class LocalLLMServer:
     def refresh_config(self):
         self.llm_config = None
         self.llm_server_config = None
-        self.load_config(llm_config_path=self.llm_config_path, llm_server_config_path=self.llm_server_config_path)
+        self.load_config()
 
     def update_model_catalog(self)->bool:
         print("--> Fetching model catalog from github.com/jschw/chatshell...")
@@ -188,6 +262,78 @@ class LocalLLMServer:
     def get_endpoints(self):
         return self.llm_config
 
+    def get_endpoint_config(self, name):
+        for conf in self.llm_config or []:
+            if conf.get("name") == name:
+                return conf
+        return None
+
+    def get_endpoint_base_url(self, name):
+        """
+        OpenAI-compatible base URL of an endpoint config, e.g. http://localhost:4000/v1
+        """
+        conf = self.get_endpoint_config(name)
+        if conf is None:
+            return None
+        host = conf.get("ip") or "localhost"
+        return f"http://{host}:{conf.get('port', '4000')}/v1"
+
+    def get_running_endpoints(self)->dict:
+        """
+        Base URLs of all running endpoint processes by name.
+        """
+        self.sync_process_registry()
+        running = {}
+        for name, process in self.processes.items():
+            base_url = self.get_endpoint_base_url(name)
+            if process.poll() is None and base_url is not None:
+                running[name] = base_url
+        return running
+
+    def resolve_model_path(self, model):
+        # Model file at an absolute path or relative to the model base dir, None if not found
+        if os.path.isfile(str(model)):
+            return str(model)
+        model_path = os.path.join(self.model_base_dir, str(model))
+        if os.path.isfile(model_path):
+            return model_path
+        return None
+
+    def download_model(self, name, progress=None)->list[bool, str]:
+        """
+        Download the model file (hf-repo / hf-file) of a config set into the model
+        base dir and set it as "model" of the config set. Interrupted downloads are
+        resumed, the file is verified against "sha256" of the config set or the
+        checksum reported by Hugging Face.
+        """
+        conf = self.get_endpoint_config(name)
+        if conf is None:
+            return [False, f"No configuration found for LLM with name '{name}'."]
+
+        # llama-server also accepts <repo>:<quant>, the file has to be given here
+        repo = str(conf.get("hf-repo", "")).split(":", 1)[0]
+        hf_file = str(conf.get("hf-file", ""))
+        if repo == "" or hf_file == "":
+            return [False, f"Config set '{name}' has no hf-repo and hf-file to download."]
+
+        dest_path = self.model_base_dir / os.path.basename(hf_file)
+        if not dest_path.exists():
+            print(f"--> Downloading model '{hf_file}' from {repo}...")
+            try:
+                ModelDownloader(parts=self.download_parts).download(
+                    hf_file_url(repo, hf_file), dest_path, sha256=conf.get("sha256") or None, progress=progress
+                )
+            except (DownloadError, OSError) as e:
+                print(f"--> {e}")
+                return [False, f"Download of the model failed: {e}"]
+
+        self.update_llm_conf(name, {"model": dest_path.name})
+        return [True, f"Model '{dest_path.name}' is available for '{name}'."]
+
+    def get_slot_save_dir(self, name):
+        # Directory for KV cache slot files of an endpoint (llama-server --slot-save-path)
+        return self.slot_save_base_dir / name
+
     def edit_llm_conf(self, config_set, key, value):
         found = False
         for conf in self.llm_config:
@@ -218,6 +364,24 @@ class LocalLLMServer:
         except Exception as e:
             print(f"Failed to update llm_server_config.json: {e}")
 
+    def update_llm_conf(self, config_set, values: dict)->bool:
+        """
+        Set several parameters of an LLM config set at once and save llm_config.json.
+        """
+        conf = self.get_endpoint_config(config_set)
+        if conf is None:
+            print(f"No LLM config set found with name '{config_set}'.")
+            return False
+        conf.update({key: str(value) for key, value in values.items()})
+        try:
+            with open(self.llm_config_path, "w") as f:
+                json.dump(self.llm_config, f, indent=4)
+            print(f"--> Updated LLM config set '{config_set}': {values}")
+            return True
+        except Exception as e:
+            print(f"--> Failed to update llm_config.json: {e}")
+            return False
+
     def set_autostart_endpoint(self, name)->bool:
         try:
             key = "autostart-endpoint"
@@ -256,8 +420,11 @@ class LocalLLMServer:
                 "cache-type-k": "",
                 "cache-type-v": "",
                 "n-gpu-layers": "",
+                "threads": "",
+                "batch-size": "",
                 "lora": "",
                 "no-context-shift": "",
+                "parallel": "",
                 "api-key": ""
             }
             self.llm_config.append(template)
@@ -305,9 +472,10 @@ class LocalLLMServer:
             except Exception as e:
                 print(f"Failed to rename LLM config set: {e}")
     
-    def create_endpoint(self, name)->list[bool, str]:
+    def create_endpoint(self, name, overrides=None)->list[bool, str]:
         """
         Start a new process running ./llama_server with parameters from the config for the given LLM name.
+        overrides: parameters that replace the ones of the config set for this start (e.g. autotuning)
         """
         if self.llm_config is None:
             print("--> Configuration not loaded. Please call load_config() first.")
@@ -324,7 +492,19 @@ class LocalLLMServer:
             print(f"--> No configuration found for LLM with name '{name}'.")
             return [False, f"No configuration found for LLM with name '{name}'."]
 
+        if overrides:
+            llm_config = dict(llm_config, **overrides)
+
+        if self.use_python_server_lib and llm_config.get("hf-repo") and llm_config.get("hf-file") \
+                and self.resolve_model_path(llm_config.get("model", "")) is None:
+            # The python bindings can not download models, fetch the file first
+            download_ok, output = self.download_model(name)
+            if not download_ok:
+                return [False, output]
+            llm_config = dict(llm_config, model=self.get_endpoint_config(name)["model"])
+
         # Build command line arguments from the config
+        model_path = None
         args = []
         self.args_dict = {}
         for key, value in llm_config.items():
@@ -339,23 +519,19 @@ class LocalLLMServer:
 
             # Convert boolean to flag or no flag
             if str(value).lower() == "true" or str(value).lower() == "false":
-                if value:
+                if str(value).lower() == "true":
                     args.append(arg_key)
                     self.args_dict[arg_key] = True
                 # if false, skip adding the flag
             else:
                 if arg_key == "--model":
                     # Check if model is at absolute path or model base dir available
-                    model_path = str(value)
-
-                    # Checking model path absolute + relative to model base dir
-                    if not os.path.isfile(model_path):
-                        model_path = os.path.join(self.model_base_dir, str(value))
+                    model_path = self.resolve_model_path(value)
 
-                        if not os.path.isfile(model_path):
-                            # Model is not available -> return error
-                            print("--> Error: Model file not found.")
-                            return [False, "Error: Model file not found."]
+                    if model_path is None:
+                        # Model is not available -> return error
+                        print("--> Error: Model file not found.")
+                        return [False, "Error: Model file not found."]
 
                     value = model_path
 
@@ -367,12 +543,100 @@ class LocalLLMServer:
                 args.append(str(value))
                 self.args_dict[arg_key] = value
 
+        if not self.use_python_server_lib and "--slot-save-path" not in self.args_dict:
+            # Allow saving and restoring of KV cache slots
+            slot_save_dir = self.get_slot_save_dir(name)
+            slot_save_dir.mkdir(parents=True, exist_ok=True)
+            args.append("--slot-save-path")
+            args.append(str(slot_save_dir))
+            self.args_dict["--slot-save-path"] = str(slot_save_dir)
+
+        if model_path is not None:
+            # Refuse launches that would not fit into the free memory
+            memory_ok, memory_output = self.check_memory(name, llm_config, model_path)
+            if not memory_ok:
+                return [False, memory_output]
+
         # Start the process using create_process
-        self.create_process(name, self.target_server_app, *args)
+        self.create_process(name, self.target_server_app, *args, config_hash=self.config_hash(llm_config))
 
         return [True, f"Endpoint{name} started successful."]
 
-    def create_process(self, name, executable_path, *args):
+    def estimate_endpoint_memory(self, llm_config, model_path):
+        """
+        Memory estimate of an endpoint from the GGUF header of its model and the
+        configured ctx-size, KV cache types and batch size.
+        """
+        info = read_gguf_header(model_path)
+        return estimate_memory(
+            info,
+            ctx_size=llm_config.get("ctx-size") or None,
+            cache_type_k=llm_config.get("cache-type-k") or "f16",
+            cache_type_v=llm_config.get("cache-type-v") or "f16",
+            batch_size=llm_config.get("batch-size") or 512
+        )
+
+    def pending_memory(self):
+        # Memory that recently started endpoints will still allocate while loading
+        pending = 0
+        now = time.monotonic()
+        for name, process in self.processes.items():
+            estimate = self.memory_estimates.get(name)
+            if estimate is None or process.poll() is not None:
+                continue
+            if now - self.process_start_times.get(name, 0.0) > MEMORY_SETTLE_S:
+                continue
+            pending += max(0, estimate - (process_rss(process.pid) or 0))
+        return pending
+
+    def check_memory(self, name, llm_config, model_path, wait_s=MEMORY_SETTLE_S)->list[bool, str]:
+        """
+        Check the memory estimate of an endpoint against the free RAM budget
+        (memory-budget-share of the available RAM). If other endpoints are still
+        loading, the launch waits until their memory use is known.
+        """
+        if self.memory_budget_share <= 0:
+            return [True, ""]
+
+        try:
+            estimate = self.estimate_endpoint_memory(llm_config, model_path)
+        except (GGUFError, OSError) as e:
+            print(f"--> Memory of '{name}' can not be estimated: {e}")
+            return [True, ""]
+
+        print(f"--> Memory estimate for '{name}': {estimate}")
+        deadline = time.monotonic() + wait_s
+        while True:
+            _, available = memory_info()
+            if available is None:
+                return [True, ""]
+
+            budget = available * self.memory_budget_share
+            pending = self.pending_memory()
+            if estimate.total <= budget - pending:
+                self.memory_estimates[name] = estimate.total
+                return [True, ""]
+
+            if pending == 0 or estimate.total > budget or time.monotonic() > deadline:
+                message = (f"Error: Endpoint '{name}' needs about {estimate}, but only "
+                           f"{max(0, budget - pending) / 2**30:.1f} GiB of memory are available. "
+                           "Reduce ctx-size, use a quantized KV cache or stop other endpoints.")
+                print(f"--> {message}")
+                return [False, message]
+
+            # Queue the launch until loading endpoints have settled
+            time.sleep(2.0)
+
+    def config_hash(self, llm_config):
+        # Identifies the launch configuration of an endpoint process
+        launch = {
+            "config": {key: str(value) for key, value in llm_config.items()},
+            "executable": str(self.target_server_app),
+            "python-lib": self.use_python_server_lib,
+        }
+        return hashlib.sha256(json.dumps(launch, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def create_process(self, name, executable_path, *args, config_hash=None):
         if name in self.processes:
             print(f"--> Process with name '{name}' already exists.")
             return
@@ -391,6 +655,12 @@ class LocalLLMServer:
             print(args)
 
         self.processes[name] = process
+        self.process_start_times[name] = time.monotonic()
+        self.process_registry[name] = {
+            "config_hash": config_hash,
+            "start_time": time.time(),
+            "start_ticks": process_start_ticks(process.pid),
+        }
 
         print(f"--> Process '{name}' started with PID {process.pid}.")
         self.update_process_list_file()
@@ -445,6 +715,8 @@ class LocalLLMServer:
         if len(self.processes.items()) > 0:
             for name, process in self.processes.items():
                 status = "running" if process.poll() is None else "stopped"
+                if isinstance(process, AdoptedProcess):
+                    status += " (reattached)"
                 processes.append(f"- Process '{name}': PID {process.pid}, Status: {status}")
             print(processes)
             return processes
@@ -455,31 +727,144 @@ class LocalLLMServer:
             return processes
 
     def update_process_list_file(self):
+        if not self.manage_processes:
+            return
         process_list = {
             name: {
                 "pid": process.pid,
-                "status": "running" if process.poll() is None else "stopped"
+                "status": "running" if process.poll() is None else "stopped",
+                "port": str((self.get_endpoint_config(name) or {}).get("port", "")),
+                **self.process_registry.get(name, {})
             }
             for name, process in self.processes.items()
         }
-        with open(self.proc_list, "w") as file:
+        for name in list(self.process_registry):
+            if name not in self.processes:
+                del self.process_registry[name]
+        # Replaced atomically, secondary proxy workers read it concurrently
+        tmp_path = self.proc_list.with_suffix(".tmp")
+        with open(tmp_path, "w") as file:
             json.dump(process_list, file, indent=4)
+        os.replace(tmp_path, self.proc_list)
 
-        # Update running param
-        for name, process in self.processes.items():
-            if process.poll() != None:
-                # Process is running
-                self.process_started = True
+    def sync_process_registry(self):
+        # Secondary proxy workers: follow the endpoint processes of the primary worker
+        if self.manage_processes:
+            return
+        try:
+            stat = os.stat(self.proc_list)
+        except OSError:
+            self.processes = {}
+            return
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stat_key == self.registry_stat:
+            return
+        try:
+            with open(self.proc_list, "r") as file:
+                process_list = json.load(file)
+        except (OSError, ValueError):
+            # Being rewritten, read it on the next call
+            return
+        self.registry_stat = stat_key
+        # Entries without start time (not readable on this system) are followed by PID
+        self.processes = {
+            name: AdoptedProcess(entry["pid"], entry.get("start_ticks"))
+            for name, entry in process_list.items()
+            if entry.get("status") == "running" and isinstance(entry.get("pid"), int)
+        }
 
-    def process_started(self):
-        if len(self.processes.items()) > 0:
-            for name, process in self.processes.items():
-                if process.poll() != None:
-                    # Process is running
-                    self.process_started = True
-                    return True
-        else:
+    def endpoint_healthy(self, name, base_url=None):
+        # llama-server answers /health with 200 when ready and 503 while loading the model
+        if base_url is None:
+            base_url = self.get_endpoint_base_url(name)
+        url = f"{base_url}/models" if self.use_python_server_lib else f"{server_root_url(base_url)}/health"
+        try:
+            status_code = requests.get(url, timeout=REATTACH_HEALTH_TIMEOUT_S).status_code
+        except requests.RequestException:
             return False
+        return status_code == 200 or (status_code == 503 and not self.use_python_server_lib)
+
+    def reattach_processes(self)->list:
+        """
+        Take over the endpoint processes of process_list.json that are still
+        running with an unchanged launch configuration and pass a health check.
+        Processes with a changed configuration or failing health check are
+        stopped, entries of exited processes are removed.
+        Where the start time of a process can not be read (no /proc and no ps),
+        the endpoint must answer the health check on the port of its entry,
+        otherwise the entry is removed without stopping the process.
+        Returns the names of the reattached endpoints.
+        """
+        try:
+            with open(self.proc_list, "r") as file:
+                process_list = json.load(file)
+        except (OSError, ValueError):
+            return []
+
+        reattached = []
+        for name, entry in process_list.items():
+            pid = entry.get("pid")
+            start_ticks = entry.get("start_ticks")
+            current_ticks = process_start_ticks(pid) if isinstance(pid, int) else None
+            if not isinstance(pid, int) or not process_alive(pid) or (
+                start_ticks is not None and current_ticks is not None and current_ticks != start_ticks
+            ):
+                # Exited, or the PID was reused by another process
+                print(f"--> Removed stale process entry '{name}' (PID {pid}).")
+                continue
+
+            conf = self.get_endpoint_config(name)
+            if start_ticks is None or current_ticks is None:
+                # Start time unknown, the PID alone may be reused: the endpoint must answer on its port
+                host = (conf or {}).get("ip") or "localhost"
+                if not self.endpoint_healthy(name, f"http://{host}:{entry.get('port')}/v1"):
+                    print(f"--> Removed process entry '{name}' (PID {pid}): start time unknown and no endpoint on port {entry.get('port')}.")
+                    continue
+                start_ticks = current_ticks
+
+            if not self.reattach_endpoints:
+                reason = "reattaching is disabled"
+            elif conf is None or self.config_hash(conf) != entry.get("config_hash"):
+                reason = "configuration changed"
+            elif str(conf.get("port", "")) != str(entry.get("port", "")):
+                reason = "port changed"
+            elif name in self.processes:
+                reason = "endpoint already running"
+            elif not self.endpoint_healthy(name):
+                reason = "health check failed"
+            else:
+                reason = None
+
+            if reason is not None:
+                try:
+                    # Endpoint processes are started as leaders of their own process group
+                    os.killpg(pid, signal.SIGTERM)
+                    print(f"--> Stopped endpoint process '{name}' (PID {pid}) of an earlier run: {reason}.")
+                except OSError as e:
+                    print(f"--> Failed to stop endpoint process '{name}' (PID {pid}): {e}")
+                continue
+
+            self.processes[name] = AdoptedProcess(pid, start_ticks)
+            age = max(0.0, time.time() - float(entry.get("start_time") or time.time()))
+            self.process_start_times[name] = time.monotonic() - age
+            self.process_registry[name] = {
+                "config_hash": entry.get("config_hash"),
+                "start_time": entry.get("start_time"),
+                "start_ticks": start_ticks,
+            }
+            reattached.append(name)
+            print(f"--> Reattached to running endpoint '{name}' (PID {pid}, port {entry.get('port')}).")
+
+        self.update_process_list_file()
+        return reattached
+
+    def process_started(self)->bool:
+        self.sync_process_registry()
+        for name, process in self.processes.items():
+            if process.poll() is None:
+                # Process is running
+                return True
+        return False
 
         
             
\ No newline at end of file
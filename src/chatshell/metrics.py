@@ -0,0 +1,107 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+
+class ProxyMetrics:
+    """
+    Simple in-process metrics registry for the Chatshell proxy.
+    Counters are plain sums, observations keep a bounded window of recent values
+    for percentile calculation.
+    """
+
+    def __init__(self, window_size=2048):
+        self.window_size    = window_size
+        self.lock           = threading.Lock()
+        self.counters       = {}
+        self.observations   = {}
+        self.start_time     = time.time()
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            if name not in self.observations:
+                self.observations[name] = {"count": 0, "sum": 0.0, "max": None, "window": deque(maxlen=self.window_size)}
+            entry = self.observations[name]
+            entry["count"] += 1
+            entry["sum"] += value
+            entry["max"] = value if entry["max"] is None else max(entry["max"], value)
+            entry["window"].append(value)
+
+    def get_counter(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    @staticmethod
+    def _percentile(ordered, p):
+        # Nearest-rank percentile
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100.0 * len(ordered)) - 1))
+        return ordered[index]
+
+    def summary(self, name):
+        with self.lock:
+            entry = self.observations.get(name)
+            if entry is None or entry["count"] == 0:
+                return None
+            ordered = sorted(entry["window"])
+            return {
+                "count": entry["count"],
+                "mean": entry["sum"] / entry["count"],
+                "max": entry["max"],
+                "p50": self._percentile(ordered, 50),
+                "p95": self._percentile(ordered, 95),
+                "p99": self._percentile(ordered, 99),
+            }
+
+    def snapshot(self):
+        with self.lock:
+            names = list(self.observations.keys())
+            counters = dict(self.counters)
+
+        return {
+            "uptime_s": time.time() - self.start_time,
+            "process_cpu_s": time.process_time(),
+            "counters": counters,
+            "observations": {name: self.summary(name) for name in names},
+        }
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.observations = {}
+            self.start_time = time.time()
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the asyncio event loop wakes up a periodic task.
+    A high lag means that blocking work on the loop delays all other requests.
+    """
+
+    def __init__(self, metrics, interval=0.05, name="event_loop_lag_ms"):
+        self.metrics    = metrics
+        self.interval   = interval
+        self.name       = name
+        self.task       = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (loop.time() - expected) * 1000.0)
+            self.metrics.observe(self.name, lag_ms)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+
+HF_BASE_URL = "https://huggingface.co"
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class DownloadError(Exception):
+    pass
+
+
+def hf_file_url(repo, filename, revision="main"):
+    return f"{HF_BASE_URL}/{repo}/resolve/{revision}/{filename}"
+
+
+def file_sha256(path, block_size=8 * 2**20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadProgress:
+    """
+    Prints the progress of a download at most every interval_s seconds.
+    """
+
+    def __init__(self, label, interval_s=2.0):
+        self.label      = label
+        self.interval_s = interval_s
+        self.start      = time.monotonic()
+        self.last       = 0.0
+
+    def __call__(self, done, total, resumed=0):
+        now = time.monotonic()
+        if now - self.last < self.interval_s and done < total:
+            return
+        self.last = now
+        rate = (done - resumed) / max(now - self.start, 1e-6)
+        share = f"{done / total * 100:.0f}% " if total else ""
+        print(f"--> Downloading {self.label}: {share}({done / 2**30:.2f}/{total / 2**30:.2f} GiB, {rate / 2**20:.1f} MiB/s)")
+
+
+class ModelDownloader:
+    """
+    Downloads large files (GGUF models) with parallel HTTP range requests.
+
+    The file is split into parts that are fetched by parallel connections into a
+    preallocated <file>.part. The progress of every part is kept in
+    <file>.part.json, so an interrupted download continues where it stopped if
+    size and ETag of the remote file are unchanged. The SHA-256 is verified
+    before the file is moved to its final name. Servers without range support
+    are downloaded with a single connection.
+    """
+
+    def __init__(self, parts=8, min_part_size=16 * 2**20, chunk_size=2**20, timeout_s=60.0, retries=3, headers=None):
+        self.parts          = max(1, parts)
+        self.min_part_size  = min_part_size
+        self.chunk_size     = chunk_size
+        self.timeout_s      = timeout_s
+        self.retries        = retries
+        self.headers        = dict(headers or {})
+
+    def probe(self, url):
+        """
+        Size, range support, ETag and SHA-256 (Hugging Face X-Linked-Etag) of the remote file.
+        """
+        response = requests.get(url, headers=dict(self.headers, Range="bytes=0-0"), stream=True,
+                                timeout=self.timeout_s, allow_redirects=True)
+        try:
+            response.raise_for_status()
+            size, ranges = None, False
+            if response.status_code == 206:
+                content_range = response.headers.get("Content-Range", "")
+                if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                    size, ranges = int(content_range.rsplit("/", 1)[1]), True
+            elif response.headers.get("Content-Length", "").isdigit():
+                size = int(response.headers["Content-Length"])
+
+            etag = response.headers.get("ETag", "")
+            if etag.startswith("W/"):
+                etag = etag[2:]
+            etag = etag.strip('"')
+            sha256 = None
+            for history_response in [*response.history, response]:
+                linked = history_response.headers.get("X-Linked-Etag", "").strip('"').lower()
+                if SHA256_PATTERN.match(linked):
+                    sha256 = linked
+            return size, ranges, etag, sha256
+        finally:
+            response.close()
+
+    def _plan(self, size):
+        count = max(1, min(self.parts, size // self.min_part_size))
+        part_size = -(-size // count)
+        return [{"start": start, "end": min(start + part_size, size), "done": 0} for start in range(0, size, part_size)]
+
+    def download(self, url, dest_path, sha256=None, progress=None):
+        """
+        Download url to dest_path. Returns the path. Raises DownloadError.
+        progress: callable (done bytes, total bytes, resumed bytes), default prints to the console
+        """
+        dest_path = Path(dest_path)
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = dest_path.with_name(dest_path.name + ".part")
+        state_path = dest_path.with_name(dest_path.name + ".part.json")
+        progress = progress or DownloadProgress(dest_path.name)
+
+        try:
+            size, ranges, etag, remote_sha256 = self.probe(url)
+        except requests.RequestException as e:
+            raise DownloadError(f"Download of {url} failed: {e}")
+        expected_sha256 = (sha256 or remote_sha256 or "").lower() or None
+
+        if size is None or not ranges or size == 0:
+            self._download_single(url, part_path, size, progress)
+        else:
+            self._download_parts(url, part_path, state_path, size, etag, progress)
+
+        if expected_sha256 is not None:
+            actual_sha256 = file_sha256(part_path)
+            if actual_sha256 != expected_sha256:
+                part_path.unlink()
+                state_path.unlink(missing_ok=True)
+                raise DownloadError(f"Checksum mismatch for {dest_path.name}: expected {expected_sha256}, got {actual_sha256}")
+
+        os.replace(part_path, dest_path)
+        state_path.unlink(missing_ok=True)
+        return dest_path
+
+    def _download_single(self, url, part_path, size, progress):
+        done = 0
+        try:
+            with requests.get(url, headers=self.headers, stream=True, timeout=self.timeout_s) as response:
+                response.raise_for_status()
+                with open(part_path, "wb") as f:
+                    for block in response.iter_content(self.chunk_size):
+                        f.write(block)
+                        done += len(block)
+                        progress(done, size or done)
+        except requests.RequestException as e:
+            raise DownloadError(f"Download of {url} failed: {e}")
+
+    def _load_state(self, state_path, part_path, url, size, etag):
+        # Continue an interrupted download of the same remote file
+        if not state_path.exists() or not part_path.exists():
+            return None
+        try:
+            with open(state_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("size") != size or state.get("etag") != etag or part_path.stat().st_size != size:
+            return None
+        if state.get("url") != url:
+            # Signed CDN URLs change, the ETag identifies the file
+            state["url"] = url
+        return state
+
+    def _download_parts(self, url, part_path, state_path, size, etag, progress):
+        state = self._load_state(state_path, part_path, url, size, etag)
+        if state is None:
+            state = {"url": url, "size": size, "etag": etag, "parts": self._plan(size)}
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+
+        lock = threading.Lock()
+        failed = threading.Event()
+        resumed = sum(part["done"] for part in state["parts"])
+        done = [resumed]
+
+        def save_state():
+            tmp_path = state_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, state_path)
+
+        def fetch(part):
+            attempt = 0
+            last_saved = part["done"]
+            while part["start"] + part["done"] < part["end"] and not failed.is_set():
+                headers = dict(self.headers, Range=f"bytes={part['start'] + part['done']}-{part['end'] - 1}")
+                done_before = part["done"]
+                try:
+                    with requests.get(url, headers=headers, stream=True, timeout=self.timeout_s) as response:
+                        if response.status_code != 206:
+                            raise DownloadError(f"Server ignored the range request (status {response.status_code})")
+                        # Unbuffered, so the saved progress never covers bytes that were not written
+                        with open(part_path, "r+b", buffering=0) as f:
+                            f.seek(part["start"] + part["done"])
+                            for block in response.iter_content(self.chunk_size):
+                                if failed.is_set():
+                                    return
+                                block = block[:part["end"] - part["start"] - part["done"]]
+                                f.write(block)
+                                with lock:
+                                    part["done"] += len(block)
+                                    done[0] += len(block)
+                                    progress(done[0], size, resumed)
+                                    if part["done"] - last_saved >= 32 * self.chunk_size:
+                                        save_state()
+                                        last_saved = part["done"]
+                                if part["start"] + part["done"] >= part["end"]:
+                                    break
+                    if part["done"] > done_before:
+                        attempt = 0
+                        continue
+                    # E.g. empty 206 responses, retrying them forever would never finish
+                    error = "the server sent no data"
+                except (requests.RequestException, OSError) as e:
+                    error = e
+                except DownloadError:
+                    failed.set()
+                    raise
+
+                attempt += 1
+                if attempt > self.retries:
+                    failed.set()
+                    raise DownloadError(f"Download of bytes {part['start']}-{part['end'] - 1} failed: {error}")
+                time.sleep(min(2 ** attempt, 10))
+
+        open_parts = [part for part in state["parts"] if part["start"] + part["done"] < part["end"]]
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(open_parts))) as executor:
+                for future in [executor.submit(fetch, part) for part in open_parts]:
+                    future.result()
+        finally:
+            with lock:
+                # Keep the progress for a later resume
+                save_state()
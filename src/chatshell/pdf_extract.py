@@ -0,0 +1,145 @@
+import json
+import os
+from pathlib import Path
+
+from .model_download import file_sha256
+from .tracing import trace_span
+
+
+PDF_BACKEND_PYPDF2      = "pypdf2"
+PDF_BACKEND_PYPDFIUM2   = "pypdfium2"
+PDF_BACKEND_PDFMINER    = "pdfminer"
+
+
+def _pages_pypdf2(path):
+    from PyPDF2 import PdfReader
+    for page in PdfReader(path).pages:
+        yield page.extract_text() or ""
+
+
+def _pages_pypdfium2(path):
+    # PDFium (Chrome's PDF engine), much faster than the pure Python parsers
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(path)
+    try:
+        for page_index in range(len(pdf)):
+            page = pdf[page_index]
+            textpage = page.get_textpage()
+            yield textpage.get_text_range()
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+
+
+def _pages_pdfminer(path):
+    # Layout analysis, slow but good at reading order in multi-column documents
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+    for page_layout in extract_pages(path):
+        yield "".join(element.get_text() for element in page_layout if isinstance(element, LTTextContainer))
+
+
+PDF_BACKENDS = {
+    PDF_BACKEND_PYPDF2: ("PyPDF2", _pages_pypdf2),
+    PDF_BACKEND_PYPDFIUM2: ("pypdfium2", _pages_pypdfium2),
+    PDF_BACKEND_PDFMINER: ("pdfminer", _pages_pdfminer),
+}
+
+
+def backend_available(backend) -> bool:
+    if backend not in PDF_BACKENDS:
+        return False
+    try:
+        __import__(PDF_BACKENDS[backend][0])
+        return True
+    except ImportError:
+        return False
+
+
+class PdfExtractor:
+    """
+    Page texts of PDF files from a selectable backend (PyPDF2, pypdfium2 or
+    pdfminer). With a cache_dir, the page texts of every document are cached
+    under the SHA-256 of the file and the backend, so a document that is
+    summarized and then loaded for chat (or loaded again after a change of
+    its path) is parsed only once.
+    """
+
+    def __init__(self, backend=PDF_BACKEND_PYPDF2, cache_dir=None, cache_max_mb=256):
+        backend = str(backend).lower()
+        if not backend_available(backend):
+            print(f"--> PDF backend '{backend}' is unknown or not installed, using {PDF_BACKEND_PYPDF2}.")
+            backend = PDF_BACKEND_PYPDF2
+        self.backend        = backend
+        self.cache_dir      = Path(cache_dir) if cache_dir is not None else None
+        self.cache_max_bytes = cache_max_mb * 2**20
+        # (path, mtime_ns, size) -> SHA-256, files are hashed once while unchanged
+        self.hashes         = {}
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def document_hash(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        sha256 = self.hashes.get(key)
+        if sha256 is None:
+            sha256 = file_sha256(path)
+            self.hashes[key] = sha256
+        return sha256
+
+    def extract(self, path):
+        """
+        Page texts of the document without the cache.
+        """
+        pages = []
+        page_iter = PDF_BACKENDS[self.backend][1](str(path))
+        while True:
+            with trace_span("pdf_extraction"):
+                text = next(page_iter, None)
+            if text is None:
+                break
+            pages.append(text)
+        return pages
+
+    def page_texts(self, path):
+        """
+        List with the text of every page (empty string for pages without text).
+        """
+        if self.cache_dir is None:
+            return self.extract(path)
+
+        cache_path = self.cache_dir / f"{self.document_hash(path)}.{self.backend}.json"
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                pages = json.load(f)
+            # Recently used documents are kept longest
+            os.utime(cache_path)
+            return pages
+        except (OSError, ValueError):
+            pass
+
+        pages = self.extract(path)
+        tmp_path = cache_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(pages, f)
+        os.replace(tmp_path, cache_path)
+        self.prune_cache()
+        return pages
+
+    def prune_cache(self):
+        # Remove least recently used documents above the size limit
+        entries = []
+        for cache_path in self.cache_dir.glob("*.json"):
+            try:
+                stat = cache_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, cache_path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, cache_path in sorted(entries):
+            if total <= self.cache_max_bytes:
+                break
+            cache_path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,117 @@
+import hashlib
+from collections import OrderedDict
+
+
+PROMPT_LAYOUT_APPEND = "append"
+PROMPT_LAYOUT_CACHE = "cache-friendly"
+
+# Parameters understood by llama-server but not by the OpenAI SDK (sent as extra body)
+LLAMA_SERVER_EXTRA_PARAMS = ("cache_prompt", "id_slot")
+
+# Separator of the sources list that is appended to RAG answers
+SOURCES_SEPARATOR = "\n\n---\nSources:\n"
+
+
+def split_llama_server_params(payload: dict) -> dict:
+    """
+    Returns keyword arguments for the OpenAI SDK, with llama-server specific
+    parameters moved into extra_body.
+    """
+    kwargs = dict(payload)
+    extra_body = {key: kwargs.pop(key) for key in LLAMA_SERVER_EXTRA_PARAMS if key in kwargs}
+    if extra_body:
+        kwargs["extra_body"] = extra_body
+    return kwargs
+
+
+class PromptAssembler:
+    """
+    Inserts RAG and clipboard context into the messages that are forwarded upstream.
+
+    Layout "append" (default) appends all context to the last user message.
+
+    Layout "cache-friendly" keeps the prompt prefix byte-stable between turns, so the
+    llama-server prompt cache (KV cache) can be reused instead of re-processing
+    the whole history:
+    - Stable context (pinned clipboard context, document preamble) goes into the
+      first system message, which only changes when the context changes.
+    - Per-turn retrieval is appended to the last user message, after the history.
+    - Retrieval injected in earlier turns is remembered and re-applied to the same
+      history messages, and the sources list appended to answers is removed again,
+      so the history is sent exactly as the model has seen it before.
+    """
+
+    def __init__(self, layout=PROMPT_LAYOUT_APPEND, max_entries=4096):
+        self.layout         = layout
+        self.max_entries    = max_entries
+        self.injections     = OrderedDict()
+
+    @staticmethod
+    def _message_keys(messages):
+        # Rolling hash over the conversation -> identical key for the same message in later turns
+        keys = []
+        digest = b""
+        for message in messages:
+            content = message.get("content", "")
+            digest = hashlib.sha1(
+                digest + str(message.get("role", "")).encode("utf-8") + b"\x00" + str(content).encode("utf-8")
+            ).digest()
+            keys.append(digest)
+        return keys
+
+    def _remember(self, key, injection):
+        self.injections[key] = injection
+        self.injections.move_to_end(key)
+        while len(self.injections) > self.max_entries:
+            self.injections.popitem(last=False)
+
+    def _insert_system_context(self, messages, system_context):
+        if len(messages) > 0 and messages[0].get("role") == "system" and isinstance(messages[0].get("content"), str):
+            messages[0]["content"] += "\n\n" + system_context
+        else:
+            messages.insert(0, {"role": "system", "content": system_context})
+
+    def assemble(self, messages, retrieval=None, document_preamble=None, context=None):
+        """
+        Inserts the context blocks into messages (in place) and returns the list.
+
+        retrieval:          per-turn RAG block (retrieved chunks for the last message)
+        document_preamble:  stable instructions that belong to the RAG document
+        context:            stable additional context (e.g. clipboard)
+        """
+        if len(messages) == 0:
+            return messages
+
+        if self.layout != PROMPT_LAYOUT_CACHE:
+            if retrieval is not None:
+                block = retrieval if document_preamble is None else document_preamble + retrieval
+                messages[-1]["content"] += "\n" + block # insert at end of last user message
+            if context is not None:
+                messages[-1]["content"] += "\n" + context # insert at end of last user message
+            return messages
+
+        keys = self._message_keys(messages)
+
+        for i, message in enumerate(messages[:-1]):
+            content = message.get("content")
+            if not isinstance(content, str):
+                continue
+
+            if message.get("role") == "assistant" and SOURCES_SEPARATOR in content:
+                # Sources were added by the proxy, the model never generated them
+                message["content"] = content[:content.rindex(SOURCES_SEPARATOR)]
+
+            elif message.get("role") == "user" and keys[i] in self.injections:
+                message["content"] = content + self.injections[keys[i]]
+                self.injections.move_to_end(keys[i])
+
+        if retrieval is not None and isinstance(messages[-1].get("content"), str):
+            injection = "\n" + retrieval
+            messages[-1]["content"] += injection
+            self._remember(keys[-1], injection)
+
+        stable_blocks = [block for block in (document_preamble, context) if block]
+        if stable_blocks:
+            self._insert_system_context(messages, "\n".join(stable_blocks))
+
+        return messages
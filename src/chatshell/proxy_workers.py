@@ -0,0 +1,31 @@
+import os
+import socket
+
+
+def listen_socket(host, port, backlog=2048):
+    """
+    Listening TCP socket created before the workers start. Every worker
+    inherits it and accepts connections from it, the kernel distributes
+    the connections between the workers.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def unix_listen_socket(path, backlog=128):
+    """
+    Listening unix socket of the primary worker, the other workers forward
+    slash commands through it.
+    """
+    path = str(path)
+    if os.path.exists(path):
+        # Left over from an earlier run
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(backlog)
+    return sock
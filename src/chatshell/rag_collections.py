@@ -0,0 +1,210 @@
+import json
+import os
+import re
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+
+COLLECTION_FILE = "collection.json"
+
+# Collection names are used as directory names
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+class CollectionSearch:
+    """
+    RAG search over one or more collections. The results of all collections
+    are merged by similarity; the scores are comparable because every
+    collection is embedded with the same model.
+    """
+
+    def __init__(self, collections):
+        # List of (name, generation, vectorsearch)
+        self.collections    = collections
+        # Saved generations identify the corpus in every worker and after restarts
+        self.corpus_version = ",".join(f"{name}:{generation}" for name, generation, _ in collections)
+
+    @property
+    def names(self):
+        return [name for name, _, _ in self.collections]
+
+    def generations(self) -> dict:
+        return {name: generation for name, generation, _ in self.collections}
+
+    def search_knn(self, prompt, num_chunks=4, query_embedding=None) -> list:
+        if query_embedding is None:
+            query_embedding = self.collections[0][2].embed_query(prompt)
+
+        results = []
+        for name, _, vectorsearch in self.collections:
+            for result in vectorsearch.search_knn(prompt, num_chunks=num_chunks, query_embedding=query_embedding):
+                result["collection"] = name
+                results.append(result)
+
+        results.sort(key=lambda result: result["similarity"], reverse=True)
+        return results[:num_chunks]
+
+
+class RagCollections:
+    """
+    Named RAG collections, each with its own index and chunk store.
+
+    Every change of a collection is saved to collections_dir/<name>/gen-<N>
+    right away, so collections survive restarts and can be dropped from
+    memory at any time. Recently used collections stay resident; when the
+    resident ones exceed the memory budget, the least recently used are
+    dropped and memory-mapped from disk again when they are used.
+    """
+
+    def __init__(self, collections_dir, embedding_model, memory_budget_bytes, pdf_extractor=None, chunker=None, dedup=True):
+        self.collections_dir        = Path(collections_dir)
+        self.embedding_model        = embedding_model
+        self.pdf_extractor          = pdf_extractor
+        self.chunker                = chunker
+        self.dedup                  = dedup
+        self.memory_budget_bytes    = memory_budget_bytes
+        # Name -> (generation, vectorsearch), least recently used first
+        self.resident               = OrderedDict()
+
+        self.collections_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def valid_name(name) -> bool:
+        return COLLECTION_NAME_PATTERN.match(name) is not None
+
+    def _read_meta(self, name):
+        try:
+            with open(self.collections_dir / name / COLLECTION_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _new_vectorsearch(self):
+        from .vectorstore import ChatshellVectorsearch
+        return ChatshellVectorsearch(embedding_model=self.embedding_model, pdf_extractor=self.pdf_extractor, chunker=self.chunker, dedup=self.dedup)
+
+    def exists(self, name) -> bool:
+        return name in self.resident or self._read_meta(name) is not None
+
+    def names(self):
+        saved = {path.parent.name for path in self.collections_dir.glob(f"*/{COLLECTION_FILE}")}
+        return sorted(saved | set(self.resident))
+
+    def create(self, name):
+        """
+        New empty collection, saved with its first documents.
+        """
+        vectorsearch = self._new_vectorsearch()
+        self.resident[name] = (0, vectorsearch)
+        return vectorsearch
+
+    def get(self, name, generation=None):
+        """
+        Vectorsearch of a collection, loaded from disk if it is not resident
+        (or not in the given generation).
+        """
+        entry = self.resident.get(name)
+        if entry is not None and (generation is None or entry[0] == generation):
+            self.resident.move_to_end(name)
+            return entry[1]
+
+        meta = self._read_meta(name)
+        if meta is None:
+            raise KeyError(f"Collection {name} does not exist")
+        vectorsearch = self._new_vectorsearch()
+        vectorsearch.load_index(self.collections_dir / name / f"gen-{meta['generation']}", mmap=True)
+        self.resident[name] = (meta["generation"], vectorsearch)
+        self.resident.move_to_end(name)
+        return vectorsearch
+
+    def save(self, name):
+        """
+        Write the resident collection as a new generation.
+        """
+        generation, vectorsearch = self.resident[name]
+        meta = self._read_meta(name) or {}
+        generation = max(generation, int(meta.get("generation", 0))) + 1
+
+        collection_dir = self.collections_dir / name
+        gen_dir = collection_dir / f"gen-{generation}"
+        shutil.rmtree(gen_dir, ignore_errors=True)
+        vectorsearch.save_index(gen_dir)
+
+        meta = {
+            "generation": generation,
+            "chunks": vectorsearch.live_count(),
+            "sources": len(vectorsearch.chunk_store.sources),
+        }
+        tmp_path = collection_dir / (COLLECTION_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, collection_dir / COLLECTION_FILE)
+
+        # Keep the previous generation for workers that are loading it right now
+        for old_dir in collection_dir.glob("gen-*"):
+            if old_dir.name not in (f"gen-{generation}", f"gen-{generation - 1}"):
+                shutil.rmtree(old_dir, ignore_errors=True)
+
+        self.resident[name] = (generation, vectorsearch)
+        self.resident.move_to_end(name)
+
+    def discard(self, name):
+        """
+        Drop the resident state of a collection, it is loaded from disk on next use.
+        """
+        self.resident.pop(name, None)
+
+    def search(self, names, generations=None):
+        """
+        CollectionSearch over the named collections.
+        """
+        collections = []
+        for name in names:
+            vectorsearch = self.get(name, (generations or {}).get(name))
+            collections.append((name, self.resident[name][0], vectorsearch))
+        return CollectionSearch(collections)
+
+    def evict(self, keep=()):
+        """
+        Drop least recently used collections (except keep) from memory until
+        the resident ones fit into the memory budget.
+        """
+        total = sum(vectorsearch.memory_bytes() for _, vectorsearch in self.resident.values())
+        for name in list(self.resident):
+            if total <= self.memory_budget_bytes:
+                break
+            generation, vectorsearch = self.resident[name]
+            if name in keep or generation == 0:
+                # Active or not saved yet
+                continue
+            total -= vectorsearch.memory_bytes()
+            del self.resident[name]
+            print(f"--> Collection {name} evicted from memory.")
+
+    def status(self):
+        """
+        Name, chunks, sources, residency and memory of every collection.
+        """
+        rows = []
+        for name in self.names():
+            entry = self.resident.get(name)
+            if entry is not None:
+                _, vectorsearch = entry
+                rows.append({
+                    "name": name,
+                    "chunks": vectorsearch.live_count(),
+                    "sources": len(vectorsearch.chunk_store.sources),
+                    "resident": True,
+                    "memory_mb": vectorsearch.memory_bytes() / 2**20,
+                })
+            else:
+                meta = self._read_meta(name) or {}
+                rows.append({
+                    "name": name,
+                    "chunks": meta.get("chunks", 0),
+                    "sources": meta.get("sources", 0),
+                    "resident": False,
+                    "memory_mb": 0.0,
+                })
+        return rows
@@ -0,0 +1,386 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk, Choice, ChoiceDelta
+
+
+def is_cacheable(payload: dict, max_temperature: float) -> bool:
+    """
+    Only (nearly) deterministic requests may be answered from a cache. Requests
+    without temperature use the server default (0.8 for llama-server) and are not cached.
+    """
+    temperature = payload.get("temperature")
+    if temperature is None:
+        return False
+    try:
+        if float(temperature) > max_temperature:
+            return False
+    except (TypeError, ValueError):
+        return False
+
+    if payload.get("n", 1) not in (None, 1):
+        return False
+    # Tool calls are not part of the cached text
+    if payload.get("tools") or payload.get("functions"):
+        return False
+    return True
+
+
+def replay_chunks(text: str, model="generic", chunk_chars=48, finish_reason="stop"):
+    """
+    Cached answer as a sequence of streaming chunks (OpenAI format).
+    """
+    response_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    parts = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+
+    for i, part in enumerate(parts):
+        yield ChatCompletionChunk(
+            id=response_id,
+            object="chat.completion.chunk",
+            created=created,
+            model=model,
+            choices=[
+                Choice(
+                    index=0,
+                    delta=ChoiceDelta(content=part),
+                    finish_reason=finish_reason if i == len(parts) - 1 else None
+                )
+            ]
+        )
+
+
+def build_completion(text: str, model="generic", finish_reason="stop") -> dict:
+    """
+    Cached answer as a non-streaming chat completion (OpenAI format).
+    """
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": finish_reason
+            }
+        ],
+    }
+
+
+class StreamTranscript:
+    """
+    Collects the content of a forwarded SSE byte stream (passthrough mode), so a
+    complete answer can be cached. Only used for cacheable requests.
+
+    The answer ends with the first finish_reason of the upstream, content after it
+    (e.g. the injected sources) is only part of full_text.
+    """
+
+    def __init__(self):
+        self.buffer         = b""
+        self.parts          = []
+        self.answer_parts   = 0
+        self.finish_reason  = None
+        self.done           = False
+
+    def feed(self, data: bytes):
+        self.buffer += data
+        while b"\n" in self.buffer:
+            line, self.buffer = self.buffer.split(b"\n", 1)
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data_str = line[5:].strip()
+            if data_str == b"[DONE]":
+                self.done = True
+                continue
+            try:
+                choice = json.loads(data_str)["choices"][0]
+            except (ValueError, KeyError, IndexError, TypeError):
+                continue
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                self.parts.append(content)
+            if choice.get("finish_reason") and self.finish_reason is None:
+                self.finish_reason = choice["finish_reason"]
+                self.answer_parts = len(self.parts)
+
+    @property
+    def text(self):
+        if self.finish_reason is None:
+            return "".join(self.parts)
+        return "".join(self.parts[:self.answer_parts])
+
+    @property
+    def full_text(self):
+        return "".join(self.parts)
+
+
+class CachedResponse:
+    def __init__(self, text, sources, model, expires):
+        self.text       = text
+        self.sources    = sources
+        self.model      = model
+        self.expires    = expires
+        self.hits       = 0
+
+
+class SemanticResponseCache:
+    """
+    Cache of answers to questions that were asked before in the same setting.
+
+    The setting (scope) is matched exactly: model, ids of the retrieved chunks,
+    history and additional context. Within a scope, the question is matched by
+    cosine similarity of its embedding, so rephrased questions also hit.
+    Entries expire after ttl_s, the least recently used entries are evicted
+    above max_entries.
+    """
+
+    def __init__(self, similarity_threshold=0.95, ttl_s=3600.0, max_entries=512, metrics=None):
+        self.similarity_threshold   = similarity_threshold
+        self.ttl_s                  = ttl_s
+        self.max_entries            = max_entries
+        self.metrics                = metrics
+        self.lock                   = threading.Lock()
+
+        self.entries                = OrderedDict() # entry id -> (scope, embedding, CachedResponse)
+        self.scopes                 = {}            # scope -> set of entry ids
+        self.next_id                = 0
+
+    def _count(self, name, value=1):
+        if self.metrics is not None:
+            self.metrics.increment(name, value)
+
+    @staticmethod
+    def scope_key(model, chunk_ids, history, context=None) -> str:
+        digest = hashlib.sha1()
+        digest.update(str(model).encode("utf-8") + b"\x00")
+        digest.update(",".join(sorted(chunk_ids or [])).encode("utf-8") + b"\x00")
+        for message in history:
+            digest.update(str(message.get("role", "")).encode("utf-8") + b"\x00" + str(message.get("content", "")).encode("utf-8") + b"\x00")
+        digest.update(str(context or "").encode("utf-8"))
+        return digest.hexdigest()
+
+    def _remove(self, entry_id):
+        scope, _, _ = self.entries.pop(entry_id)
+        ids = self.scopes.get(scope)
+        if ids is not None:
+            ids.discard(entry_id)
+            if len(ids) == 0:
+                del self.scopes[scope]
+
+    def lookup(self, scope, embedding):
+        """
+        Returns the CachedResponse of the most similar question in the scope or None.
+        """
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        now = time.time()
+
+        with self.lock:
+            best_id, best_similarity = None, -1.0
+            for entry_id in list(self.scopes.get(scope, ())):
+                _, entry_embedding, response = self.entries[entry_id]
+                if response.expires < now:
+                    self._remove(entry_id)
+                    self._count("response_cache_expired")
+                    continue
+                similarity = float(np.dot(entry_embedding, embedding))
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None or best_similarity < self.similarity_threshold:
+                self._count("response_cache_misses")
+                return None
+
+            self.entries.move_to_end(best_id)
+            response = self.entries[best_id][2]
+            response.hits += 1
+
+        self._count("response_cache_hits")
+        if self.metrics is not None:
+            self.metrics.observe("response_cache_similarity", best_similarity)
+        return response
+
+    def store(self, scope, embedding, text, sources=None, model="generic"):
+        if not text:
+            return
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+        with self.lock:
+            # Replace an entry of the same question
+            for entry_id in list(self.scopes.get(scope, ())):
+                if float(np.dot(self.entries[entry_id][1], embedding)) >= 0.999:
+                    self._remove(entry_id)
+
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = (scope, embedding, CachedResponse(text, sources, model, time.time() + self.ttl_s))
+            self.scopes.setdefault(scope, set()).add(entry_id)
+
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self._count("response_cache_evictions")
+
+        self._count("response_cache_stores")
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.scopes = {}
+
+
+# Request fields that do not change the generated answer
+NON_SEMANTIC_KEYS = ("stream", "stream_options", "user")
+
+
+class ExactResponseCache:
+    """
+    Cache of complete responses to byte-identical deterministic requests
+    (temperature 0), e.g. of batch jobs.
+
+    The key is a hash of the normalized payload and the proxy state (fingerprint,
+    e.g. loaded documents). Streamed responses are stored as the SSE body that
+    was sent and replayed unchanged. All entries are kept in memory for fast
+    hits and persisted as one JSON file per entry in cache_dir, the least
+    recently used entries are evicted above max_entries. With an executor,
+    the files are written in its threads instead of the caller's.
+    """
+
+    def __init__(self, cache_dir, max_entries=1024, ttl_s=86400.0, metrics=None, executor=None):
+        self.cache_dir      = Path(cache_dir)
+        self.max_entries    = max_entries
+        self.ttl_s          = ttl_s
+        self.metrics        = metrics
+        self.executor       = executor
+        self.lock           = threading.Lock()
+        self.entries        = OrderedDict() # key -> entry dict
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _count(self, name, value=1):
+        if self.metrics is not None:
+            self.metrics.increment(name, value)
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def _load(self):
+        # Restore entries in least recently used order (file modification time)
+        files = sorted(self.cache_dir.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        now = time.time()
+        for path in files:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                if entry["expires"] < now:
+                    path.unlink()
+                    continue
+                self.entries[entry["key"]] = entry
+            except (OSError, ValueError, KeyError) as e:
+                print(f"--> Dropping unreadable response cache file {path}: {e}")
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    @staticmethod
+    def request_key(payload: dict, fingerprint="") -> str:
+        normalized = {key: value for key, value in payload.items() if key not in NON_SEMANTIC_KEYS}
+        if "temperature" in normalized:
+            normalized["temperature"] = float(normalized["temperature"])
+        serialized = json.dumps(normalized, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256((serialized + "\x00" + str(fingerprint)).encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        """
+        Returns the entry (dict with "text", "stream_body" and/or "response") or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires"] < time.time():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self._count("exact_cache_misses")
+                return None
+
+            self.entries.move_to_end(key)
+
+        try:
+            # Persist the access for the LRU order after a restart
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+        self._count("exact_cache_hits")
+        return entry
+
+    def store(self, key, text, transcript):
+        """
+        transcript: SSE body (bytes) of a streamed response or the response dict.
+        """
+        entry = {"key": key, "created": time.time(), "expires": time.time() + self.ttl_s, "text": text}
+        if isinstance(transcript, (bytes, bytearray)):
+            entry["stream_body"] = bytes(transcript).decode("utf-8")
+            # Visible text including appended sources, for non-streaming replays
+            collector = StreamTranscript()
+            collector.feed(bytes(transcript))
+            entry["text"] = collector.full_text
+        else:
+            entry["response"] = transcript
+
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self._count("exact_cache_evictions")
+
+        self._count("exact_cache_stores")
+
+        if self.executor is not None:
+            self.executor.submit(self._persist, entry)
+        else:
+            self._persist(entry)
+
+    def _persist(self, entry):
+        path = self._path(entry["key"])
+        # Unique temporary file, the same key can be stored twice concurrently
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            with self.lock:
+                # Entries evicted or cleared meanwhile are not persisted
+                if self.entries.get(entry["key"]) is entry:
+                    os.replace(tmp_path, path)
+                else:
+                    tmp_path.unlink()
+        except OSError as e:
+            print(f"--> Failed to persist response cache entry: {e}")
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                self._remove(key)
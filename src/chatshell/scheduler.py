@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+
+# Lower rank is served first
+PRIORITY_RANKS = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 1}
+
+
+class SchedulerRejected(Exception):
+    """
+    Request was not admitted: queue full (429) or deadline exceeded while queued (503).
+    """
+
+    def __init__(self, status_code, retry_after, message):
+        super().__init__(message)
+        self.status_code    = status_code
+        self.retry_after    = retry_after
+        self.message        = message
+
+
+class _Waiter:
+    def __init__(self, rank, seq, future):
+        self.rank       = rank
+        self.seq        = seq
+        self.future     = future
+        self.cancelled  = False
+
+    def __lt__(self, other):
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+
+class AdmissionTicket:
+    """
+    Admission of one request to an endpoint. release() must be called when the
+    request is complete.
+    """
+
+    def __init__(self, queue, wait_ms):
+        self.queue      = queue
+        self.wait_ms    = wait_ms
+        self.start      = time.monotonic()
+        self.released   = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.queue._release(time.monotonic() - self.start)
+
+
+class EndpointQueue:
+    """
+    Admission control for a single upstream endpoint: at most max_inflight
+    requests are forwarded, up to max_queue requests wait by priority.
+    """
+
+    def __init__(self, base_url, max_inflight, max_queue, metrics=None):
+        self.base_url       = base_url
+        self.max_inflight   = max_inflight
+        self.max_queue      = max_queue
+        self.metrics        = metrics
+
+        self.inflight       = 0
+        self.queued         = 0
+        self.waiters        = []
+        self.seq            = itertools.count()
+        self.avg_service_s  = None
+        self.last_wait_ms   = 0.0
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.increment(name)
+
+    def retry_after(self):
+        # Estimated time until a new request could be served, in seconds
+        service_s = self.avg_service_s if self.avg_service_s is not None else 1.0
+        return max(1, math.ceil(service_s * (self.queued + 1) / max(1, self.max_inflight)))
+
+    def _admit(self, wait_ms):
+        self.last_wait_ms = wait_ms
+        if self.metrics is not None:
+            self.metrics.observe("queue_wait_ms", wait_ms)
+        return AdmissionTicket(self, wait_ms)
+
+    def _reject(self, status_code, message, name):
+        self._count(name)
+        return SchedulerRejected(status_code, self.retry_after(), message)
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE, timeout=None):
+        rank = PRIORITY_RANKS.get(priority, 0)
+
+        if self.inflight < self.max_inflight and self.queued == 0:
+            self.inflight += 1
+            return self._admit(0.0)
+
+        if self.queued >= self.max_queue:
+            # Make room by rejecting the newest waiter of a lower priority class
+            victims = [w for w in self.waiters if not w.cancelled and w.rank > rank]
+            if len(victims) == 0:
+                raise self._reject(429, "Too many queued requests for the inference endpoint.", "scheduler_rejected_queue_full")
+            victim = max(victims)
+            victim.cancelled = True
+            self.queued -= 1
+            victim.future.set_exception(self._reject(429, "Request was displaced by a request of higher priority.", "scheduler_displaced"))
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(rank, next(self.seq), loop.create_future())
+        heapq.heappush(self.waiters, waiter)
+        self.queued += 1
+        enqueued = time.monotonic()
+
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            if not waiter.cancelled:
+                waiter.cancelled = True
+                self.queued -= 1
+            raise self._reject(503, "Request deadline exceeded while waiting for the inference endpoint.", "scheduler_rejected_deadline")
+        except asyncio.CancelledError:
+            # Client is gone while waiting
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self._release(None)
+            elif not waiter.cancelled:
+                waiter.cancelled = True
+                self.queued -= 1
+            raise
+
+        return self._admit((time.monotonic() - enqueued) * 1000.0)
+
+    def _release(self, service_s):
+        if service_s is not None:
+            # Moving average of the time a request occupies the endpoint
+            if self.avg_service_s is None:
+                self.avg_service_s = service_s
+            else:
+                self.avg_service_s = 0.8 * self.avg_service_s + 0.2 * service_s
+        self.inflight -= 1
+
+        while self.waiters and self.inflight < self.max_inflight:
+            waiter = heapq.heappop(self.waiters)
+            if waiter.cancelled or waiter.future.done():
+                continue
+            self.queued -= 1
+            self.inflight += 1
+            waiter.future.set_result(True)
+
+    def set_max_inflight(self, max_inflight):
+        self.max_inflight = max(1, max_inflight)
+        # More capacity -> admit waiting requests
+        while self.waiters and self.inflight < self.max_inflight:
+            waiter = heapq.heappop(self.waiters)
+            if waiter.cancelled or waiter.future.done():
+                continue
+            self.queued -= 1
+            self.inflight += 1
+            waiter.future.set_result(True)
+
+    def status(self):
+        return {
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "last_wait_ms": self.last_wait_ms,
+            "avg_service_s": self.avg_service_s,
+        }
+
+
+class RequestScheduler:
+    """
+    Per-endpoint admission control with priority queueing and backpressure.
+
+    max_inflight "auto" uses the number of slots of the llama-server (/props),
+    so requests wait in the proxy instead of piling up inside the server.
+    With several proxy workers, every worker admits its share of the limit,
+    but at least one request, so with fewer slots than workers the endpoint
+    is oversubscribed.
+    """
+
+    def __init__(self, server_props, max_inflight="auto", max_queue=64, queue_timeout_s=60.0,
+                 fallback_inflight=4, metrics=None, workers=1):
+        self.server_props       = server_props
+        self.max_inflight       = max_inflight
+        self.max_queue          = max_queue
+        self.queue_timeout_s    = queue_timeout_s
+        self.fallback_inflight  = fallback_inflight
+        self.metrics            = metrics
+        self.workers            = max(1, workers)
+        self.queues             = {}
+
+    async def _endpoint_limit(self, base_url):
+        if str(self.max_inflight).lower() != "auto":
+            limit = int(self.max_inflight)
+        else:
+            slots = await self.server_props.total_slots(base_url)
+            limit = slots if slots is not None else self.fallback_inflight
+        # Rounded down, so the workers together stay within the limit
+        return max(1, limit // self.workers)
+
+    async def admit(self, base_url, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """
+        Wait for admission to the endpoint. Raises SchedulerRejected.
+        timeout: max. time in the queue in seconds (request deadline), at most
+                 queue_timeout_s
+        """
+        limit = await self._endpoint_limit(base_url)
+        queue = self.queues.get(base_url)
+        if queue is None:
+            queue = EndpointQueue(base_url, limit, self.max_queue, self.metrics)
+            self.queues[base_url] = queue
+        elif queue.max_inflight != limit:
+            queue.set_max_inflight(limit)
+
+        if timeout is None:
+            timeout = self.queue_timeout_s
+        return await queue.acquire(priority, min(timeout, self.queue_timeout_s))
+
+    def status(self):
+        return {base_url: queue.status() for base_url, queue in self.queues.items()}
@@ -0,0 +1,61 @@
+import time
+from urllib.parse import urlparse
+
+import httpx
+
+
+def server_root_url(base_url: str) -> str:
+    # "http://localhost:4000/v1" -> "http://localhost:4000" (llama-server /props, /slots, /tokenize)
+    parsed = urlparse(str(base_url))
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+class ServerPropsCache:
+    """
+    Cached llama-server /props of the upstream endpoints (slot count, context size).
+    Endpoints without /props (e.g. other OpenAI-compatible servers) are asked
+    again after retry_s.
+    """
+
+    def __init__(self, http_client, retry_s=10.0):
+        self.http_client    = http_client
+        self.retry_s        = retry_s
+        self.props          = {} # base_url -> (props or None, time of check)
+
+    async def get(self, base_url):
+        props, checked = self.props.get(base_url, (None, 0.0))
+        if props is not None or time.monotonic() - checked < self.retry_s:
+            return props
+
+        try:
+            response = await self.http_client.get(f"{server_root_url(base_url)}/props", timeout=2.0)
+            props = response.json() if response.status_code == 200 else None
+        except (httpx.HTTPError, ValueError):
+            props = None
+
+        self.props[base_url] = (props if isinstance(props, dict) else None, time.monotonic())
+        return self.props[base_url][0]
+
+    def invalidate(self, base_url=None):
+        # Endpoint restarted, possibly with other settings
+        if base_url is None:
+            self.props = {}
+        else:
+            self.props.pop(base_url, None)
+
+    async def total_slots(self, base_url):
+        props = await self.get(base_url)
+        if props is None:
+            return None
+        return int(props.get("total_slots", 0)) or None
+
+    async def context_size(self, base_url):
+        """
+        Context size of one slot (n_ctx), None if unknown.
+        """
+        props = await self.get(base_url)
+        if props is None:
+            return None
+        settings = props.get("default_generation_settings", {})
+        n_ctx = settings.get("n_ctx", props.get("n_ctx", 0)) if isinstance(settings, dict) else props.get("n_ctx", 0)
+        return int(n_ctx) or None
@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+
+STATE_FILE = "state.json"
+
+# Up to this corpus size an exact search over the memory-mapped embeddings takes
+# about a millisecond, larger corpora load the saved hnswlib graph
+BRUTE_FORCE_MAX_CHUNKS = 50_000
+
+
+class MatrixIndex:
+    """
+    Exact cosine search over a matrix of normalized embeddings (e.g. memory-mapped),
+    with the knn_query interface of hnswlib.Index. Rows set in the boolean
+    mask deleted are never returned.
+    """
+
+    def __init__(self, embeddings, deleted=None):
+        self.embeddings = embeddings
+        self.deleted    = deleted
+
+    def get_current_count(self):
+        return self.embeddings.shape[0]
+
+    def set_ef(self, ef):
+        pass
+
+    def knn_query(self, data, k=1):
+        query = np.asarray(data, dtype=np.float32).reshape(-1, self.embeddings.shape[1])
+        # Cosine distance like hnswlib, which normalizes the query
+        query = query / np.maximum(np.linalg.norm(query, axis=1, keepdims=True), 1e-12)
+        similarities = query @ self.embeddings.T
+        if self.deleted is not None:
+            similarities[:, self.deleted] = -np.inf
+            k = min(k, int(self.embeddings.shape[0] - self.deleted.sum()))
+        else:
+            k = min(k, self.embeddings.shape[0])
+
+        # Top k without sorting all similarities
+        labels = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(similarities, labels, axis=1), axis=1)
+        labels = np.take_along_axis(labels, order, axis=1)
+        return labels, 1.0 - np.take_along_axis(similarities, labels, axis=1)
+
+
+class SharedRagState:
+    """
+    RAG state of the primary proxy worker (index, RAG and context switches)
+    shared with the other workers through a directory.
+
+    Every new corpus is written by the primary to its own generation directory,
+    then state.json is replaced atomically. Workers notice the new state by
+    its file identity (one stat per request) and map the files of the
+    generation read-only, so the pages are shared between all workers. Old
+    generations are removed; workers still mapping them keep valid mappings.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir          = Path(index_dir)
+        self.state_path         = self.index_dir / STATE_FILE
+        self.published_version  = None
+        self.generation         = 0
+        self.stat_key           = None
+        self.loaded_generation  = None
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def publish(self, vectorsearch, rag_enabled, context_enabled, context_list, collections=None):
+        """
+        Primary worker: write the current state, and the index of vectorsearch
+        (the one RAG searches) if the corpus changed. If RAG searches named
+        collections instead, collections maps their names to the saved generations.
+        """
+        state = self._read_state() or {}
+        # Generation numbers are never reused, workers load a generation only once
+        self.generation = max(self.generation, int(state.get("last_generation") or 0))
+        generation = state.get("generation") if vectorsearch.has_index() else None
+
+        if vectorsearch.corpus_version != self.published_version and vectorsearch.has_index():
+            self.generation += 1
+            gen_dir = self.index_dir / f"gen-{self.generation}"
+            shutil.rmtree(gen_dir, ignore_errors=True)
+            vectorsearch.save_index(gen_dir)
+            generation = self.generation
+
+            # Keep the previous generation for workers that are loading it right now
+            for old_dir in self.index_dir.glob("gen-*"):
+                if old_dir.name not in (f"gen-{generation}", f"gen-{generation - 1}"):
+                    shutil.rmtree(old_dir, ignore_errors=True)
+        self.published_version = vectorsearch.corpus_version
+
+        state = {
+            "generation": generation,
+            "last_generation": self.generation,
+            "corpus_version": vectorsearch.corpus_version,
+            "rag_enabled": rag_enabled,
+            "context_enabled": context_enabled,
+            "context_list": list(context_list),
+            "collections": collections,
+        }
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def poll(self):
+        """
+        Other workers: the shared state if it changed since the last call, else None.
+        """
+        try:
+            stat = os.stat(self.state_path)
+        except OSError:
+            return None
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stat_key == self.stat_key:
+            return None
+        state = self._read_state()
+        if state is not None:
+            self.stat_key = stat_key
+        return state
+
+    def load(self, vectorsearch, state):
+        """
+        Apply a polled state to the vectorsearch of a worker, mapping the index
+        files of a new generation.
+        """
+        generation = state.get("generation")
+        if generation is not None and generation != self.loaded_generation:
+            vectorsearch.load_index(self.index_dir / f"gen-{generation}", mmap=True)
+            self.loaded_generation = generation
+        vectorsearch.corpus_version = state.get("corpus_version", vectorsearch.corpus_version)
+        vectorsearch.context_list = list(state.get("context_list", []))
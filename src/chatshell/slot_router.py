@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import httpx
+
+from .server_props import server_root_url
+
+
+def conversation_key(messages, client_id=None, first_turn=False) -> str:
+    """
+    Stable key of a conversation over its turns: the system prompt(s), the first
+    user message and the first answer, which every later request repeats
+    unchanged. The answer tells apart conversations that open with the same
+    prompt, client_id (conversation id or user sent by the client) already the
+    first turn. first_turn=True returns the key without the answer, which the
+    conversation had in its first turn.
+    """
+    digest = hashlib.sha1(str(client_id or "").encode("utf-8") + b"\x00")
+    opened = False
+    for message in messages:
+        role = str(message.get("role", ""))
+        if opened and (first_turn or role != "assistant"):
+            break
+        digest.update(role.encode("utf-8") + b"\x00" + str(message.get("content", "")).encode("utf-8") + b"\x00")
+        if opened:
+            break
+        opened = role not in ("system", "developer")
+    return digest.hexdigest()
+
+
+class SlotState:
+    def __init__(self):
+        self.owner      = None
+        self.last_used  = 0.0
+        self.inflight   = 0
+        # Held while the KV cache of the slot is saved or restored
+        self.guard      = asyncio.Lock()
+
+
+class SlotLease:
+    """
+    Slot of an endpoint that is used by one request. release() must be called
+    when the request is complete.
+    """
+
+    def __init__(self, router, base_url, id_slot, state):
+        self.router     = router
+        self.base_url   = base_url
+        self.id_slot    = id_slot
+        self.state      = state
+        self.released   = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.state.inflight -= 1
+            self.state.last_used = time.monotonic()
+
+
+class SlotRouter:
+    """
+    Pins conversations to llama-server slots (id_slot), so consecutive turns reuse
+    the KV cache of their slot.
+
+    A new conversation gets a free slot on the endpoint with the most free slots.
+    If all slots are owned, the least recently used idle slot is reclaimed: its
+    KV cache is saved to a file (/slots/{id}?action=save) and restored
+    (action=restore) when the evicted conversation comes back to the endpoint.
+    Saving requires the llama-server option --slot-save-path.
+
+    The slot is picked and reserved under the router lock. Saving and restoring
+    run outside of it under the guard of the slot, so they only delay the
+    requests of that slot.
+    """
+
+    def __init__(self, http_client, server_props, metrics=None, max_saved=256):
+        self.http_client    = http_client
+        self.server_props   = server_props
+        self.metrics        = metrics
+        self.max_saved      = max_saved
+        self.lock           = asyncio.Lock()
+
+        self.slots          = {}            # (base_url, id_slot) -> SlotState
+        self.conversations  = {}            # conversation key -> (base_url, id_slot)
+        self.saved          = OrderedDict() # conversation key -> base_url with the saved slot file
+        self.save_dirs      = {}            # base_url -> local slot save dir (managed endpoints)
+        self.save_disabled  = set()
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.increment(name)
+
+    @staticmethod
+    def _filename(key):
+        return f"chatshell-{key[:24]}.bin"
+
+    def set_save_dirs(self, save_dirs: dict):
+        # Known slot save dirs are used to delete files of forgotten conversations
+        self.save_dirs = dict(save_dirs)
+
+    async def _slot_action(self, base_url, id_slot, action, key):
+        if base_url in self.save_disabled:
+            return False
+        try:
+            response = await self.http_client.post(
+                f"{server_root_url(base_url)}/slots/{id_slot}",
+                params={"action": action},
+                json={"filename": self._filename(key)},
+                timeout=60.0
+            )
+        except httpx.HTTPError as e:
+            print(f"--> Slot {action} on {base_url} failed: {e}")
+            return False
+
+        if response.status_code in (400, 501) and action == "save":
+            # Slot saving not enabled on this server (no --slot-save-path)
+            print(f"--> Slot saving is not available on {base_url}, evicted slots are not saved.")
+            self.save_disabled.add(base_url)
+            return False
+        return response.status_code == 200
+
+    def _forget_saved(self, key):
+        base_url = self.saved.pop(key, None)
+        save_dir = self.save_dirs.get(base_url)
+        if save_dir is not None:
+            try:
+                os.remove(os.path.join(save_dir, self._filename(key)))
+            except OSError:
+                pass
+
+    def _remember_saved(self, key, base_url):
+        self.saved[key] = base_url
+        self.saved.move_to_end(key)
+        while len(self.saved) > self.max_saved:
+            self._forget_saved(next(iter(self.saved)))
+
+    def _lease(self, key, base_url, id_slot):
+        state = self.slots[(base_url, id_slot)]
+        state.owner = key
+        state.inflight += 1
+        state.last_used = time.monotonic()
+        self.conversations[key] = (base_url, id_slot)
+        return SlotLease(self, base_url, id_slot, state)
+
+    def _pick(self, key, endpoints, counts):
+        # Returns (base_url, id_slot, owner to evict or None), None if all slots are busy
+        candidates = []
+        for base_url in endpoints:
+            if counts[base_url] is None:
+                continue
+            for id_slot in range(counts[base_url]):
+                candidates.append((base_url, id_slot, self.slots.setdefault((base_url, id_slot), SlotState())))
+
+        saved_url = self.saved.get(key)
+        free = [c for c in candidates if c[2].owner is None]
+        if free:
+            # Endpoint with the most free slots, prefer the endpoint holding a saved state
+            free_per_endpoint = {}
+            for base_url, _, _ in free:
+                free_per_endpoint[base_url] = free_per_endpoint.get(base_url, 0) + 1
+            base_url, id_slot, _ = max(
+                free, key=lambda c: (c[0] == saved_url, free_per_endpoint[c[0]])
+            )
+            return base_url, id_slot, None
+
+        idle = [c for c in candidates if c[2].inflight == 0]
+        if len(idle) == 0:
+            return None
+
+        # Reclaim the least recently used idle slot, prefer the endpoint holding a saved state
+        base_url, id_slot, state = min(idle, key=lambda c: (c[0] != saved_url, c[2].last_used))
+        return base_url, id_slot, state.owner
+
+    def _rename(self, old_key, key):
+        # The slot (and a saved state) of the first turn moves to the final key
+        assigned = self.conversations.pop(old_key)
+        self.conversations[key] = assigned
+        self.slots[assigned].owner = key
+        if old_key in self.saved:
+            self.saved[key] = self.saved.pop(old_key)
+
+    async def acquire(self, key, endpoints, first_turn_key=None):
+        """
+        Returns a SlotLease for the conversation on one of the endpoints (list of
+        base URLs), or None if no slot can be pinned (unknown slot count, all busy).
+        first_turn_key: key of the conversation in its first turn, if it differs
+        """
+        # Number of parallel slots of every llama-server, None if unknown
+        counts = {}
+        for base_url in endpoints:
+            counts[base_url] = await self.server_props.total_slots(base_url)
+
+        victim = None
+        restore = False
+        async with self.lock:
+            if first_turn_key is not None and key not in self.conversations:
+                assigned = self.conversations.get(first_turn_key)
+                if assigned is not None and self.slots[assigned].owner == first_turn_key:
+                    self._rename(first_turn_key, key)
+
+            lease = None
+            assigned = self.conversations.get(key)
+            if assigned is not None and assigned[0] in endpoints:
+                state = self.slots.get(assigned)
+                if state is not None and state.owner == key:
+                    self._count("slot_affinity_hits")
+                    lease = self._lease(key, *assigned)
+
+            if lease is None:
+                picked = self._pick(key, endpoints, counts)
+                if picked is None:
+                    self._count("slot_unpinned")
+                    return None
+
+                base_url, id_slot, victim = picked
+                if victim is not None:
+                    self._count("slot_reclaims")
+                    self.conversations.pop(victim, None)
+                restore = self.saved.get(key) == base_url
+                self._count("slot_assignments")
+                lease = self._lease(key, base_url, id_slot)
+                if victim is not None or restore:
+                    # The slot had no request in flight, so its guard is free
+                    await lease.state.guard.acquire()
+
+        if victim is None and not restore:
+            try:
+                # Wait for a save or restore of the slot that is still running
+                async with lease.state.guard:
+                    pass
+            except BaseException:
+                lease.release()
+                raise
+            return lease
+
+        try:
+            if victim is not None and await self._slot_action(lease.base_url, lease.id_slot, "save", victim):
+                self._count("slot_saves")
+                if victim not in self.conversations:
+                    self._remember_saved(victim, lease.base_url)
+
+            if restore:
+                if await self._slot_action(lease.base_url, lease.id_slot, "restore", key):
+                    self._count("slot_restores")
+                self._forget_saved(key)
+        except BaseException:
+            lease.release()
+            raise
+        finally:
+            lease.state.guard.release()
+        return lease
+
+    def status(self):
+        """
+        Occupied slots per endpoint, e.g. for /llmstatus.
+        """
+        output = {}
+        for (base_url, _), state in self.slots.items():
+            total, owned = output.get(base_url, (0, 0))
+            output[base_url] = (total + 1, owned + (1 if state.owner is not None else 0))
+        return output
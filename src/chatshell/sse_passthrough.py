@@ -0,0 +1,116 @@
+import json
+import time
+import uuid
+
+
+DONE_MARKER = b"data: [DONE]"
+
+
+def build_sse_event(data: dict) -> bytes:
+    return b"data: " + json.dumps(data, separators=(",", ":")).encode("utf-8") + b"\n\n"
+
+
+def build_sources_event(sources: list, model="generic") -> bytes:
+    """
+    Final chunk in OpenAI streaming format that lists the RAG sources.
+    """
+    sources_text = "\n\n---\nSources:\n" + "\n".join(sources)
+    return build_sse_event({
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"content": sources_text},
+                "finish_reason": "stop"
+            }
+        ]
+    })
+
+
+async def passthrough_stream(upstream_response, inject_event: bytes = None):
+    """
+    Forward the SSE byte stream of an upstream streaming response unchanged.
+
+    Chunks are neither parsed nor re-serialized. If inject_event is given, it is
+    inserted right before the terminating "data: [DONE]" event (or at the end
+    of the stream if the upstream sends no such marker).
+    """
+    if inject_event is None:
+        async for data in upstream_response.aiter_bytes():
+            yield data
+        return
+
+    # Keep back a tail that may contain the beginning of a marker split over two reads
+    keep = len(DONE_MARKER) - 1
+    pending = b""
+    injected = False
+
+    async for data in upstream_response.aiter_bytes():
+        if injected:
+            yield data
+            continue
+
+        pending += data
+        marker_pos = pending.find(DONE_MARKER)
+
+        if marker_pos != -1:
+            yield pending[:marker_pos] + inject_event + pending[marker_pos:]
+            pending = b""
+            injected = True
+
+        elif len(pending) > keep:
+            yield pending[:-keep]
+            pending = pending[-keep:]
+
+    if not injected:
+        if pending and not pending.endswith(b"\n"):
+            pending += b"\n\n"
+        yield pending + inject_event
+
+
+TIMINGS_KEY = b'"timings":'
+
+
+class TimingsSniffer:
+    """
+    Picks the llama-server "timings" object (prompt_n, cache_n, ...) out of a
+    forwarded SSE byte stream. Only the bytes after the key are decoded, all other
+    events are left untouched.
+    """
+
+    def __init__(self, max_bytes=65536):
+        self.max_bytes  = max_bytes
+        self.tail       = b""
+        self.pending    = None
+        self.timings    = None
+        self.decoder    = json.JSONDecoder()
+
+    def feed(self, data: bytes):
+        if self.timings is not None:
+            return
+
+        if self.pending is None:
+            buffer = self.tail + data
+            key_pos = buffer.find(TIMINGS_KEY)
+            if key_pos == -1:
+                # Keep back a tail that may contain the beginning of a key split over two reads
+                self.tail = buffer[-(len(TIMINGS_KEY) - 1):]
+                return
+            self.pending = buffer[key_pos + len(TIMINGS_KEY):]
+        else:
+            self.pending += data
+
+        try:
+            timings, _ = self.decoder.raw_decode(self.pending.decode("utf-8").lstrip())
+        except ValueError:
+            # Object not complete yet, wait for the next read
+            if len(self.pending) > self.max_bytes:
+                self.pending = None
+                self.tail = b""
+            return
+
+        self.timings = timings if isinstance(timings, dict) else {}
+        self.pending = None
@@ -0,0 +1,166 @@
+import contextvars
+import cProfile
+import pstats
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# Trace of the request that is currently processed (per asyncio task / thread context)
+_current_trace = contextvars.ContextVar("chatshell_current_trace", default=None)
+
+
+class RequestTrace:
+    """
+    Collects the timings of the processing stages (spans) of a single proxy request.
+    Optionally captures a cProfile profile of the request and writes it to disk.
+    The profile covers the event loop while the request is active and the work
+    of the request that runs in worker threads through run_traced().
+    """
+
+    def __init__(self, name, profile_dir=None, enable_profile=False):
+        self.trace_id       = uuid.uuid4().hex[:16]
+        self.name           = name
+        self.start_time     = time.perf_counter()
+        self.spans          = []
+        self.finished       = False
+        self.deferred       = False
+
+        self.profile_dir    = Path(profile_dir) if profile_dir is not None else None
+        self.profile_path   = None
+        self.profiler       = None
+        # Profiles of the worker thread calls of the request, merged on finish
+        self.thread_profiles = []
+
+        if enable_profile and self.profile_dir is not None:
+            self.start_profile()
+
+    def start_profile(self):
+        # Note: covers everything running on the event loop while the request is active,
+        # worker threads only through profile_call()
+        try:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        except ValueError as e:
+            # Another profiler is already active (e.g. concurrent profiled request)
+            print(f"--> Request profiling not possible: {e}")
+            self.profiler = None
+
+    def profile_call(self, func, *args, **kwargs):
+        """
+        Run func in the current (worker) thread with its own profiler, which is
+        merged into the request profile.
+        """
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler, which already sees all threads
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            self.thread_profiles.append(profiler)
+
+    def add_span(self, name, duration_ms):
+        self.spans.append((name, duration_ms))
+
+    @contextmanager
+    def span(self, name):
+        t_start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_span(name, (time.perf_counter() - t_start) * 1000.0)
+
+    def defer(self):
+        """
+        Mark the trace as finished by somebody else (e.g. at the end of a streamed response).
+        """
+        self.deferred = True
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start_time) * 1000.0
+
+    def span_totals(self):
+        # Sum up spans with the same name (e.g. multiple embedding calls) in order of first occurrence
+        totals = {}
+        for name, duration_ms in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration_ms
+        return totals
+
+    def server_timing_header(self):
+        entries = [f"{name};dur={duration_ms:.2f}" for name, duration_ms in self.span_totals().items()]
+        entries.append(f"total;dur={self.elapsed_ms():.2f}")
+        return ", ".join(entries)
+
+    def attach_headers(self, response):
+        try:
+            response.headers["Server-Timing"]           = self.server_timing_header()
+            response.headers["X-Chatshell-Trace-Id"]    = self.trace_id
+        except Exception as e:
+            print(f"--> Failed to attach trace headers: {e}")
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            try:
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                self.profile_path = self.profile_dir / f"{time.strftime('%Y%m%d-%H%M%S')}_{self.trace_id}.prof"
+                stats = pstats.Stats(self.profiler)
+                for profiler in self.thread_profiles:
+                    stats.add(profiler)
+                stats.dump_stats(str(self.profile_path))
+            except Exception as e:
+                print(f"--> Failed to write request profile: {e}")
+                self.profile_path = None
+            self.profiler = None
+            self.thread_profiles = []
+
+        stages = " ".join(f"{name}={duration_ms:.1f}ms" for name, duration_ms in self.span_totals().items())
+        print(f"--> Trace {self.trace_id} {self.name}: {stages} total={self.elapsed_ms():.1f}ms")
+
+        if self.profile_path is not None:
+            print(f"--> Request profile written to {self.profile_path}")
+
+
+def get_current_trace():
+    return _current_trace.get()
+
+
+def set_current_trace(trace):
+    """
+    Make the given trace the current trace, so that trace_span() calls record into it.
+    """
+    _current_trace.set(trace)
+
+
+def run_traced(func, *args, **kwargs):
+    """
+    Run func, profiled into the current request trace if it is profiled.
+    For blocking work that runs in worker threads with the context of the request.
+    """
+    trace = _current_trace.get()
+    if trace is None or trace.profiler is None:
+        return func(*args, **kwargs)
+    return trace.profile_call(func, *args, **kwargs)
+
+
+@contextmanager
+def trace_span(name):
+    """
+    Record a span into the current request trace. Does nothing if no trace is active.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    with trace.span(name):
+        yield trace
@@ -1,17 +1,17 @@
 import requests
-from bs4 import BeautifulSoup
-from markdownify import markdownify as md
 from urllib.parse import urljoin, urlparse
 
+from .html_extract import page_links, parse_html, tree_main_content
+from .tracing import trace_span
+
 
 def crawl_website(url: str, timeout: int, max_depth: int = 1):
     """
     Recursively crawl a website starting from `url` up to `max_depth` link depth.
-    Returns a list of (markdown_content, url) tuples for all visited pages.
+    Returns a list of (content, url) tuples for all visited pages, the content
+    is the main text of a page with its paragraphs and lines.
     """
 
-    DEFAULT_TARGET_CONTENT = ['article', 'div', 'main', 'p']
-    strip_elements = ['a']
     visited = set()
     results = []
 
@@ -29,39 +29,21 @@ def crawl_website(url: str, timeout: int, max_depth: int = 1):
         content_type = response.headers.get('Content-Type', '')
 
         if 'text/html' in content_type:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for script in soup(['script', 'style']):
-                script.decompose()
-
-            max_text_length = 0
-            main_content = ""
-            for tag in soup.find_all(DEFAULT_TARGET_CONTENT):
-                text_length = len(tag.get_text())
-                if text_length > max_text_length:
-                    max_text_length = text_length
-                    main_content = tag
-
-            content = str(main_content)
-            if len(content) == 0:
-                return
-
-            output = md(
-                content,
-                keep_inline_images_in=['td', 'th', 'a', 'figure'],
-                strip=strip_elements
-            )
+            with trace_span("html_extraction"):
+                root = parse_html(response.text)
+                if root is None:
+                    return
+                # Links of the whole page, before the main content is selected
+                hrefs = page_links(root) if depth < max_depth else []
+                output = tree_main_content(root)
 
-            output = output.replace('\n','')
-            output = output.replace('\t','')
-            output = output.strip()
             if output:
                 results.append((output, current_url))
 
             # Recursively crawl links if depth < max_depth
             if depth < max_depth:
                 links = set()
-                for a in soup.find_all('a', href=True):
-                    href = a['href']
+                for href in hrefs:
                     # Only follow http(s) links, resolve relative URLs
                     joined = urljoin(current_url, href)
                     parsed = urlparse(joined)
@@ -73,16 +55,8 @@ def crawl_website(url: str, timeout: int, max_depth: int = 1):
                     _crawl(link, depth + 1)
 
         elif 'text/plain' in content_type:
-            if len(response.text) == 0:
-                return
-            output = md(
-                response.text,
-                keep_inline_images_in=['td', 'th', 'a', 'figure'],
-                strip=strip_elements
-            )
-            output = output.replace('\n','')
-            output = output.replace('\t','')
-            output = output.strip()
+            # Line breaks stay, the chunker splits at them
+            output = response.text.strip()
             if output:
                 results.append((output, current_url))
 
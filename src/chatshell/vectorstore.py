@@ -1,34 +1,50 @@
+import hashlib
+import itertools
+import json
 import hnswlib
-from PyPDF2 import PdfReader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 import os
+from pathlib import Path
 import nltk
 nltk.download('punkt_tab')
 nltk.download('punkt')
 from nltk.tokenize import sent_tokenize
 import networkx as nx
 import numpy as np
-from light_embed import TextEmbedding
 from .utils_rag import crawl_website
+from .tracing import trace_span
+from .shared_index import BRUTE_FORCE_MAX_CHUNKS, MatrixIndex
+from .chunk_store import ChunkStore
+from .pdf_extract import PdfExtractor
+from .chunker import DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS, Chunker, TokenCounter
+from .dedup import Deduplicator
+from .embeddings import create_embedding_backend
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+# Corpus versions are unique across all vectorsearch instances of a process
+CORPUS_VERSIONS = itertools.count(1)
+
 
 class ChatshellVectorsearch:
-    def __init__(self):
+    def __init__(self, embedding_model=None, pdf_extractor=None, chunker=None, chunk_tokens=DEFAULT_CHUNK_TOKENS, chunk_overlap_tokens=DEFAULT_OVERLAP_TOKENS, dedup=True):
 
         # Load and initialize embedding model
-        self.chunks = []
-        self.chunk_metadata = []
+        self.chunk_store = ChunkStore()
         self.context_list = []
-
-        self.text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=500,
-                chunk_overlap=50,
-                separators=["\n\n", "\n", ".", " ", ""]
-            )
+        # Changes whenever a new corpus is indexed
+        self.corpus_version = 0
+        # Labels of chunks removed from the index (incremental updates)
+        self.deleted_labels = set()
         
-        self.embedding_model = TextEmbedding('sentence-transformers/all-MiniLM-L6-v2')
+        # An instance can share the (large) embedding model of another one
+        self.embedding_model = embedding_model or create_embedding_backend()
+        self.pdf_extractor = pdf_extractor or PdfExtractor()
+
+        # Chunks are sized in tokens of the embedding model
+        self.chunker = chunker or Chunker(TokenCounter.for_model(self.embedding_model), chunk_tokens, chunk_overlap_tokens)
+
+        # Duplicate pages and chunks of crawls are dropped before encoding
+        self.dedup = dedup
 
     def reset_context(self):
         self.context_list = []
@@ -46,29 +62,31 @@ class ChatshellVectorsearch:
     def index_vectorstore(self, input, chunk_metadata=None):
         try:
             # Split
-            self.chunks = self.text_splitter.split_text(input)
-            print(f"-> Number of chunks: {len(self.chunks)}")
+            with trace_span("chunking"):
+                chunks, offsets = self._split(input)
+            print(f"-> Number of chunks: {len(chunks)}")
 
-            # If metadata is provided, use it; else, fill with empty dicts
-            if chunk_metadata is not None:
-                self.chunk_metadata = chunk_metadata
-            else:
-                self.chunk_metadata = [{} for _ in self.chunks]
+            # Metadata per chunk is optional
+            chunk_store = ChunkStore()
+            for i, chunk in enumerate(chunks):
+                meta = chunk_metadata[i] if chunk_metadata is not None and i < len(chunk_metadata) else {}
+                chunk_store.add(chunk, meta.get("source_info"), meta.get("source_position"), offsets[i])
 
             # Create embeddings
             print("-> Creating embeddings...")
-            embeddings = self.embedding_model.encode(self.chunks, normalize_embeddings=True)
+            with trace_span("embedding"):
+                embeddings = self.embedding_model.encode(chunks, normalize_embeddings=True)
             
-            print(f"-> Created embeddings for {len(self.chunks)} chunks.")
+            print(f"-> Created embeddings for {len(chunks)} chunks.")
 
             # Create index
             print("-> Creating vectorstore index...")
-            self.vectorstore = hnswlib.Index(space='cosine', dim=384)
-            self.vectorstore.init_index(max_elements=8000, ef_construction=200, M=48)
-            self.vectorstore.add_items(embeddings)
-
-            # Controlling the recall by setting ef
-            self.vectorstore.set_ef(50)
+            with trace_span("indexing"):
+                self.vectorstore = self.new_index(embeddings.shape[1], max(8000, len(chunks)))
+                self.vectorstore.add_items(embeddings)
+            self.chunk_store = chunk_store
+            self.deleted_labels = set()
+            self.corpus_version = next(CORPUS_VERSIONS)
 
             return True
         
@@ -76,13 +94,21 @@ class ChatshellVectorsearch:
             print(f"Error in index_vectorstore: {e}")
             return False
 
+    def _split(self, text):
+        # Chunks and the character offsets where they start in the text
+        chunks = []
+        offsets = []
+        for chunk, offset, _ in self.chunker.iter_chunks(text):
+            chunks.append(chunk)
+            offsets.append(offset)
+        return chunks, offsets
+
     def init_vectorstore_pdf(self, pdf_paths:list):
         print("-> Creating vectorstore index...")
-        self.vectorstore = hnswlib.Index(space='cosine', dim=384)
-        self.vectorstore.init_index(max_elements=10000, ef_construction=200, M=48)
+        self.vectorstore = self.new_index(self.embedding_model.dim, 10000)
 
-        self.chunks = []
-        self.chunk_metadata = []
+        self.chunk_store = ChunkStore()
+        self.deleted_labels = set()
         
         # Loop through path list
         for doc_path in pdf_paths:
@@ -90,20 +116,17 @@ class ChatshellVectorsearch:
             print(f"-> Reading PDF file {doc_path}...")
 
             try:
-                reader = PdfReader(doc_path)
-
                 all_chunks = []
-                all_metadata = []
-                for page_num, page in enumerate(reader.pages):
-                    text = page.extract_text()
+                all_pages = []
+                all_offsets = []
+                for page_num, text in enumerate(self.pdf_extractor.page_texts(doc_path)):
                     if text:
                         # Split each page into chunks
-                        page_chunks = self.text_splitter.split_text(text)
+                        with trace_span("chunking"):
+                            page_chunks, page_offsets = self._split(text)
                         all_chunks.extend(page_chunks)
-                        all_metadata.extend([
-                            {"source_info": os.path.basename(doc_path), "source_position": page_num}
-                            for _ in page_chunks
-                        ])
+                        all_pages.extend([page_num] * len(page_chunks))
+                        all_offsets.extend(page_offsets)
 
                 print("-> Number of chunks:", len(all_chunks))
 
@@ -111,59 +134,66 @@ class ChatshellVectorsearch:
                     print("-> No text extracted from PDF.")
                     return False
 
-                # Store chunks and metadata, and index
-                self.chunks += all_chunks
-                self.chunk_metadata += all_metadata
-
                 # Create embeddings and index
                 print(f"-> Creating embeddings for document {doc_path} ...")
-                embeddings = self.embedding_model.encode(all_chunks, normalize_embeddings=True)
+                with trace_span("embedding"):
+                    embeddings = self.embedding_model.encode(all_chunks, normalize_embeddings=True)
                 print(f"-> Created embeddings for {len(all_chunks)} chunks.")
 
-                self.vectorstore.add_items(embeddings)
+                # Index labels are the chunk indices of the store
+                source_info = os.path.basename(doc_path)
+                labels = [self.chunk_store.add(chunk, source_info, page_num, offset) for chunk, page_num, offset in zip(all_chunks, all_pages, all_offsets)]
+                with trace_span("indexing"):
+                    self.vectorstore.add_items(embeddings, labels)
 
             except Exception as e:
                 print(f"--> Error while reading PDF: {e}")
                 continue
 
         self.vectorstore.set_ef(50)
+        self.corpus_version = next(CORPUS_VERSIONS)
 
         print("-> Vectorstore ready.")
         return True
     
     def init_vectorstore_str(self, clipboard_string):
         print("-> Creating vectorstore index...")
-        self.vectorstore = hnswlib.Index(space='cosine', dim=384)
-        self.vectorstore.init_index(max_elements=10000, ef_construction=200, M=48)
+        self.vectorstore = self.new_index(self.embedding_model.dim, 10000)
 
-        self.chunks = []
-        self.chunk_metadata = []
+        self.chunk_store = ChunkStore()
+        self.deleted_labels = set()
         
         try:
             # Chunking clipboard string
+            clipboard_chunks = []
+            clipboard_offsets = []
             if clipboard_string:
                 # Split each page into chunks
-                clipboard_chunks = self.text_splitter.split_text(clipboard_string)
-                self.chunks += clipboard_chunks
+                with trace_span("chunking"):
+                    clipboard_chunks, clipboard_offsets = self._split(clipboard_string)
 
-            print("-> Number of chunks:", len(self.chunks))
+            print("-> Number of chunks:", len(clipboard_chunks))
 
-            if len(self.chunks) == 0:
+            if len(clipboard_chunks) == 0:
                 print("-> No text extracted from clipboard.")
                 return False
 
             # Create embeddings and index
             print(f"-> Creating embeddings for clipboard context ...")
-            embeddings = self.embedding_model.encode(self.chunks, normalize_embeddings=True)
-            print(f"-> Created embeddings for {len(self.chunks)} chunks.")
+            with trace_span("embedding"):
+                embeddings = self.embedding_model.encode(clipboard_chunks, normalize_embeddings=True)
+            print(f"-> Created embeddings for {len(clipboard_chunks)} chunks.")
 
-            self.vectorstore.add_items(embeddings)
+            labels = [self.chunk_store.add(chunk, char_offset=offset) for chunk, offset in zip(clipboard_chunks, clipboard_offsets)]
+            with trace_span("indexing"):
+                self.vectorstore.add_items(embeddings, labels)
 
         except Exception as e:
             print(f"--> Error while creating vectorstore from clipboard: {e}")
             return False
 
         self.vectorstore.set_ef(50)
+        self.corpus_version = next(CORPUS_VERSIONS)
 
         print("-> Vectorstore ready.")
         return True
@@ -171,11 +201,13 @@ class ChatshellVectorsearch:
     def init_vectorstore_web(self, urls:list, deep=False):
         # Init vectorstore
         print("-> Creating vectorstore index...")
-        self.vectorstore = hnswlib.Index(space='cosine', dim=384)
-        self.vectorstore.init_index(max_elements=10000, ef_construction=200, M=48)
+        self.vectorstore = self.new_index(self.embedding_model.dim, 10000)
+
+        self.chunk_store = ChunkStore()
+        self.deleted_labels = set()
 
-        self.chunks = []
-        self.chunk_metadata = []
+        # Pages and chunks are deduplicated across all crawled URLs
+        deduplicator = Deduplicator() if self.dedup else None
 
         for url in urls:
 
@@ -187,45 +219,80 @@ class ChatshellVectorsearch:
                 print(f"-> Crawling {url}.")
 
             # Init vectorstore with website content
-            page_contents = crawl_website(url, 5, max_depth=ref_depth)
+            with trace_span("crawling"):
+                page_contents = crawl_website(url, 5, max_depth=ref_depth)
 
             if page_contents is not None and len(page_contents) > 0:
-                all_chunks = []
-                all_metadata = []
-
-                for page_text, page_url in page_contents:
-                    chunks = self.text_splitter.split_text(page_text)
-                    all_chunks.extend(chunks)
-                    all_metadata.extend([
-                        {"source_info": page_url, "source_position": 0}
-                        for _ in chunks
-                    ])
-
-                self.chunks += all_chunks
-                self.chunk_metadata += all_metadata
+                all_chunks, labels = self.add_pages(page_contents, deduplicator)
+                if len(all_chunks) == 0:
+                    print(f"-> Pages of {url} contain no new content, skipped.")
+                    continue
 
                 # Create embeddings and index
                 print(f"-> Creating embeddings for {url}...")
-                embeddings = self.embedding_model.encode(all_chunks, normalize_embeddings=True)
+                with trace_span("embedding"):
+                    embeddings = self.embedding_model.encode(all_chunks, normalize_embeddings=True)
                 print(f"-> Created embeddings for {len(all_chunks)} chunks.")
 
-                self.vectorstore.add_items(embeddings)
+                with trace_span("indexing"):
+                    self.vectorstore.add_items(embeddings, labels)
 
             else:
                 print(f"-> Page {url} contains no data, skipped.")
                 continue
 
+        if deduplicator is not None and (deduplicator.duplicate_pages or deduplicator.duplicate_chunks):
+            print(f"-> Skipped {deduplicator.duplicate_pages} duplicate pages and {deduplicator.duplicate_chunks} duplicate chunks.")
+
         self.vectorstore.set_ef(50)
+        self.corpus_version = next(CORPUS_VERSIONS)
         
         print("-> Vectorstore ready.")
         return True
+
+    def add_pages(self, page_contents, deduplicator=None):
+        """
+        Split (text, url) pages into the chunk store. With a deduplicator,
+        duplicate pages and chunks are not stored again, their URL is added to
+        the sources of the chunks they duplicate. Returns the new chunks and
+        their labels, which still have to be embedded.
+        """
+        new_chunks = []
+        new_labels = []
+        for page_text, page_url in page_contents:
+            page_labels = []
+            if deduplicator is not None:
+                with trace_span("dedup"):
+                    original_labels = deduplicator.check_page(page_text, page_labels)
+                if original_labels is not None:
+                    for label in original_labels:
+                        self.chunk_store.add_source(label, page_url)
+                    continue
+
+            with trace_span("chunking"):
+                chunks, offsets = self._split(page_text)
+
+            with trace_span("dedup"):
+                for chunk, offset in zip(chunks, offsets):
+                    label = len(self.chunk_store)
+                    original = deduplicator.check_chunk(chunk, label) if deduplicator is not None else None
+                    if original is None:
+                        self.chunk_store.add(chunk, page_url, 0, offset)
+                        new_chunks.append(chunk)
+                        new_labels.append(label)
+                    else:
+                        self.chunk_store.add_source(original, page_url)
+                        label = original
+                    page_labels.append(label)
+        return new_chunks, new_labels
     
     def generate_text_summary(self, text: list):
 
         # Split into sentences
         sentences = []
-        for s in text:
-            sentences.extend(sent_tokenize(s))
+        with trace_span("sentence_split"):
+            for s in text:
+                sentences.extend(sent_tokenize(s))
 
         # Remove empty sentences or whitespace-only sentences
         sentences = [s.strip() for s in sentences if s.strip()]
@@ -235,10 +302,11 @@ class ChatshellVectorsearch:
 
         # --- Encode sentences using transformer model ---
 
-        sentence_vectors = self.embedding_model.encode(
-            sentences,
-            normalize_embeddings=True  # Unit-length vectors -> use of fast dot-product instead of cosine-similarity
-        )
+        with trace_span("embedding"):
+            sentence_vectors = self.embedding_model.encode(
+                sentences,
+                normalize_embeddings=True  # Unit-length vectors -> use of fast dot-product instead of cosine-similarity
+            )
 
         # Build similarity matrix (FAST)
         sim_mat = np.dot(sentence_vectors, sentence_vectors.T)
@@ -247,9 +315,10 @@ class ChatshellVectorsearch:
         np.fill_diagonal(sim_mat, 0)
 
         # Build graph and compute PageRank
-        nx_graph = nx.from_numpy_array(sim_mat)
-        print("-> Running pagerank algorithm")
-        scores = nx.pagerank(nx_graph)
+        with trace_span("pagerank"):
+            nx_graph = nx.from_numpy_array(sim_mat)
+            print("-> Running pagerank algorithm")
+            scores = nx.pagerank(nx_graph)
 
         # Rank sentences
         ranked_sentences = sorted(
@@ -266,25 +335,274 @@ class ChatshellVectorsearch:
 
         return summary_context
     
-    def search_knn(self, prompt, num_chunks=4) -> list:
-        new_embedding = self.embedding_model.encode([prompt], normalize_embeddings=True)
+    def new_staging(self):
+        """
+        Empty vectorsearch with the same models. Documents are indexed into it
+        while searches continue on this one, see swap_in.
+        """
+        return ChatshellVectorsearch(embedding_model=self.embedding_model, pdf_extractor=self.pdf_extractor, chunker=self.chunker, dedup=self.dedup)
+
+    def swap_in(self, staging):
+        """
+        Replace index and chunk store with the ones built in staging.
+        """
+        self.vectorstore    = staging.vectorstore
+        self.chunk_store    = staging.chunk_store
+        self.deleted_labels = staging.deleted_labels
+        self.corpus_version = staging.corpus_version
+
+    def append(self, staging):
+        """
+        Add the chunks built in staging to this index (created if there is none),
+        their labels follow the existing ones. Returns the range of the new labels.
+        """
+        live = [label for label in range(len(staging.chunk_store)) if label not in staging.deleted_labels]
+        if not live:
+            return range(len(self.chunk_store), len(self.chunk_store))
+        embeddings = np.asarray(staging.vectorstore.get_items(live), dtype=np.float32)
+
+        if not self.has_index():
+            self.vectorstore = self.new_index(embeddings.shape[1], max(10000, 2 * len(live)))
+            self.chunk_store = ChunkStore()
+            self.deleted_labels = set()
+        elif isinstance(self.vectorstore, MatrixIndex):
+            # The mapped matrix is read-only, continue with a hnswlib graph of its rows
+            count = self.vectorstore.get_current_count()
+            vectorstore = self.new_index(embeddings.shape[1], max(10000, 2 * (count + len(live))))
+            if count > 0:
+                with trace_span("indexing"):
+                    vectorstore.add_items(np.asarray(self.vectorstore.embeddings, dtype=np.float32), list(range(count)))
+            for label in self.deleted_labels:
+                vectorstore.mark_deleted(label)
+            self.vectorstore = vectorstore
+
+        required = len(self.chunk_store) + len(live)
+        if required > self.vectorstore.get_max_elements():
+            self.vectorstore.resize_index(max(required, 2 * self.vectorstore.get_max_elements()))
+
+        start = len(self.chunk_store)
+        for label in live:
+            new_label = self.chunk_store.add(
+                staging.chunk_store.text(label),
+                staging.chunk_store.source_info(label),
+                staging.chunk_store.source_position(label),
+                staging.chunk_store.char_offset(label)
+            )
+            for source_info in staging.chunk_store.all_sources(label)[1:]:
+                self.chunk_store.add_source(new_label, source_info)
+        labels = range(start, len(self.chunk_store))
+        with trace_span("indexing"):
+            self.vectorstore.add_items(embeddings, list(labels))
+        self.corpus_version = next(CORPUS_VERSIONS)
+        return labels
+
+    def has_index(self):
+        return getattr(self, "vectorstore", None) is not None
+
+    def live_count(self):
+        # Number of searchable chunks
+        if not self.has_index():
+            return 0
+        return self.vectorstore.get_current_count() - len(self.deleted_labels)
+
+    def memory_bytes(self):
+        # Approximate memory of index and chunk store
+        if not self.has_index():
+            return 0
+        if isinstance(self.vectorstore, MatrixIndex):
+            index_bytes = self.vectorstore.embeddings.nbytes
+        else:
+            index_bytes = self.vectorstore.index_file_size()
+        return index_bytes + self.chunk_store.nbytes()
+
+    def embed_chunks(self, chunks):
+        with trace_span("embedding"):
+            return self.embedding_model.encode(chunks, normalize_embeddings=True)
+
+    @staticmethod
+    def new_index(dim, max_elements):
+        vectorstore = hnswlib.Index(space='cosine', dim=dim)
+        vectorstore.init_index(max_elements=max_elements, ef_construction=200, M=48)
+        vectorstore.set_ef(50)
+        return vectorstore
+
+    def add_chunks(self, chunks, embeddings, source_info=None, source_positions=None, char_offsets=None):
+        """
+        Add embedded chunks to the current index (created if there is none),
+        returns the range of their labels.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not self.has_index():
+            self.vectorstore = self.new_index(embeddings.shape[1], max(10000, 2 * len(chunks)))
+            self.chunk_store = ChunkStore()
+            self.deleted_labels = set()
+
+        required = len(self.chunk_store) + len(chunks)
+        if required > self.vectorstore.get_max_elements():
+            self.vectorstore.resize_index(max(required, 2 * self.vectorstore.get_max_elements()))
+
+        start = len(self.chunk_store)
+        for i, chunk in enumerate(chunks):
+            self.chunk_store.add(
+                chunk,
+                source_info,
+                source_positions[i] if source_positions is not None else None,
+                char_offsets[i] if char_offsets is not None else None
+            )
+        labels = range(start, len(self.chunk_store))
+        with trace_span("indexing"):
+            self.vectorstore.add_items(embeddings, list(labels))
+        self.corpus_version = next(CORPUS_VERSIONS)
+        return labels
+
+    def remove_chunks(self, labels):
+        """
+        Exclude chunks from the search, they stay in the store until compact.
+        """
+        for label in labels:
+            if label not in self.deleted_labels:
+                self.vectorstore.mark_deleted(label)
+                self.deleted_labels.add(label)
+        self.corpus_version = next(CORPUS_VERSIONS)
+
+    def compact(self):
+        """
+        Rebuild store and index without the removed chunks. Returns the new label
+        of every old label (-1 if removed), the order of the chunks is kept.
+        """
+        mapping = np.full(len(self.chunk_store), -1, dtype=np.int64)
+        live = [label for label in range(len(self.chunk_store)) if label not in self.deleted_labels]
+
+        chunk_store = ChunkStore()
+        for label in live:
+            mapping[label] = chunk_store.add(
+                self.chunk_store.text(label),
+                self.chunk_store.source_info(label),
+                self.chunk_store.source_position(label),
+                self.chunk_store.char_offset(label)
+            )
+            for source_info in self.chunk_store.all_sources(label)[1:]:
+                chunk_store.add_source(mapping[label], source_info)
+
+        vectorstore = self.new_index(self.vectorstore.dim, max(10000, 2 * len(live)))
+        if live:
+            with trace_span("indexing"):
+                vectorstore.add_items(np.asarray(self.vectorstore.get_items(live), dtype=np.float32), mapping[live])
+
+        self.vectorstore = vectorstore
+        self.chunk_store = chunk_store
+        self.deleted_labels = set()
+        self.corpus_version = next(CORPUS_VERSIONS)
+        return mapping
+
+    def save_index(self, path):
+        """
+        Write index, embeddings, chunk texts and metadata to the directory path.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        count = self.vectorstore.get_current_count()
+        if isinstance(self.vectorstore, MatrixIndex):
+            embeddings = np.asarray(self.vectorstore.embeddings, dtype=np.float32)
+        else:
+            # Removed chunks have no vector in hnswlib, their rows stay zero
+            embeddings = np.zeros((count, self.vectorstore.dim), dtype=np.float32)
+            live = [label for label in range(count) if label not in self.deleted_labels]
+            if live:
+                embeddings[live] = self.vectorstore.get_items(live)
+            self.vectorstore.save_index(str(path / "index.bin"))
+        np.save(path / "embeddings.npy", embeddings)
+        np.save(path / "deleted.npy", np.asarray(sorted(self.deleted_labels), dtype=np.int64))
+
+        self.chunk_store.save(path)
+        with open(path / "metadata.json", "w", encoding="utf-8") as f:
+            json.dump({"count": count, "model_id": self.embedding_model.model_id, "dim": int(embeddings.shape[1])}, f)
+
+    def load_index(self, path, mmap=True, writable=False):
+        """
+        Load an index written by save_index. With mmap, embeddings and chunk texts
+        are memory-mapped read-only and shared with other processes mapping them.
+        A writable index is always the hnswlib graph, for add_chunks and remove_chunks.
+        """
+        path = Path(path)
+        with open(path / "metadata.json", "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+
+        deleted_labels = set()
+        if (path / "deleted.npy").exists():
+            deleted_labels = set(np.load(path / "deleted.npy").tolist())
+
+        embeddings = np.load(path / "embeddings.npy", mmap_mode="r" if mmap else None)
+        # Only indexes of the same model and dimension are comparable with the queries
+        model_id = metadata.get("model_id")
+        if model_id is not None and model_id != self.embedding_model.model_id:
+            raise ValueError(f"Index in {path} was embedded with {model_id}, not {self.embedding_model.model_id}")
+        if embeddings.shape[1] != self.embedding_model.dim:
+            raise ValueError(f"Index in {path} has {embeddings.shape[1]} dimensions, the embedding model {self.embedding_model.dim}")
+        if (writable or embeddings.shape[0] > BRUTE_FORCE_MAX_CHUNKS) and (path / "index.bin").exists():
+            vectorstore = hnswlib.Index(space='cosine', dim=embeddings.shape[1])
+            # Deleted marks are part of the saved graph
+            vectorstore.load_index(str(path / "index.bin"), max_elements=max(10000, 2 * embeddings.shape[0]) if writable else embeddings.shape[0])
+            vectorstore.set_ef(50)
+        else:
+            # Exact search on the mapped matrix, no per-process copy of the vectors
+            deleted = None
+            if deleted_labels:
+                deleted = np.zeros(embeddings.shape[0], dtype=bool)
+                deleted[list(deleted_labels)] = True
+            vectorstore = MatrixIndex(embeddings, deleted=deleted)
+
+        chunk_store = ChunkStore.load(path, mmap=mmap)
+        if len(chunk_store) != metadata["count"] or embeddings.shape[0] != metadata["count"]:
+            raise ValueError(f"Index in {path} is incomplete")
+        self.chunk_store = chunk_store
+        self.vectorstore = vectorstore
+        self.deleted_labels = deleted_labels
+        self.corpus_version = next(CORPUS_VERSIONS)
+
+    def embed_query(self, prompt):
+        with trace_span("embed_query"):
+            return self.embedding_model.encode([prompt], normalize_embeddings=True)
+
+    @staticmethod
+    def chunk_id(chunk, meta) -> str:
+        # Content based id, stays the same if a document is indexed again
+        key = f"{meta.get('source_info')}\x00{meta.get('source_position')}\x00{chunk}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    def search_knn(self, prompt, num_chunks=4, query_embedding=None) -> list:
+        if query_embedding is None:
+            new_embedding = self.embed_query(prompt)
+        else:
+            new_embedding = query_embedding
+
+        # hnswlib can not return more neighbors than there are searchable chunks
+        num_chunks = min(num_chunks, self.live_count())
+        if num_chunks <= 0:
+            return []
 
         # Fetch k neighbors
-        chunk_ind, distances = self.vectorstore.knn_query(new_embedding, k=num_chunks)
+        with trace_span("knn_query"):
+            chunk_ind, distances = self.vectorstore.knn_query(new_embedding, k=num_chunks)
 
         # De-Reference chunks and metadata
         results = []
 
-        for i, ind in enumerate(chunk_ind[0]):
-            chunk = self.chunks[ind]
-            meta = self.chunk_metadata[ind] if hasattr(self, "chunk_metadata") and len(self.chunk_metadata) > ind else {}
-            similarity = 1 - distances[0][i]
-            results.append({
-                "chunk": chunk,
-                "source_info": meta.get("source_info", None),
-                "source_position": meta.get("source_position", None),
-                "similarity": similarity
-            })
+        with trace_span("dereference"):
+            for i, ind in enumerate(chunk_ind[0]):
+                chunk = self.chunk_store.text(ind)
+                meta = self.chunk_store.metadata(ind)
+                similarity = 1 - distances[0][i]
+                results.append({
+                    "chunk_id": self.chunk_id(chunk, meta),
+                    "chunk": chunk,
+                    "source_info": meta.get("source_info", None),
+                    "source_position": meta.get("source_position", None),
+                    "char_offset": meta.get("char_offset", None),
+                    "sources": meta.get("sources", []),
+                    "similarity": similarity
+                })
 
         return results
     
\ No newline at end of file